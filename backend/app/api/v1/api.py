@@ -1,5 +1,5 @@
 from fastapi import APIRouter
-from .endpoints import  goal, login, user
+from .endpoints import  chats, goal, jobs, login, user
 
 api_router = APIRouter()
 
@@ -7,3 +7,5 @@ api_router = APIRouter()
 api_router.include_router(login.router, prefix="/login", tags=["Login"])
 api_router.include_router(user.router, prefix="/user", tags=["Users"])
 api_router.include_router(goal.router, prefix="/goal", tags=["Goal"])
+api_router.include_router(chats.router, prefix="/chat", tags=["Chat"])
+api_router.include_router(jobs.router, prefix="/jobs", tags=["Jobs"])
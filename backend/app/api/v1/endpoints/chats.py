@@ -1,102 +1,261 @@
-import os
+import json
 import logging
-import numpy as np
-from openai import OpenAI
-from app.services import user_service
-from app.core.models import FinancialContext, Transaction
-from typing import List
-
-# --- Dependency Imports ---
-# Make sure you have run: pip install faiss-cpu scikit-learn openai
-import faiss 
-from sklearn.preprocessing import normalize
+import time
+from datetime import datetime
+from typing import AsyncIterator, List, Optional, Tuple
+from fastapi import APIRouter, Request
+from fastapi.responses import StreamingResponse
+from app.core import metrics
+from app.core.config import CHAT_MAX_TOKENS, CHAT_MODEL, OPENAI_CHAT_TIMEOUT_SECONDS
+from app.services import ingestion, openai_client, policy_engine, prompt_builder, retrieval, user_service, vector_store, working_set
+from app.services.answer_cache import CachedAnswer, answer_cache
+from app.services.embeddings import embed_texts
+from app.core.models import ChatRequest, ChatResponse, GoalDB, RetrievedTransaction
 
+router = APIRouter()
 logger = logging.getLogger(__name__)
-client = OpenAI()
 
 # --- Core Vectorization and RAG Logic ---
+# Transactions are embedded once, on write, into a persistent per-user FAISS
+# index (see app.services.vector_store). A chat turn only embeds the query.
+
+# Canned replies for turns that never reach the model.
+NO_DATA_REPLY = "I can't seem to find any transaction data to analyze. Please upload a CSV first."
+ANALYSIS_FAILED_REPLY = "I had trouble analyzing your transactions. Please try again."
+LLM_FAILED_REPLY = "I'm having trouble connecting to my AI brain right now."
+
+CHAT_TURNS = metrics.Counter("finchat_chat_turns_total", "Chat turns by how they were answered.", ["outcome"])
+TIME_TO_FIRST_TOKEN = metrics.Histogram("finchat_chat_time_to_first_token_seconds",
+                                        "Time from a streamed chat request to its first token.")
 
-def create_vector_index(transactions: List[Transaction]):
+
+async def _prepare_chat(clerk_id: str, user_message: str) -> Tuple[Optional[str], List[RetrievedTransaction], List[dict]]:
     """
-    Creates a FAISS index from a list of transaction descriptions.
-    This is the "vectorizing the database" step.
+    Runs retrieval for one chat turn.
+    Returns (canned reply, sources, messages): when the canned reply is set the turn
+    should be answered with it directly, otherwise `messages` is ready for the model.
     """
-    if not transactions:
-        return None, None
+    # 1. RETRIEVE: the user's data from the in-process working set (columnar, cached).
+    with metrics.span("chat.working_set"):
+        ws = await working_set.get_working_set(clerk_id)
+    if not ws or ws.columns.size == 0:
+        return NO_DATA_REPLY, [], []
+
+    # 2. INDEX: Rows are indexed as they are written. History that predates the
+    # index is embedded by a backfill job; until it catches up the turn is
+    # answered from lexical scores, so a chat turn only ever embeds its query.
+    semantic_search = True
+    try:
+        if (await vector_store.get_user_index(clerk_id)).ntotal < ws.columns.size:
+            semantic_search = False
+            await ingestion.request_index_backfill(clerk_id)
+    except Exception as e:
+        semantic_search = False
+        logger.error(f"Vector index check failed for user {clerk_id}: {e}")
+
+    # 3. HYBRID SEARCH: structured filters from the query, then BM25 + vector scores.
+    try:
+        with metrics.span("chat.retrieval"):
+            result = await retrieval.retrieve(clerk_id, user_message, ws, semantic_search=semantic_search)
+    except Exception as e:
+        logger.error(f"Retrieval failed for user {clerk_id}: {e}")
+        return ANALYSIS_FAILED_REPLY, [], []
 
-    descriptions = [t.description for t in transactions]
-    
-    # 1. Create Embeddings using OpenAI's powerful and efficient model
-    response = client.embeddings.create(
-        input=descriptions,
-        model="text-embedding-3-small" # State-of-the-art embedding model
+    # 4. AUGMENT: the most valuable context that fits the prompt token budget.
+    with metrics.span("chat.prompt"):
+        policies = ws.policy_models()
+        policy_spending = policy_engine.evaluate_policies(ws.columns, policies, datetime.utcnow())
+        messages, prompt = prompt_builder.build_messages(
+            user_message, result, policies, policy_spending, [GoalDB(**g) for g in ws.goals]
+        )
+    logger.debug(f"Chat prompt for user {clerk_id}: {prompt}")
+    return None, result.transactions, messages
+
+
+async def _create_completion(messages: List[dict], stream: bool = False):
+    # Streams report usage in a final chunk with no choices.
+    extra = {"stream_options": {"include_usage": True}} if stream else {}
+    return await openai_client.get_client().chat.completions.create(
+        model=CHAT_MODEL,
+        messages=messages,
+        temperature=0.5,
+        max_tokens=CHAT_MAX_TOKENS,
+        timeout=OPENAI_CHAT_TIMEOUT_SECONDS,
+        stream=stream,
+        **extra,
     )
-    embeddings = np.array([item.embedding for item in response.data])
-    
-    # 2. Normalize embeddings for accurate similarity search
-    faiss.normalize_L2(embeddings)
-    
-    # 3. Build the FAISS index
-    index = faiss.IndexFlatIP(embeddings.shape[1]) # Using Inner Product for similarity
-    index.add(embeddings)
-    
-    return index, descriptions
+
+
+def _record_usage(usage) -> None:
+    if usage is not None:
+        openai_client.LLM_TOKENS.inc(usage.prompt_tokens, model=CHAT_MODEL, kind="prompt")
+        openai_client.LLM_TOKENS.inc(usage.completion_tokens, model=CHAT_MODEL, kind="completion")
+
+
+async def _lookup_cached_answer(clerk_id: str, user_message: str) -> Tuple[Optional[CachedAnswer], Optional[tuple]]:
+    """
+    Checks the semantic answer cache before any retrieval or generation.
+    Returns (cached answer or None, cache key to store the fresh answer under).
+    The key is None when caching is unavailable for this turn.
+    """
+    try:
+        data_version = await user_service.get_data_version(clerk_id)
+        if data_version is None:
+            return None, None
+        # Retrieval embeds the same query again, which the embedding cache serves from memory.
+        with metrics.span("chat.embed_query"):
+            query_vector = (await embed_texts([user_message]))[0]
+    except Exception as e:
+        logger.warning(f"Answer cache unavailable for user {clerk_id}: {e}")
+        return None, None
+    filters_key = retrieval.parse_query(user_message).model_dump_json(exclude={"terms"})
+    cache_key = (query_vector, filters_key, data_version)
+    return answer_cache.lookup(clerk_id, *cache_key), cache_key
+
 
 async def generate_chat_response(clerk_id: str, user_message: str) -> str:
     """
     This is the new, vectorized RAG function.
     """
     logger.info(f"Generating vectorized AI response for user {clerk_id}")
+    started = time.perf_counter()
+    cached, cache_key = await _lookup_cached_answer(clerk_id, user_message)
+    if cached is not None:
+        logger.info(f"Answer cache hit for user {clerk_id}")
+        CHAT_TURNS.inc(outcome="cached")
+        return cached.answer
 
-    # 1. RETRIEVE (unchanged): Get the user's real-time financial data.
-    context = await user_service.get_user_financial_context(clerk_id)
-    if not context or not context.transactions:
-        return "I can't seem to find any transaction data to analyze. Please upload a CSV first."
-
-    # 2. VECTORIZE & INDEX: Create the in-memory vector database.
-    vector_index, transaction_descriptions = create_vector_index(context.transactions)
-    if not vector_index:
-        return "I had trouble analyzing your transactions. Please try again."
-
-    # 3. SEMANTIC SEARCH: Find transactions relevant to the user's query.
-    # Convert the user's question into a vector
-    query_response = client.embeddings.create(input=[user_message], model="text-embedding-3-small")
-    query_vector = np.array([query_response.data[0].embedding])
-    faiss.normalize_L2(query_vector)
-
-    # Search the index for the top 3 most similar transactions
-    k = 3
-    distances, indices = vector_index.search(query_vector, k)
-    
-    # Retrieve the descriptions of the most relevant transactions
-    relevant_transactions = [transaction_descriptions[i] for i in indices[0]]
-    
-    # 4. AUGMENT & GENERATE: Build the context-rich prompt.
-    system_prompt = f"""
-    You are FinChat, an expert AI financial co-pilot.
-    Your goal is to provide data-driven, insightful advice based on the user's actual spending.
-    
-    When answering the user's question, you MUST base your answer on the following highly relevant transactions that were found in their financial history:
-    - Transaction 1: "{relevant_transactions[0]}"
-    - Transaction 2: "{relevant_transactions[1]}"
-    - Transaction 3: "{relevant_transactions[2]}"
-
-    Use this specific data to provide a concise, helpful, and direct response to the user's message.
-    """
+    reply, sources, messages = await _prepare_chat(clerk_id, user_message)
+    if reply is not None:
+        CHAT_TURNS.inc(outcome="canned")
+        return reply
 
+    # 5. GENERATE
     try:
-        completion = client.chat.completions.create(
-            model="gpt-4-turbo-preview",
-            messages=[
-                {"role": "system", "content": system_prompt},
-                {"role": "user", "content": user_message}
-            ],
-            temperature=0.5,
-            max_tokens=200,
-        )
+        async with openai_client.concurrency_limit():
+            with metrics.span("chat.completion"):
+                completion = await _create_completion(messages)
+        _record_usage(completion.usage)
         response_text = completion.choices[0].message.content
+        if response_text and cache_key is not None:
+            answer_cache.store(clerk_id, *cache_key, response_text, sources, time.perf_counter() - started)
+        CHAT_TURNS.inc(outcome="generated")
         return response_text or "I'm not sure how to respond to that."
     except Exception as e:
         logger.error(f"OpenAI API call failed for user {clerk_id}: {e}")
-        return "I'm having trouble connecting to my AI brain right now."
+        CHAT_TURNS.inc(outcome="failed")
+        return LLM_FAILED_REPLY
+
+
+async def stream_chat_response(clerk_id: str, user_message: str) -> AsyncIterator[Tuple[str, dict]]:
+    """
+    Streaming variant of generate_chat_response. Yields (event, payload) pairs:
+    one "metadata" event with the retrieved sources, a "token" event per content
+    delta as it arrives from the model, then "done" (or "error"). A cached answer
+    is sent as a single token event, with `cached: true` in the metadata.
+
+    If the consumer stops iterating (e.g. the client disconnected), the upstream
+    HTTP stream is closed so OpenAI stops generating.
+    """
+    logger.info(f"Streaming vectorized AI response for user {clerk_id}")
+    started = time.perf_counter()
+    cached, cache_key = await _lookup_cached_answer(clerk_id, user_message)
+    if cached is not None:
+        logger.info(f"Answer cache hit for user {clerk_id}")
+        CHAT_TURNS.inc(outcome="cached")
+        yield "metadata", {"sources": [source.model_dump(mode="json") for source in cached.sources], "cached": True}
+        yield "token", {"text": cached.answer}
+        yield "done", {}
+        return
+
+    reply, sources, messages = await _prepare_chat(clerk_id, user_message)
+    yield "metadata", {"sources": [source.model_dump(mode="json") for source in sources], "cached": False}
+    if reply is not None:
+        CHAT_TURNS.inc(outcome="canned")
+        yield "token", {"text": reply}
+        yield "done", {}
+        return
+
+    async with openai_client.concurrency_limit():
+        try:
+            stream = await _create_completion(messages, stream=True)
+        except Exception as e:
+            logger.error(f"OpenAI API call failed for user {clerk_id}: {e}")
+            CHAT_TURNS.inc(outcome="failed")
+            yield "error", {"message": LLM_FAILED_REPLY}
+            return
+
+        first_token = True
+        answer = []
+        try:
+            async for chunk in stream:
+                if not chunk.choices:
+                    _record_usage(chunk.usage)
+                    continue
+                text = chunk.choices[0].delta.content
+                if not text:
+                    continue
+                if first_token:
+                    first_token = False
+                    time_to_first_token = time.perf_counter() - started
+                    TIME_TO_FIRST_TOKEN.observe(time_to_first_token)
+                    logger.info(f"Time to first token for user {clerk_id}: {time_to_first_token * 1000:.0f} ms")
+                answer.append(text)
+                yield "token", {"text": text}
+        except Exception as e:
+            logger.error(f"OpenAI stream failed for user {clerk_id}: {e}")
+            CHAT_TURNS.inc(outcome="failed")
+            yield "error", {"message": LLM_FAILED_REPLY}
+            return
+        finally:
+            # Runs on normal completion, errors and cancellation/aclose() alike.
+            await stream.close()
+    if answer and cache_key is not None:
+        answer_cache.store(clerk_id, *cache_key, "".join(answer), sources, time.perf_counter() - started)
+    CHAT_TURNS.inc(outcome="generated")
+    yield "done", {}
+
+
+def _sse_event(event: str, payload: dict) -> str:
+    return f"event: {event}\ndata: {json.dumps(payload)}\n\n"
+
+
+@router.post("/message", response_model=ChatResponse)
+async def chat_message(request: ChatRequest):
+    """ Answers one chat message using the user's own transaction history. """
+    prompt_builder.check_message(request.message)
+    response = await generate_chat_response(request.clerk_id, request.message)
+    return ChatResponse(response=response)
+
+
+@router.post("/stream")
+async def chat_stream(request: ChatRequest, http_request: Request):
+    """
+    Streams the answer as Server-Sent Events: `metadata` (retrieved sources) first,
+    then `token` events as the model produces them, then `done` or `error`.
+    """
+    prompt_builder.check_message(request.message)
+
+    async def event_source():
+        events = stream_chat_response(request.clerk_id, request.message)
+        try:
+            async for event, payload in events:
+                if await http_request.is_disconnected():
+                    logger.info(f"Client disconnected from chat stream for user {request.clerk_id}")
+                    break
+                yield _sse_event(event, payload)
+        finally:
+            # Closing the generator closes the upstream OpenAI stream.
+            await events.aclose()
+
+    return StreamingResponse(
+        event_source(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
 
+@router.get("/cache/stats")
+async def chat_cache_stats():
+    """ Answer cache hit ratio and the generation latency it has saved. """
+    return answer_cache.stats()
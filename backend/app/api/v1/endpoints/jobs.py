@@ -0,0 +1,16 @@
+from fastapi import APIRouter, HTTPException
+import logging
+from app.core.models import JobStatusResponse
+from app.services import jobs
+
+router = APIRouter()
+logger = logging.getLogger(__name__)
+
+
+@router.get("/{job_id}", response_model=JobStatusResponse)
+async def get_job_status(job_id: str):
+    """ Status of a background job: progress counters, ETA while running, and the error if it failed. """
+    job = await jobs.get_job(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found.")
+    return jobs.to_status(job)
@@ -1,108 +1,205 @@
-from fastapi import APIRouter, File, UploadFile, Form, Depends, HTTPException, Query, Header
-from app.services import csv_parser, user_service
-from app.core.database import get_db
-from motor.motor_asyncio import AsyncIOMotorDatabase
-from typing import List
+from fastapi import APIRouter, File, UploadFile, Form, HTTPException, Query, Header, Response
+from app.services import ingestion, jobs, user_service
+from datetime import date
+from typing import List, Literal, Optional, Union
 import logging
-from app.core.models import FinancialContext, PolicyDB, AddPolicyRequest, TransactionDB, UserResponse, AddTransactionRequest, UserDocumentDB, BankAccountDB, UserDocument, UserLoginRequest
+import orjson
+from app.core.models import FinancialContext, AddPolicyRequest, AddTransactionRequest, TransactionPage, TransactionWriteResponse, PolicyWriteResponse, PolicyStatus, SpendingSummary, JobAccepted
 
 router = APIRouter()
 # Initialize logger if not already done
 logger = logging.getLogger(__name__)
 
+# "full" re-reads and returns the whole FinancialContext after a write;
+# "minimal" returns only the written item plus updated aggregates.
+ResponseMode = Literal["full", "minimal"]
+
+# Context responses are serialized by the service straight to JSON bytes and
+# returned as-is, skipping response_model re-validation and jsonable_encoder.
+# response_model is still declared on those routes for the OpenAPI schema.
+_EMPTY_CONTEXT_JSON = orjson.dumps({"goals": [], "policies": [], "transactions": []})
+
+
+def _json_response(content: bytes) -> Response:
+    return Response(content=content, media_type="application/json")
+
 # -----------------------------------------------------------------------------
 # Route 1: Upload Transactions (POST) - Ingestion
 # (Assuming this is the implementation established previously)
 # -----------------------------------------------------------------------------
 
 
-@router.post("/upload", status_code=201)
+def _accepted(job: dict) -> JobAccepted:
+    return JobAccepted(job_id=job["job_id"], kind=job["kind"], status=job["status"],
+                       status_url=f"/api/v1/jobs/{job['job_id']}")
+
+
+@router.post("/upload", status_code=202, response_model=JobAccepted)
 async def upload_user_transactions(
     file: UploadFile = File(...),
     clerk_id: str = Form(...),
+    account: Optional[str] = Form(None),
 ):
     """
-    Accepts a CSV file, parses it, and saves the transactions to the user's document.
+    Accepts a CSV file and queues its import as a background job.
+    Only the header is checked here; parsing, categorization and persistence run in
+    the job workers, chunk by chunk. Poll `status_url` for progress and the final
+    imported/skipped counts. The import is idempotent: rows already imported by an
+    earlier (possibly overlapping) upload are skipped and reported in `rows_skipped`.
     """
     if not file.filename.endswith('.csv') and file.content_type != 'text/csv':
          raise HTTPException(status_code=400, detail="File must be a CSV.")
+    if await user_service.get_data_version(clerk_id) is None:
+        raise HTTPException(status_code=404, detail="User not found.")
 
-    # 1. Parse
-    try:
-        # Assuming csv_parser.parse_csv is the async function defined earlier
-        transactions = await csv_parser.parse_csv(file)
-    except HTTPException as e:
-        raise e
-    except Exception as e:
-        logger.error(f"Unexpected error during CSV parsing: {e}")
-        raise HTTPException(status_code=400, detail="Error processing CSV file.")
+    job = await ingestion.submit_csv_import(clerk_id, file.file, account)
+    return _accepted(job)
 
 
-    if not transactions:
-        raise HTTPException(status_code=400, detail="No valid transactions found.")
-
-    # 2. Persist
-    success = await user_service.add_transactions_to_user(clerk_id, transactions)
+@router.post("/recategorize", status_code=202, response_model=JobAccepted)
+async def recategorize_user_transactions(
+    clerk_id: str = Form(...),
+    all_transactions: bool = Query(False, alias="all", description="Recategorize every transaction, not only uncategorized ones"),
+):
+    """ Queues a job that runs categorization again over the user's stored transactions. """
+    if await user_service.get_data_version(clerk_id) is None:
+        raise HTTPException(status_code=404, detail="User not found.")
+    job = await jobs.submit(ingestion.RECATEGORIZE, clerk_id, {"all": all_transactions})
+    return _accepted(job)
 
-    if not success:
-         raise HTTPException(status_code=500, detail="Failed to update transactions or user not found.")
 
-    return {
-        "status": "success",
-        "imported_count": len(transactions)
-    }
+@router.post("/reindex", status_code=202, response_model=JobAccepted)
+async def reindex_user_transactions(clerk_id: str = Form(...)):
+    """ Queues a job that embeds any transactions missing from the user's vector index. """
+    if await user_service.get_data_version(clerk_id) is None:
+        raise HTTPException(status_code=404, detail="User not found.")
+    job = await jobs.submit(ingestion.BACKFILL_INDEX, clerk_id)
+    return _accepted(job)
 
 
-@router.post("/policies", response_model=FinancialContext) # <-- Changed in Step 2
+@router.post("/policies", response_model=Union[FinancialContext, PolicyWriteResponse]) # <-- Changed in Step 2
 async def add_policy_to_user(
     policy_data: AddPolicyRequest,
-    clerk_id: str = Header(...)  # <--- Tell FastAPI to get clerk_id from the header
-) -> FinancialContext: # <-- Changed in Step 2
+    clerk_id: str = Header(...),  # <--- Tell FastAPI to get clerk_id from the header
+    response_mode: ResponseMode = Query("full", description="'minimal' returns only the new policy plus totals"),
+):
     """ Adds a new spending policy to the user's document. """
-    success = await user_service.add_policy_to_user(clerk_id, policy_data)
-    if not success:
+    policy = await user_service.add_policy_to_user(clerk_id, policy_data)
+    if not policy:
         raise HTTPException(status_code=404, detail="User not found or failed to add policy.")
 
+    if response_mode == "minimal":
+        return PolicyWriteResponse(policy=policy, aggregates=await user_service.get_user_aggregates(clerk_id))
+
     # Fetch and return the updated context
-    updated_context = await user_service.get_user_financial_context(clerk_id)
+    updated_context = await user_service.get_user_financial_context_json(clerk_id)
     if not updated_context:
          raise HTTPException(status_code=500, detail="Policy added, but failed to retrieve updated context.")
 
-    return updated_context
+    return _json_response(updated_context)
+
+@router.get("/policies", response_model=List[PolicyStatus], status_code=200)
+async def retrieve_policy_statuses(
+    clerk_id: str = Query(..., description="The Clerk User ID"),
+):
+    """ Returns each policy's current-window spending, remaining budget and utilization. """
+    try:
+        return await user_service.get_policy_statuses(clerk_id)
+    except Exception as e:
+        logger.error(f"Error retrieving policy status for {clerk_id}: {e}")
+        raise HTTPException(status_code=500, detail="An internal error occurred while retrieving policy status.")
+
+@router.get("/summary", response_model=SpendingSummary, status_code=200)
+async def retrieve_spending_summary(
+    clerk_id: str = Query(..., description="The Clerk User ID"),
+    start_month: Optional[str] = Query(None, pattern=r"^\d{4}-\d{2}$", description="First month to include (YYYY-MM)"),
+    end_month: Optional[str] = Query(None, pattern=r"^\d{4}-\d{2}$", description="Last month to include (YYYY-MM)"),
+):
+    """ Returns precomputed per-category and per-month totals, income vs. spending and averages. """
+    try:
+        return await user_service.get_spending_summary(clerk_id, start_month, end_month)
+    except Exception as e:
+        logger.error(f"Error retrieving spending summary for {clerk_id}: {e}")
+        raise HTTPException(status_code=500, detail="An internal error occurred while retrieving the spending summary.")
 
 @router.get("/context", response_model=FinancialContext, status_code=200)
 async def retrieve_financial_context(
     clerk_id: str = Query(..., description="The Clerk User ID"),
+    start_date: Optional[date] = Query(None, description="Only include transactions on or after this date"),
+    end_date: Optional[date] = Query(None, description="Only include transactions on or before this date"),
+    category: Optional[List[str]] = Query(None, description="Only include transactions in these categories"),
+    transaction_limit: Optional[int] = Query(None, ge=1, description="Only include the most recent N transactions"),
+    include_transactions: bool = Query(True, description="Set to false to return only goals and policies"),
 ):
     """
-    Retrieves the complete financial context (Goals, Policies, Transactions) for the user.
+    Retrieves the financial context (Goals, Policies, Transactions) for the user.
+    Without filters this is the complete history; use /transactions to page through large histories.
     """
     logger.info(f"Received request for financial context retrieval for {clerk_id}")
 
     try:
-        context = await user_service.get_user_financial_context( clerk_id)
+        context = await user_service.get_user_financial_context_json(
+            clerk_id,
+            start_date=start_date,
+            end_date=end_date,
+            categories=category,
+            transaction_limit=transaction_limit,
+            include_transactions=include_transactions,
+        )
         
-        # The service handles user-not-found by returning an empty context (200 OK).
-        return context
+        # Unknown users get an empty context (200 OK).
+        return _json_response(context or _EMPTY_CONTEXT_JSON)
 
     except Exception as e:
         # Catch unexpected server errors
         logger.error(f"Error retrieving financial context for {clerk_id}: {e}")
         raise HTTPException(status_code=500, detail="An internal error occurred while retrieving financial context.")
+
+
+@router.get("/transactions", response_model=TransactionPage, status_code=200)
+async def list_user_transactions(
+    clerk_id: str = Query(..., description="The Clerk User ID"),
+    start_date: Optional[date] = Query(None, description="Only include transactions on or after this date"),
+    end_date: Optional[date] = Query(None, description="Only include transactions on or before this date"),
+    category: Optional[List[str]] = Query(None, description="Only include transactions in these categories"),
+    cursor: Optional[str] = Query(None, description="The next_cursor of the previous page"),
+    limit: int = Query(100, ge=1, le=1000),
+    fields: Optional[str] = Query(None, description="Comma-separated transaction fields to return, e.g. 'date,amount'"),
+):
+    """ Pages through the user's transactions, newest first. """
+    try:
+        return await user_service.list_transactions(
+            clerk_id,
+            start_date=start_date,
+            end_date=end_date,
+            categories=category,
+            cursor=cursor,
+            limit=limit,
+            fields=[f.strip() for f in fields.split(",") if f.strip()] if fields else None,
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        logger.error(f"Error listing transactions for {clerk_id}: {e}")
+        raise HTTPException(status_code=500, detail="An internal error occurred while listing transactions.")
     
     
-@router.post("/transactions", response_model=FinancialContext)
+@router.post("/transactions", response_model=Union[FinancialContext, TransactionWriteResponse])
 async def add_single_transaction(
     transaction_data: AddTransactionRequest,
     clerk_id: str = Header(...),
+    response_mode: ResponseMode = Query("full", description="'minimal' returns only the new transaction plus totals"),
 ):
-    """ Adds a single transaction and returns the updated user context. """
-    success = await user_service.add_single_transaction(clerk_id, transaction_data)
-    if not success:
+    """ Adds a single transaction and returns the updated user context (or, in minimal mode, just the new row). """
+    transaction = await user_service.add_single_transaction(clerk_id, transaction_data)
+    if not transaction:
         raise HTTPException(status_code=404, detail="User not found or failed to add transaction.")
+
+    if response_mode == "minimal":
+        return TransactionWriteResponse(transaction=transaction, aggregates=await user_service.get_user_aggregates(clerk_id))
         
-    updated_context = await user_service.get_user_financial_context(clerk_id)
+    updated_context = await user_service.get_user_financial_context_json(clerk_id)
     if not updated_context:
         raise HTTPException(status_code=500, detail="Transaction added, but failed to retrieve updated context.")
         
-    return updated_context
+    return _json_response(updated_context)
@@ -0,0 +1,76 @@
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Hashable, Optional
+
+
+class LRUCache:
+    """
+    A small thread-safe, size-bounded LRU map.
+    The least recently used entry is evicted once `maxsize` is exceeded. If `ttl` (seconds)
+    is given, entries also expire that long after they were written. If `weigher` is given,
+    entries are also evicted while the summed weight of all entries exceeds `maxweight`
+    (the most recently written entry is always kept).
+    """
+
+    def __init__(self, maxsize: int, ttl: Optional[float] = None,
+                 weigher: Optional[Callable[[Any], int]] = None, maxweight: Optional[int] = None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.weigher = weigher
+        self.maxweight = maxweight
+        self.weight = 0
+        self._data: "OrderedDict[Hashable, Any]" = OrderedDict()
+        self._expires: Dict[Hashable, float] = {}
+        self._weights: Dict[Hashable, int] = {}
+        self._lock = threading.Lock()
+
+    def _remove(self, key: Hashable) -> Any:
+        self._expires.pop(key, None)
+        self.weight -= self._weights.pop(key, 0)
+        return self._data.pop(key)
+
+    def get(self, key: Hashable, default: Optional[Any] = None) -> Any:
+        with self._lock:
+            if key not in self._data:
+                return default
+            if self.ttl is not None and self._expires[key] < time.monotonic():
+                self._remove(key)
+                return default
+            self._data.move_to_end(key)
+            return self._data[key]
+
+    def put(self, key: Hashable, value: Any) -> None:
+        with self._lock:
+            if key in self._data:
+                self._remove(key)
+            self._data[key] = value
+            if self.ttl is not None:
+                self._expires[key] = time.monotonic() + self.ttl
+            if self.weigher is not None:
+                self._weights[key] = self.weigher(value)
+                self.weight += self._weights[key]
+            while len(self._data) > self.maxsize or (
+                self.maxweight is not None and self.weight > self.maxweight and len(self._data) > 1
+            ):
+                self._remove(next(iter(self._data)))
+
+    def pop(self, key: Hashable, default: Optional[Any] = None) -> Any:
+        with self._lock:
+            if key not in self._data:
+                return default
+            return self._remove(key)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._data.clear()
+            self._expires.clear()
+            self._weights.clear()
+            self.weight = 0
+
+    def __contains__(self, key: Hashable) -> bool:
+        with self._lock:
+            return key in self._data
+
+    def __len__(self) -> int:
+        return len(self._data)
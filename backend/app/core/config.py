@@ -0,0 +1,195 @@
+import os
+from dotenv import load_dotenv
+
+# Load environment variables from a .env file located in your 'backend' directory
+load_dotenv()
+
+# =============================================================================
+# VECTOR SEARCH / EMBEDDINGS
+# =============================================================================
+
+# What embeds transaction descriptions and chat queries (app.services.embeddings):
+# "openai" (EMBEDDING_MODEL over the API) or "local" (hashed n-gram vectors computed
+# on the CPU, no external calls). Each backend gets its own indexes and cache entries.
+EMBEDDING_BACKEND = os.getenv("EMBEDDING_BACKEND", "openai").lower()
+
+# Embedding model used for transaction descriptions and chat queries.
+EMBEDDING_MODEL = os.getenv("EMBEDDING_MODEL", "text-embedding-3-small")
+
+# Local backend (app.services.local_embeddings): output dimensions, hashed n-gram
+# buckets before the projection, and texts per vectorized batch.
+LOCAL_EMBEDDING_DIM = int(os.getenv("LOCAL_EMBEDDING_DIM", "384"))
+LOCAL_EMBEDDING_FEATURES = int(os.getenv("LOCAL_EMBEDDING_FEATURES", str(2 ** 18)))
+LOCAL_EMBEDDING_BATCH_SIZE = int(os.getenv("LOCAL_EMBEDDING_BATCH_SIZE", "4096"))
+
+# Directory where the persistent per-user FAISS indexes are stored.
+VECTOR_INDEX_DIR = os.getenv("VECTOR_INDEX_DIR", "data/vector_indexes")
+
+# Maximum number of descriptions sent to the embeddings API in a single request.
+EMBEDDING_BATCH_SIZE = int(os.getenv("EMBEDDING_BATCH_SIZE", "512"))
+
+# Shared, content-addressed embedding cache (memory LRU + on-disk tier).
+EMBEDDING_CACHE_DIR = os.getenv("EMBEDDING_CACHE_DIR", "data/embedding_cache")
+EMBEDDING_CACHE_MEMORY_SIZE = int(os.getenv("EMBEDDING_CACHE_MEMORY_SIZE", "50000"))
+
+# Per-user index type (app.services.ann_index): "auto" picks by corpus size, or
+# force "flat" (exact), "hnsw" or "ivfpq".
+VECTOR_INDEX_KIND = os.getenv("VECTOR_INDEX_KIND", "auto").lower()
+# Auto: exact flat search below this many vectors, an approximate index above.
+VECTOR_ANN_MIN_ROWS = int(os.getenv("VECTOR_ANN_MIN_ROWS", "20000"))
+# Auto: use HNSW while its estimated size fits this budget, IVF-PQ beyond it.
+VECTOR_INDEX_MAX_BYTES = int(os.getenv("VECTOR_INDEX_MAX_BYTES", str(256 * 1024 * 1024)))
+# Approximate indexes are tuned when built: the cheapest efSearch / nprobe whose
+# recall against exact search reaches the target, measured on the user's own vectors.
+# A setting over the latency target (median ms per query) is logged.
+VECTOR_TARGET_RECALL = float(os.getenv("VECTOR_TARGET_RECALL", "0.95"))
+VECTOR_TARGET_LATENCY_MS = float(os.getenv("VECTOR_TARGET_LATENCY_MS", "10"))
+# HNSW graph degree and build-time search depth.
+VECTOR_HNSW_M = int(os.getenv("VECTOR_HNSW_M", "32"))
+VECTOR_HNSW_EF_CONSTRUCTION = int(os.getenv("VECTOR_HNSW_EF_CONSTRUCTION", "80"))
+# Bytes per vector in an IVF-PQ index (PQ sub-quantizers of 8 bits each).
+VECTOR_PQ_BYTES = int(os.getenv("VECTOR_PQ_BYTES", "64"))
+# New vectors are appended to a per-user log instead of rewriting the index file.
+# The log is folded into a fresh index snapshot once it holds this fraction of the
+# snapshot's rows, and at least VECTOR_LOG_COMPACT_MIN_ROWS.
+VECTOR_LOG_COMPACT_RATIO = float(os.getenv("VECTOR_LOG_COMPACT_RATIO", "0.25"))
+VECTOR_LOG_COMPACT_MIN_ROWS = int(os.getenv("VECTOR_LOG_COMPACT_MIN_ROWS", "2000"))
+# Per-worker bound on loaded per-user indexes (least recently used are dropped and
+# read from disk again when next needed). The most recent one is always kept.
+VECTOR_CACHE_MAX_USERS = int(os.getenv("VECTOR_CACHE_MAX_USERS", "256"))
+VECTOR_CACHE_MAX_BYTES = int(os.getenv("VECTOR_CACHE_MAX_BYTES", str(1024 * 1024 * 1024)))
+
+# =============================================================================
+# CSV INGESTION
+# =============================================================================
+
+# Rows parsed, categorized and persisted per step of a streaming CSV upload.
+CSV_CHUNK_SIZE = int(os.getenv("CSV_CHUNK_SIZE", "5000"))
+# Rows per unordered insert_many when importing transactions.
+IMPORT_BATCH_SIZE = int(os.getenv("IMPORT_BATCH_SIZE", "1000"))
+
+# Where CSV chunks are tokenized and validated: "process" (a pool of worker
+# processes, so large uploads parse on other cores and never block the event
+# loop), "thread" (GIL-bound, but off the loop for the I/O), or "inline".
+CSV_PARSE_MODE = os.getenv("CSV_PARSE_MODE", "process").lower()
+# Parse pool processes; also the number of chunks of one upload parsed ahead.
+CSV_PARSE_WORKERS = int(os.getenv("CSV_PARSE_WORKERS", str(min(4, os.cpu_count() or 1))))
+# Forces one strptime format for every upload's date column. By default the format
+# is detected from a sample and cached per bank layout (the file's column names).
+CSV_DATE_FORMAT = os.getenv("CSV_DATE_FORMAT") or None
+
+# Max distinct (description, category) pairs of a user's rows loaded to warm the local categorizer.
+CATEGORIZER_WARM_LIMIT = int(os.getenv("CATEGORIZER_WARM_LIMIT", "200000"))
+# Users whose learned merchants the local categorizer keeps per worker (least recently used are dropped).
+CATEGORIZER_MAX_USERS = int(os.getenv("CATEGORIZER_MAX_USERS", "1000"))
+
+# LLM categorization: parallel requests per upload, attempts per request, and the
+# cross-upload description -> category memo.
+LLM_MAX_CONCURRENCY = int(os.getenv("LLM_MAX_CONCURRENCY", "8"))
+LLM_MAX_RETRIES = int(os.getenv("LLM_MAX_RETRIES", "3"))
+CATEGORY_MEMO_SIZE = int(os.getenv("CATEGORY_MEMO_SIZE", "50000"))
+CATEGORY_MEMO_TTL_SECONDS = float(os.getenv("CATEGORY_MEMO_TTL_SECONDS", "86400"))
+
+# =============================================================================
+# MONGODB CONNECTION POOL
+# =============================================================================
+
+MONGO_MAX_POOL_SIZE = int(os.getenv("MONGO_MAX_POOL_SIZE", "100"))
+# Connections opened at startup and kept open, so the first requests don't pay for the handshake.
+MONGO_MIN_POOL_SIZE = int(os.getenv("MONGO_MIN_POOL_SIZE", "10"))
+MONGO_MAX_IDLE_TIME_MS = int(os.getenv("MONGO_MAX_IDLE_TIME_MS", "300000"))
+MONGO_CONNECT_TIMEOUT_MS = int(os.getenv("MONGO_CONNECT_TIMEOUT_MS", "5000"))
+MONGO_SERVER_SELECTION_TIMEOUT_MS = int(os.getenv("MONGO_SERVER_SELECTION_TIMEOUT_MS", "5000"))
+MONGO_SOCKET_TIMEOUT_MS = int(os.getenv("MONGO_SOCKET_TIMEOUT_MS", "30000"))
+# How long a request may wait for a free pooled connection before failing.
+MONGO_WAIT_QUEUE_TIMEOUT_MS = int(os.getenv("MONGO_WAIT_QUEUE_TIMEOUT_MS", "2000"))
+# Comma-separated wire compressors, e.g. "zstd,zlib". Empty disables compression.
+MONGO_COMPRESSORS = os.getenv("MONGO_COMPRESSORS", "")
+
+# =============================================================================
+# OPENAI CLIENT
+# =============================================================================
+
+# Max in-flight OpenAI requests per worker (also the HTTP connection pool size).
+OPENAI_MAX_CONCURRENCY = int(os.getenv("OPENAI_MAX_CONCURRENCY", "16"))
+OPENAI_MAX_RETRIES = int(os.getenv("OPENAI_MAX_RETRIES", "2"))
+OPENAI_EMBEDDING_TIMEOUT_SECONDS = float(os.getenv("OPENAI_EMBEDDING_TIMEOUT_SECONDS", "10"))
+OPENAI_CHAT_TIMEOUT_SECONDS = float(os.getenv("OPENAI_CHAT_TIMEOUT_SECONDS", "30"))
+
+# =============================================================================
+# CHAT RETRIEVAL
+# =============================================================================
+
+# Most / fewest transactions handed to the model per chat turn.
+RETRIEVAL_MAX_K = int(os.getenv("RETRIEVAL_MAX_K", "20"))
+RETRIEVAL_MIN_K = int(os.getenv("RETRIEVAL_MIN_K", "3"))
+# Keep results scoring at least this fraction of the best hybrid score.
+RETRIEVAL_RELATIVE_CUTOFF = float(os.getenv("RETRIEVAL_RELATIVE_CUTOFF", "0.5"))
+# Weight of vector similarity vs. BM25 in the hybrid score (0..1).
+RETRIEVAL_VECTOR_WEIGHT = float(os.getenv("RETRIEVAL_VECTOR_WEIGHT", "0.6"))
+# Nearest neighbours fetched from the vector index before fusion.
+RETRIEVAL_VECTOR_CANDIDATES = int(os.getenv("RETRIEVAL_VECTOR_CANDIDATES", "200"))
+
+# =============================================================================
+# CHAT MODEL AND PROMPT
+# =============================================================================
+
+CHAT_MODEL = os.getenv("CHAT_MODEL", "gpt-4-turbo-preview")
+# Most tokens the model may generate per answer.
+CHAT_MAX_TOKENS = int(os.getenv("CHAT_MAX_TOKENS", "200"))
+# Most tokens sent per chat turn (system prompt plus the user's message), counted
+# locally before the call (app.services.prompt_builder). Context is added by value
+# until the budget is spent.
+PROMPT_TOKEN_BUDGET = int(os.getenv("PROMPT_TOKEN_BUDGET", "1500"))
+# How prompt tokens are counted: "auto" (tiktoken's encoding for CHAT_MODEL once it
+# has loaded, a conservative estimate until then or without it) or "estimate".
+# tiktoken downloads its encoding files on first use; offline deployments should
+# download them ahead of time (e.g. at image build) into a directory and point
+# TIKTOKEN_CACHE_DIR at it, or they stay on the estimate.
+PROMPT_TOKENIZER = os.getenv("PROMPT_TOKENIZER", "auto").lower()
+
+# =============================================================================
+# CHAT ANSWER CACHE
+# =============================================================================
+
+# Minimum cosine similarity between two queries for a cached answer to be reused.
+ANSWER_CACHE_SIMILARITY_THRESHOLD = float(os.getenv("ANSWER_CACHE_SIMILARITY_THRESHOLD", "0.95"))
+ANSWER_CACHE_TTL_SECONDS = float(os.getenv("ANSWER_CACHE_TTL_SECONDS", "3600"))
+ANSWER_CACHE_MAX_USERS = int(os.getenv("ANSWER_CACHE_MAX_USERS", "1000"))
+ANSWER_CACHE_MAX_PER_USER = int(os.getenv("ANSWER_CACHE_MAX_PER_USER", "50"))
+
+# =============================================================================
+# WORKING SET CACHE
+# =============================================================================
+
+# Per-worker bound on cached users' columnar data (app.services.working_set).
+WORKING_SET_MAX_USERS = int(os.getenv("WORKING_SET_MAX_USERS", "256"))
+WORKING_SET_MAX_BYTES = int(os.getenv("WORKING_SET_MAX_BYTES", str(512 * 1024 * 1024)))
+
+# =============================================================================
+# METRICS
+# =============================================================================
+
+# In-process latency histograms and counters served on /metrics (app.core.metrics).
+METRICS_ENABLED = os.getenv("METRICS_ENABLED", "true").lower() not in ("0", "false", "no")
+
+# Load heavy libraries and clients in the background right after startup
+# (app.services.warmup). When off, they load on first use.
+WARMUP_ENABLED = os.getenv("WARMUP_ENABLED", "true").lower() not in ("0", "false", "no")
+
+# =============================================================================
+# BACKGROUND JOBS
+# =============================================================================
+
+# Concurrent jobs (imports, recategorization, index backfill) per worker process.
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", "2"))
+# A running job's lease; it is renewed while the job runs and lets another process
+# resume the job from its last checkpoint if this one dies.
+JOB_LEASE_SECONDS = float(os.getenv("JOB_LEASE_SECONDS", "60"))
+# How often idle workers look for queued jobs submitted by other processes.
+JOB_POLL_SECONDS = float(os.getenv("JOB_POLL_SECONDS", "2"))
+# Attempts (first run plus resumes after errors or crashes) before a job is marked failed.
+JOB_MAX_ATTEMPTS = int(os.getenv("JOB_MAX_ATTEMPTS", "3"))
+# Where uploaded CSVs wait for their import job. Must be shared between processes
+# that may resume each other's jobs.
+IMPORT_JOB_DIR = os.getenv("IMPORT_JOB_DIR", "data/import_jobs")
@@ -1,10 +1,17 @@
+import asyncio
+import logging
+import time
 import motor.motor_asyncio
+from pymongo import ASCENDING, IndexModel
+from pymongo import monitoring
 from typing import Optional
 import os
-from dotenv import load_dotenv
+from app.core import metrics
+from app.core.config import (MONGO_MAX_POOL_SIZE, MONGO_MIN_POOL_SIZE, MONGO_MAX_IDLE_TIME_MS, MONGO_CONNECT_TIMEOUT_MS,
+                             MONGO_SERVER_SELECTION_TIMEOUT_MS, MONGO_SOCKET_TIMEOUT_MS, MONGO_WAIT_QUEUE_TIMEOUT_MS,
+                             MONGO_COMPRESSORS)
 
-# Load environment variables from a .env file located in your 'backend' directory
-load_dotenv()
+# The backend/.env file is loaded once, by app.core.config (imported above).
 
 # Get the connection string from an environment variable for security.
 # This is essential for connecting to a remote MongoDB instance like MongoDB Atlas.
@@ -15,26 +22,151 @@ MONGO_URI = os.getenv("MONGO")
 if not MONGO_URI:
     raise ValueError("MONGO_URI environment variable not set. Please create a .env file in the backend directory.")
 
+logger = logging.getLogger(__name__)
+
+
+class PoolStats(monitoring.ConnectionPoolListener):
+    """Counts connection pool events so pool usage can be reported on the health endpoint."""
+
+    def __init__(self):
+        self.open_connections = 0
+        self.checked_out = 0
+        self.total_checkouts = 0
+        self.checkout_failures = 0
+        self.pool_clears = 0
+
+    def pool_created(self, event): pass
+    def pool_ready(self, event): pass
+    def pool_closed(self, event): pass
+
+    def pool_cleared(self, event):
+        self.pool_clears += 1
+
+    def connection_created(self, event):
+        self.open_connections += 1
+
+    def connection_ready(self, event): pass
+
+    def connection_closed(self, event):
+        self.open_connections -= 1
+
+    def connection_check_out_started(self, event): pass
+
+    def connection_check_out_failed(self, event):
+        self.checkout_failures += 1
+
+    def connection_checked_out(self, event):
+        self.checked_out += 1
+        self.total_checkouts += 1
+
+    def connection_checked_in(self, event):
+        self.checked_out -= 1
+
+    def as_dict(self) -> dict:
+        return {
+            "open_connections": self.open_connections,
+            "checked_out": self.checked_out,
+            "total_checkouts": self.total_checkouts,
+            "checkout_failures": self.checkout_failures,
+            "pool_clears": self.pool_clears,
+        }
+
+
+def client_options() -> dict:
+    """Pool and timeout settings passed to the Motor client (see app.core.config)."""
+    options = {
+        "maxPoolSize": MONGO_MAX_POOL_SIZE,
+        "minPoolSize": MONGO_MIN_POOL_SIZE,
+        "maxIdleTimeMS": MONGO_MAX_IDLE_TIME_MS,
+        "connectTimeoutMS": MONGO_CONNECT_TIMEOUT_MS,
+        "serverSelectionTimeoutMS": MONGO_SERVER_SELECTION_TIMEOUT_MS,
+        "socketTimeoutMS": MONGO_SOCKET_TIMEOUT_MS,
+        "waitQueueTimeoutMS": MONGO_WAIT_QUEUE_TIMEOUT_MS,
+    }
+    if MONGO_COMPRESSORS:
+        options["compressors"] = MONGO_COMPRESSORS
+    return options
+
 
 class Database:
     def __init__(self):
         self.client: Optional[motor.motor_asyncio.AsyncIOMotorClient] = None
         self.db: Optional[motor.motor_asyncio.AsyncIOMotorDatabase] = None
         self.connected = False
+        self.pool_stats = PoolStats()
+        self._connect_lock = asyncio.Lock()
 
     async def connect(self):
-        """Establishes a connection to the MongoDB database."""
-        self.client = motor.motor_asyncio.AsyncIOMotorClient(MONGO_URI)
-        self.db = self.client.finchat  # Your database name is 'finchat'
-        self.connected = True
-        print("Successfully connected to MongoDB.")
+        """Establishes a connection to the MongoDB database and warms the connection pool."""
+        async with self._connect_lock:
+            if self.connected:
+                return
+            self.client = motor.motor_asyncio.AsyncIOMotorClient(
+                MONGO_URI, event_listeners=[self.pool_stats], **client_options()
+            )
+            self.db = self.client.finchat  # Your database name is 'finchat'
+            try:
+                await self.warm_pool()
+            except Exception:
+                self.client.close()
+                raise
+            self.connected = True
+            print("Successfully connected to MongoDB.")
+            await self.ensure_indexes()
+
+    async def warm_pool(self):
+        """Opens min-pool-size connections up front with concurrent pings."""
+        await asyncio.gather(*(self.client.admin.command("ping") for _ in range(max(MONGO_MIN_POOL_SIZE, 1))))
+
+    async def ensure_indexes(self):
+        """Creates the indexes the services rely on. create_indexes is a no-op for existing ones."""
+        await self.db.users.create_indexes([
+            IndexModel([("clerk_id", ASCENDING)], name="clerk_id"),
+        ])
+        await self.db.transactions.create_indexes([
+            IndexModel([("clerk_id", ASCENDING), ("transaction_id", ASCENDING)], name="clerk_id_transaction_id", unique=True),
+            # Serves date-range scans and the (date, transaction_id) pagination cursor.
+            IndexModel([("clerk_id", ASCENDING), ("date", ASCENDING), ("transaction_id", ASCENDING)], name="clerk_id_date_transaction_id"),
+            IndexModel([("clerk_id", ASCENDING), ("category", ASCENDING)], name="clerk_id_category"),
+            # Import dedup: a re-uploaded row collides here. Manual entries carry no fingerprint.
+            IndexModel([("clerk_id", ASCENDING), ("fingerprint", ASCENDING)], name="clerk_id_fingerprint", unique=True,
+                       partialFilterExpression={"fingerprint": {"$exists": True}}),
+        ])
+        await self.db.spending_rollups.create_indexes([
+            IndexModel([("clerk_id", ASCENDING), ("month", ASCENDING), ("category", ASCENDING)], name="clerk_id_month_category", unique=True),
+        ])
+        await self.db.jobs.create_indexes([
+            IndexModel([("job_id", ASCENDING)], name="job_id", unique=True),
+            # Serves the workers' claim query (oldest queued or lease-expired job first).
+            IndexModel([("status", ASCENDING), ("created_at", ASCENDING)], name="status_created_at"),
+        ])
 
     async def close(self):
         """Closes the connection to the MongoDB database."""
         if self.client:
             self.client.close()
+            self.client = None
+            self.db = None
+            self.connected = False
             print("MongoDB connection closed.")
 
+    async def health(self) -> dict:
+        """Pings the server and reports pool configuration and usage."""
+        status = {
+            "connected": self.connected,
+            "pool": self.pool_stats.as_dict(),
+            "options": client_options(),
+        }
+        if not self.connected:
+            return {**status, "ok": False}
+        try:
+            start = time.perf_counter()
+            await self.client.admin.command("ping")
+            return {**status, "ok": True, "ping_ms": round((time.perf_counter() - start) * 1000, 2)}
+        except Exception as e:
+            logger.error(f"MongoDB health check failed: {e}")
+            return {**status, "ok": False, "error": str(e)}
+
     def get_collection(self, name: str) -> motor.motor_asyncio.AsyncIOMotorCollection:
         """
         Retrieves a collection from the database.
@@ -52,9 +184,25 @@ class Database:
 # Create a single, shared instance of the Database class
 db = Database()
 
+
+def _collect_metrics() -> metrics.Collected:
+    pool = db.pool_stats
+    return [
+        ("finchat_mongo_connections_open", "gauge", "Open MongoDB connections.", pool.open_connections),
+        ("finchat_mongo_connections_checked_out", "gauge", "MongoDB connections in use.", pool.checked_out),
+        ("finchat_mongo_checkouts_total", "counter", "MongoDB connection checkouts.", pool.total_checkouts),
+        ("finchat_mongo_checkout_failures_total", "counter", "Failed MongoDB connection checkouts.", pool.checkout_failures),
+        ("finchat_mongo_pool_clears_total", "counter", "MongoDB connection pool clears.", pool.pool_clears),
+    ]
+
+
+metrics.register_collector(_collect_metrics)
+
 async def get_db() -> Database:
     """
     Dependency injection helper to get the shared database instance.
+    The app connects once at startup (see app.main lifespan); the lazy connect
+    here only serves standalone scripts such as the migration CLIs.
     """
     if not db.connected:
         await db.connect()
@@ -0,0 +1,30 @@
+import importlib
+import sys
+import threading
+from types import ModuleType
+
+# =============================================================================
+# LAZY IMPORTS
+# =============================================================================
+# Heavy libraries (pandas, FAISS, the OpenAI SDK, LangChain, scikit-learn,
+# tiktoken) are imported where they are first used, and imported ahead of that
+# in a background thread by app.services.warmup. Python's per-module import
+# locks don't stop two threads that import modules sharing dependencies from
+# seeing each other's half-initialized modules ("partially initialized module
+# 'httpx' has no attribute 'Timeout'"). Every lazy import goes through load(),
+# which serializes first imports behind one process-wide lock. Once a module
+# has finished loading it comes straight from sys.modules, without the lock.
+#
+# A request that needs a module the warmup thread is still importing waits for
+# that import instead of starting a second one.
+
+_lock = threading.RLock()
+
+
+def load(name: str) -> ModuleType:
+    """ importlib.import_module(name), safe to call from any thread while others import too. """
+    module = sys.modules.get(name)
+    if module is not None and not getattr(getattr(module, "__spec__", None), "_initializing", False):
+        return module
+    with _lock:
+        return importlib.import_module(name)
@@ -0,0 +1,245 @@
+import bisect
+import threading
+import time
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+from app.core.config import METRICS_ENABLED
+
+# =============================================================================
+# IN-PROCESS METRICS (Prometheus text format)
+# =============================================================================
+# Counters, gauges and fixed-bucket histograms kept in plain dicts keyed by the
+# label values, rendered on demand by `render()` for the /metrics endpoint.
+# Recording is a dict update under a lock, cheap enough to leave on in production.
+# Set METRICS_ENABLED=false to turn recording into a no-op.
+#
+# `span("stage")` times a block into stage_duration_seconds{stage=...} and tracks
+# it in stage_in_flight{stage=...}. Stats that services already keep (caches,
+# the Mongo pool) are exported with `register_collector` and read at scrape time.
+
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+LabelValues = Tuple[str, ...]
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(str(value))}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        _registry.append(self)
+
+    def _key(self, labels: Dict[str, str]) -> LabelValues:
+        return tuple(str(labels.get(name, "")) for name in self.labelnames)
+
+    def header(self) -> List[str]:
+        return [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+
+    def samples(self) -> List[str]:
+        raise NotImplementedError
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        super().__init__(name, documentation, labelnames)
+        self._values: Dict[LabelValues, float] = {}
+
+    def inc(self, amount: float = 1, **labels: str) -> None:
+        if METRICS_ENABLED:
+            self._inc(self._key(labels), amount)
+
+    def _inc(self, key: LabelValues, amount: float) -> None:
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def samples(self) -> List[str]:
+        with self._lock:
+            items = list(self._values.items())
+        return [f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}" for key, value in items]
+
+
+class Gauge(Counter):
+    kind = "gauge"
+
+    def dec(self, amount: float = 1, **labels: str) -> None:
+        self.inc(-amount, **labels)
+
+    def set(self, value: float, **labels: str) -> None:
+        if not METRICS_ENABLED:
+            return
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                 buckets: Sequence[float] = DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        # label values -> [per-bucket counts (last one is +Inf), sum]
+        self._values: Dict[LabelValues, list] = {}
+
+    def observe(self, value: float, **labels: str) -> None:
+        if METRICS_ENABLED:
+            self._observe(self._key(labels), value)
+
+    def _observe(self, key: LabelValues, value: float) -> None:
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                state = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0]
+            state[0][index] += 1
+            state[1] += value
+
+    def samples(self) -> List[str]:
+        with self._lock:
+            items = [(key, list(counts), total) for key, (counts, total) in self._values.items()]
+        lines = []
+        for key, counts, total in items:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += count
+                le = f'le="{_format_value(float(bound))}"'
+                lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, key, le)} {cumulative}")
+            lines.append(f"{self.name}_sum{_format_labels(self.labelnames, key)} {_format_value(total)}")
+            lines.append(f"{self.name}_count{_format_labels(self.labelnames, key)} {cumulative}")
+        return lines
+
+
+# Scrape-time collectors: each returns (name, kind, help, value) tuples.
+Collected = List[Tuple[str, str, str, float]]
+
+_registry: List[_Metric] = []
+_collectors: List[Callable[[], Collected]] = []
+
+
+def register_collector(collector: Callable[[], Collected]) -> None:
+    """ Exports stats a component already keeps; `collector` is called on every scrape. """
+    _collectors.append(collector)
+
+
+def render() -> str:
+    """ All metrics in the Prometheus text exposition format (version 0.0.4). """
+    lines: List[str] = []
+    for metric in _registry:
+        samples = metric.samples()
+        if samples:
+            lines.extend(metric.header())
+            lines.extend(samples)
+    for collector in _collectors:
+        try:
+            collected = collector()
+        except Exception:
+            continue
+        for name, kind, documentation, value in collected:
+            lines.append(f"# HELP {name} {documentation}")
+            lines.append(f"# TYPE {name} {kind}")
+            lines.append(f"{name} {_format_value(value)}")
+    return "\n".join(lines) + "\n"
+
+
+# --- Shared metrics ---
+
+STAGE_DURATION = Histogram("finchat_stage_duration_seconds", "Latency of an internal processing stage.", ["stage"])
+STAGE_IN_FLIGHT = Gauge("finchat_stage_in_flight", "Stage executions currently running.", ["stage"])
+STAGE_ERRORS = Counter("finchat_stage_errors_total", "Stage executions that raised.", ["stage"])
+
+
+class span:
+    """
+    Times a block as one execution of `stage`. Works in sync and async code alike:
+
+        with metrics.span("chat.retrieval"):
+            result = await retrieval.retrieve(...)
+    """
+    __slots__ = ("key", "started")
+
+    def __init__(self, stage: str):
+        # The three stage metrics share the single `stage` label, so the key is built once.
+        self.key = (stage,)
+
+    def __enter__(self) -> None:
+        if METRICS_ENABLED:
+            STAGE_IN_FLIGHT._inc(self.key, 1)
+        self.started = time.perf_counter()
+
+    def __exit__(self, exc_type, exc, tb) -> None:
+        if not METRICS_ENABLED:
+            return
+        if exc_type is not None:
+            STAGE_ERRORS._inc(self.key, 1)
+        STAGE_DURATION._observe(self.key, time.perf_counter() - self.started)
+        STAGE_IN_FLIGHT._inc(self.key, -1)
+
+
+def route_template(scope: dict) -> Optional[str]:
+    """ The matched route's path template (e.g. /api/v1/user/context), which keeps label cardinality bounded. """
+    route = scope.get("route")
+    return getattr(route, "path", None)
+
+
+# --- HTTP ---
+
+HTTP_REQUESTS = Counter("finchat_http_requests_total", "HTTP requests handled.", ["method", "route", "status"])
+HTTP_DURATION = Histogram("finchat_http_request_duration_seconds", "HTTP request latency, until the response body is sent.",
+                          ["method", "route"])
+HTTP_IN_FLIGHT = Gauge("finchat_http_requests_in_flight", "HTTP requests currently being handled.")
+
+
+class MetricsMiddleware:
+    """
+    Pure ASGI middleware recording request count, latency and in-flight requests per route.
+    Streaming responses are timed until their last chunk is sent.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not METRICS_ENABLED:
+            await self.app(scope, receive, send)
+            return
+
+        status = 500
+
+        async def send_with_status(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        HTTP_IN_FLIGHT.inc()
+        started = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            # The router stores the matched route on the scope; unmatched paths share one label.
+            route = route_template(scope) or "unmatched"
+            HTTP_DURATION.observe(time.perf_counter() - started, method=scope["method"], route=route)
+            HTTP_REQUESTS.inc(method=scope["method"], route=route, status=str(status))
+            HTTP_IN_FLIGHT.dec()
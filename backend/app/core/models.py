@@ -1,7 +1,7 @@
 import uuid
 from datetime import datetime, date
 from enum import Enum
-from typing import Any, List, Optional
+from typing import Any, Dict, List, Literal, Optional
 
 from bson import ObjectId
 from pydantic import BaseModel, ConfigDict, Field, GetCoreSchemaHandler
@@ -77,6 +77,8 @@ class PolicyDB(BaseModel):
     timeframe: str = "monthly" 
     target_category: str
     current_spending: float = 0.0
+    # Start of the timeframe window current_spending covers (maintained by the policy engine).
+    window_start: Optional[datetime] = None
 
 class TransactionDB(BaseModel):
     transaction_id: str = Field(default_factory=lambda: str(uuid.uuid4()))
@@ -85,6 +87,9 @@ class TransactionDB(BaseModel):
     amount: float
     category: Optional[TransactionCategory] = None
     merchant: Optional[str] = None
+    account: Optional[str] = None
+    # Import dedup key (see user_service.fingerprint_transactions); unset for manual entries.
+    fingerprint: Optional[str] = None
 
 class BankAccountDB(BaseModel):
     account_name: str
@@ -96,7 +101,10 @@ class UserDocumentDB(BaseModel):
     goals: List[GoalDB] = Field(default_factory=list)
     policies: List[PolicyDB] = Field(default_factory=list)
     accounts: List[BankAccountDB] = Field(default_factory=list)
-    transactions: List[TransactionDB] = Field(default_factory=list)
+    # Bumped on every transaction/policy write; guards cached chat answers.
+    data_version: int = 0
+    # Transactions live in the separate, indexed `transactions` collection
+    # (one document per transaction, keyed by clerk_id + transaction_id).
 
     model_config = ConfigDict(
         populate_by_name=True,
@@ -125,6 +133,7 @@ class TransactionCreate(BaseModel):
     description: str
     amount: float
     category: Optional[TransactionCategory] = None
+    account: Optional[str] = None
 
 
 # --- API Response Models ---
@@ -157,11 +166,108 @@ class UserDocument(BaseModel):
 class UserResponse(BaseModel):
     exists: bool
 
+class TransactionPage(BaseModel):
+    """A page of (optionally projected) transactions, newest first."""
+    transactions: List[Dict[str, Any]] = Field(default_factory=list)
+    next_cursor: Optional[str] = None
+
+class UserAggregates(BaseModel):
+    """Running totals returned by the lightweight write responses."""
+    transaction_count: int = 0
+    total_income: float = 0.0
+    total_spending: float = 0.0
+
+class TransactionWriteResponse(BaseModel):
+    """Lightweight response for a transaction write: the new row plus updated totals."""
+    transaction: TransactionDB
+    aggregates: UserAggregates
+
+class PolicyWriteResponse(BaseModel):
+    """Lightweight response for a policy write: the new policy plus updated totals."""
+    policy: PolicyDB
+    aggregates: UserAggregates
+
+class CategoryMonthRollup(BaseModel):
+    """Materialized totals for one (month, category) cell."""
+    month: str  # "YYYY-MM"
+    category: str
+    count: int = 0
+    total: float = 0.0
+    income: float = 0.0
+    spending: float = 0.0
+    average: float = 0.0
+
+class MonthSummary(BaseModel):
+    month: str
+    income: float = 0.0
+    spending: float = 0.0
+    transaction_count: int = 0
+
+class CategorySummary(BaseModel):
+    category: str
+    total: float = 0.0
+    spending: float = 0.0
+    transaction_count: int = 0
+    average: float = 0.0
+
+class SpendingSummary(BaseModel):
+    """Dashboard summary served from the spending rollups."""
+    total_income: float = 0.0
+    total_spending: float = 0.0
+    months: List[MonthSummary] = Field(default_factory=list)
+    categories: List[CategorySummary] = Field(default_factory=list)
+    rollups: List[CategoryMonthRollup] = Field(default_factory=list)
+
+class PolicyStatus(PolicyDB):
+    """A policy with its budget progress for the current window."""
+    remaining: float
+    utilization: float
+
+class ChatRequest(BaseModel):
+    clerk_id: str
+    message: str = Field(min_length=1)
+
+class ChatResponse(BaseModel):
+    response: str
+
 class TransactionUploadResponse(BaseModel):
     status: str
     imported_count: int
+    skipped_count: int = 0  # rows already imported by an earlier upload
     total_in_file: int
 
+class ImportResult(BaseModel):
+    imported_count: int = 0
+    skipped_count: int = 0
+
+class JobAccepted(BaseModel):
+    """Returned with 202 when work is handed to the background job workers."""
+    job_id: str
+    kind: str
+    status: str
+    status_url: str
+
+class JobProgress(BaseModel):
+    rows_total: Optional[int] = None
+    rows_processed: int = 0
+    rows_categorized: int = 0
+    rows_imported: int = 0
+    rows_skipped: int = 0  # already imported by an earlier upload
+    failures: int = 0  # rows dropped as invalid
+
+class JobStatusResponse(BaseModel):
+    job_id: str
+    kind: str
+    clerk_id: str
+    status: Literal["queued", "running", "succeeded", "failed"]
+    progress: JobProgress
+    eta_seconds: Optional[float] = None
+    attempts: int = 0
+    error: Optional[str] = None
+    created_at: datetime
+    started_at: Optional[datetime] = None
+    finished_at: Optional[datetime] = None
+
 # =============================================================================
 # 4. INTERNAL LOGIC MODELS (For specific application logic like RAG)
 # =============================================================================
@@ -185,4 +291,36 @@ class CategorizedTransaction(BaseModel):
 
 class UserGoal(BaseModel):
     title:str
-    description:str
\ No newline at end of file
+    description:str
+
+class RetrievalFilters(BaseModel):
+    """Structured pre-filters parsed out of a chat query."""
+    start_date: Optional[date] = None
+    end_date: Optional[date] = None
+    categories: List[TransactionCategory] = Field(default_factory=list)
+    min_amount: Optional[float] = None  # absolute amount
+    max_amount: Optional[float] = None  # absolute amount
+    flow: Optional[str] = None  # "spending" (amount < 0) or "income" (amount > 0)
+    terms: List[str] = Field(default_factory=list)  # remaining free-text terms
+
+    def is_structured(self) -> bool:
+        return bool(self.start_date or self.end_date or self.categories
+                    or self.min_amount is not None or self.max_amount is not None or self.flow)
+
+class RetrievedTransaction(BaseModel):
+    """A transaction retrieved as context for a chat answer."""
+    transaction_id: str
+    date: datetime
+    description: str
+    amount: float
+    category: Optional[str] = None
+    score: float
+
+class RetrievalResult(BaseModel):
+    filters: RetrievalFilters
+    matched_count: int = 0  # rows passing the filters
+    total_spending: float = 0.0  # over all matched rows
+    total_income: float = 0.0
+    categories: List[CategorySummary] = Field(default_factory=list)  # over all matched rows, by spending
+    months: List[MonthSummary] = Field(default_factory=list)  # over all matched rows, oldest first
+    transactions: List[RetrievedTransaction] = Field(default_factory=list)
@@ -1,17 +1,38 @@
+from contextlib import asynccontextmanager
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse, PlainTextResponse
 from app.api.v1.api import api_router  # We will use the central router
+from app.core import metrics
+from app.core.config import WARMUP_ENABLED
+from app.core.database import db
+from app.services import csv_parser, ingestion, jobs, openai_client, vector_store, warmup  # ingestion registers the job handlers
 
-from dotenv import load_dotenv
 
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Connect (and warm the pool) once, before the first request is accepted.
+    await db.connect()
+    jobs.start_workers()
+    # Heavy libraries and clients load in the background while requests are already served.
+    if WARMUP_ENABLED:
+        warmup.start_warmup()
+    yield
+    await warmup.stop_warmup()
+    # Running jobs go back to the queue and resume from their checkpoint on the next start.
+    await jobs.stop_workers()
+    # Give scheduled vector indexing a moment to finish; chat requests backfill whatever it misses.
+    await vector_store.drain_background(timeout=10.0)
+    csv_parser.shutdown_parse_pool()
+    await openai_client.close_client()
+    await db.close()
 
 
-
-load_dotenv()
 app = FastAPI(
     title="FinChat AI Teammate API",
     description="API for the AI-powered financial buddy.",
     version="1.0.0",
+    lifespan=lifespan,
 )
 
 # --- CORS Middleware ---
@@ -26,12 +47,25 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"],
 )
+# Outermost, so the recorded latency covers the whole stack.
+app.add_middleware(metrics.MetricsMiddleware)
 
 # A simple root endpoint to confirm the server is running
 @app.get("/")
 def read_root():
     return {"message": "Welcome to the FinChat API!"}
 
+# Readiness/health check: MongoDB ping latency plus connection pool settings and usage, and warmup progress
+@app.get("/health")
+async def health():
+    mongo = await db.health()
+    return JSONResponse(status_code=200 if mongo["ok"] else 503, content={"mongo": mongo, "warmup": warmup.status()})
+
+# Prometheus scrape endpoint: request/stage latency histograms, counters and gauges
+@app.get("/metrics", include_in_schema=False)
+def prometheus_metrics():
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4; charset=utf-8")
+
 # --- Include the API Router ---
 # This single line correctly registers all your endpoints
 # (like /transactions/upload and /goal) under the /api/v1 prefix.
@@ -0,0 +1,235 @@
+import logging
+import math
+import time
+from typing import TYPE_CHECKING, List, Optional, Tuple
+
+import numpy as np
+
+from app.core import lazy_imports
+from app.core.config import (
+    RETRIEVAL_MAX_K,
+    VECTOR_ANN_MIN_ROWS,
+    VECTOR_HNSW_EF_CONSTRUCTION,
+    VECTOR_HNSW_M,
+    VECTOR_INDEX_KIND,
+    VECTOR_INDEX_MAX_BYTES,
+    VECTOR_PQ_BYTES,
+    VECTOR_TARGET_LATENCY_MS,
+    VECTOR_TARGET_RECALL,
+)
+
+if TYPE_CHECKING:
+    import faiss
+
+logger = logging.getLogger(__name__)
+
+# =============================================================================
+# FAISS INDEX SELECTION AND TUNING
+# =============================================================================
+# An exact flat index keeps every vector at full precision in memory and scans
+# all of them per query: fine for typical users, but 200k 1536-dim vectors are
+# 1.2 GB and a full scan per chat turn. The index type follows corpus size:
+#
+#   flat   - exact inner product, below VECTOR_ANN_MIN_ROWS vectors;
+#   hnsw   - graph search over full-precision vectors, while its estimated size
+#            fits VECTOR_INDEX_MAX_BYTES;
+#   ivfpq  - inverted lists of product-quantized codes (VECTOR_PQ_BYTES per
+#            vector) beyond that. PQ scores alone rank near neighbours poorly,
+#            so the best `k_factor * k` candidates are re-scored exactly against
+#            the full vectors, memory-mapped from disk.
+#
+# Approximate indexes are tuned when built: queries made from the user's own
+# vectors are answered exactly and approximately, and the fastest setting
+# (efSearch, or nprobe and k_factor) reaching VECTOR_TARGET_RECALL is stored
+# with the index. Flat and HNSW indexes can be rebuilt from their own vectors
+# when the user outgrows them; IVF-PQ is trained once, and later vectors go to
+# its existing lists.
+
+FLAT, HNSW, IVFPQ = "flat", "hnsw", "ivfpq"
+KINDS = (FLAT, HNSW, IVFPQ)
+
+# PQ codebooks want ~39 training points per centroid (256 per sub-quantizer).
+_MIN_TRAIN_ROWS = 39 * 256
+_TUNE_QUERIES = 100
+# Results scoring within this of the exact k-th best count as hits, so ties
+# (repeated descriptions) do not read as misses.
+_RECALL_EPSILON = 1e-3
+_HNSW_EF_SEARCH = (32, 48, 64, 96, 128, 192, 256, 384, 512)
+_IVF_K_FACTORS = (1, 2, 4, 8, 16, 32, 64)
+
+
+def estimate_bytes(kind: str, rows: int, dim: int) -> int:
+    """ Approximate memory held by an index of `kind` over `rows` vectors (FAISS structures only). """
+    if kind == HNSW:
+        # Vectors, ~2M neighbour links per node on level 0 plus ~1 above it, and the level bookkeeping.
+        return rows * (4 * dim + 4 * (2 * VECTOR_HNSW_M + 1) + 12)
+    if kind == IVFPQ:
+        # Codes and ids per vector, the coarse centroids, and the PQ codebooks (256 centroids per sub-space).
+        # The full vectors used for re-scoring are mapped from disk, not counted here.
+        return rows * (_pq_subquantizers(dim) + 8) + 4 * dim * (_nlist(rows) + 256)
+    return rows * 4 * dim
+
+
+def choose_kind(rows: int, dim: int) -> str:
+    """ The index type for a corpus of `rows` vectors, honouring VECTOR_INDEX_KIND. """
+    if VECTOR_INDEX_KIND in KINDS:
+        kind = VECTOR_INDEX_KIND
+    elif rows < VECTOR_ANN_MIN_ROWS:
+        kind = FLAT
+    elif estimate_bytes(HNSW, rows, dim) <= VECTOR_INDEX_MAX_BYTES:
+        kind = HNSW
+    else:
+        kind = IVFPQ
+    if kind == IVFPQ and rows < _MIN_TRAIN_ROWS:
+        # Too few vectors to train the quantizers; an exact index is small at this size anyway.
+        kind = FLAT
+    return kind
+
+
+def can_rebuild(kind: str) -> bool:
+    """ Whether an index of `kind` holds its vectors exactly (IVF-PQ only keeps codes). """
+    return kind != IVFPQ
+
+
+def _nlist(rows: int) -> int:
+    return int(min(max(math.sqrt(rows), 16), max(rows // 39, 1)))
+
+
+def _pq_subquantizers(dim: int) -> int:
+    """ The largest divisor of `dim` not above VECTOR_PQ_BYTES (PQ needs equal sub-spaces). """
+    return max(m for m in range(1, min(VECTOR_PQ_BYTES, dim) + 1) if dim % m == 0)
+
+
+def build(kind: str, vectors: np.ndarray) -> Tuple["faiss.Index", dict]:
+    """
+    Creates an index of `kind` holding `vectors` (row i is position i) and tunes it.
+    Returns the index and its parameters, which are stored next to it. IVF-PQ
+    indexes also need `vectors` at search time, see `search`.
+    """
+    faiss = lazy_imports.load("faiss")
+
+    vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+    rows, dim = vectors.shape
+    started = time.perf_counter()
+    if kind == HNSW:
+        index = faiss.IndexHNSWFlat(dim, VECTOR_HNSW_M, faiss.METRIC_INNER_PRODUCT)
+        index.hnsw.efConstruction = VECTOR_HNSW_EF_CONSTRUCTION
+    elif kind == IVFPQ:
+        nlist = _nlist(rows)
+        index = faiss.index_factory(dim, f"IVF{nlist},PQ{_pq_subquantizers(dim)}", faiss.METRIC_INNER_PRODUCT)
+        # The factory enables polysemous training, which is most of the training time and unused here.
+        index.do_polysemous_training = False
+        sample = np.random.default_rng(0).choice(rows, size=min(rows, max(64 * nlist, _MIN_TRAIN_ROWS)), replace=False)
+        index.train(vectors[np.sort(sample)])
+    else:
+        index = faiss.IndexFlatIP(dim)
+    index.add(vectors)
+    params = {"kind": kind, "built_rows": rows, "build_seconds": round(time.perf_counter() - started, 3)}
+    if kind == IVFPQ:
+        params["nlist"] = index.nlist
+    if kind != FLAT:
+        params.update(tune(index, params, vectors))
+    return index, params
+
+
+def search(index: "faiss.Index", params: dict, query: np.ndarray, k: int,
+           selector: Optional["faiss.IDSelector"] = None, fraction: float = 1.0,
+           vectors: Optional[np.ndarray] = None) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    (scores, positions) of the k best rows for one query, best first, with the index's
+    tuned settings. With a selector covering `fraction` of the index the search is
+    widened so filtered queries keep their recall. IVF-PQ candidates are re-scored
+    exactly against `vectors`.
+    """
+    faiss = lazy_imports.load("faiss")
+
+    kind = params.get("kind", FLAT)
+    query = np.ascontiguousarray(query, dtype=np.float32).reshape(1, -1)
+    widen = 1.0 / max(fraction, 1e-6)
+    if kind == HNSW:
+        ef_search = params["ef_search"]
+        search_params = faiss.SearchParametersHNSW(efSearch=int(min(ef_search * widen, ef_search * 8)), sel=selector)
+    elif kind == IVFPQ:
+        search_params = faiss.SearchParametersIVF(nprobe=int(min(params["nprobe"] * widen, params["nlist"])),
+                                                  sel=selector)
+    else:
+        search_params = faiss.SearchParameters(sel=selector) if selector is not None else None
+
+    candidates = k * params["k_factor"] if kind == IVFPQ else k
+    scores, positions = index.search(query, min(candidates, index.ntotal), params=search_params)
+    scores, positions = scores[0], positions[0]
+    if kind == IVFPQ:
+        positions = positions[positions != -1]
+        scores = np.asarray(vectors[positions], dtype=np.float32) @ query[0]
+        best = np.argsort(-scores, kind="stable")[:k]
+        return scores[best], positions[best]
+    found = positions != -1
+    return scores[found], positions[found]
+
+
+def candidate_settings(params: dict) -> List[dict]:
+    """
+    The search settings `tune` chooses from for an index. Settings with the same nprobe
+    come in order of increasing cost and recall.
+    """
+    if params["kind"] == HNSW:
+        return [{"ef_search": ef_search} for ef_search in _HNSW_EF_SEARCH]
+    nlist = params["nlist"]
+    nprobes = sorted({min(2 ** i, nlist) for i in range(int(math.log2(nlist)) + 2)})
+    return [{"nprobe": nprobe, "k_factor": k_factor} for nprobe in nprobes for k_factor in _IVF_K_FACTORS]
+
+
+def measure(index: "faiss.Index", params: dict, vectors: np.ndarray, queries: np.ndarray, k: int,
+            exact_kth: np.ndarray) -> Tuple[float, float]:
+    """
+    (recall@k, median milliseconds per query) of single-query searches with `params`.
+    A result is a hit when its exact score reaches the exact k-th best score (`exact_kth`).
+    """
+    hits, latencies = 0, []
+    for i in range(len(queries)):
+        started = time.perf_counter()
+        _, positions = search(index, params, queries[i], k, vectors=vectors)
+        latencies.append(time.perf_counter() - started)
+        hits += int(np.count_nonzero(vectors[positions] @ queries[i] >= exact_kth[i] - _RECALL_EPSILON))
+    return hits / (len(queries) * k), float(np.median(latencies) * 1000)
+
+
+def tune(index: "faiss.Index", params: dict, vectors: np.ndarray) -> dict:
+    """
+    Picks the fastest setting whose recall@k (k = RETRIEVAL_MAX_K, the most rows a chat
+    turn uses) reaches VECTOR_TARGET_RECALL, with exact answers from a brute-force scan.
+    If none does, the best recall within the latency target is kept.
+    """
+    faiss = lazy_imports.load("faiss")
+
+    rows = len(vectors)
+    k = min(RETRIEVAL_MAX_K, rows)
+    # Each query blends two of the user's vectors: close to real data, but not itself an
+    # indexed point, which a graph search would find trivially and overstate recall.
+    pairs = np.random.default_rng(1).integers(0, rows, size=(_TUNE_QUERIES, 2))
+    queries = vectors[pairs[:, 0]] + vectors[pairs[:, 1]]
+    queries /= np.maximum(np.linalg.norm(queries, axis=1, keepdims=True), 1e-12)
+    exact_scores, _ = faiss.knn(queries, vectors, k, metric=faiss.METRIC_INNER_PRODUCT)
+
+    tried, satisfied = [], set()
+    for setting in candidate_settings(params):
+        group = setting.get("nprobe")
+        if group in satisfied:
+            # Past the target: the rest of this group is only slower.
+            continue
+        recall, latency_ms = measure(index, {**params, **setting}, vectors, queries, k, exact_scores[:, -1])
+        tried.append({**setting, "recall": round(recall, 4), "latency_ms": round(latency_ms, 3)})
+        if recall >= VECTOR_TARGET_RECALL:
+            satisfied.add(group)
+    passing = [t for t in tried if t["recall"] >= VECTOR_TARGET_RECALL]
+    if passing:
+        chosen = min(passing, key=lambda t: t["latency_ms"])
+        if chosen["latency_ms"] > VECTOR_TARGET_LATENCY_MS:
+            logger.warning(f"{params['kind']} index over {rows} vectors needs {chosen['latency_ms']} ms per query "
+                           f"(target {VECTOR_TARGET_LATENCY_MS} ms) for recall {chosen['recall']}")
+    else:
+        within = [t for t in tried if t["latency_ms"] <= VECTOR_TARGET_LATENCY_MS] or tried
+        chosen = max(within, key=lambda t: t["recall"])
+        logger.warning(f"{params['kind']} index over {rows} vectors reaches recall {chosen['recall']} "
+                       f"(target {VECTOR_TARGET_RECALL}) at {chosen['latency_ms']} ms per query")
+    return chosen
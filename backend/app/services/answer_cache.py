@@ -0,0 +1,145 @@
+import logging
+import threading
+import time
+from datetime import date
+from typing import List, Optional
+
+import numpy as np
+
+from app.core import metrics
+from app.core.cache import LRUCache
+from app.core.config import (ANSWER_CACHE_MAX_PER_USER, ANSWER_CACHE_MAX_USERS, ANSWER_CACHE_SIMILARITY_THRESHOLD,
+                             ANSWER_CACHE_TTL_SECONDS)
+from app.core.models import RetrievedTransaction
+
+logger = logging.getLogger(__name__)
+
+# =============================================================================
+# SEMANTIC CHAT ANSWER CACHE
+# =============================================================================
+# Per-user cache of chat answers keyed on the query embedding. A new query is
+# a hit when it is within ANSWER_CACHE_SIMILARITY_THRESHOLD (cosine) of a
+# cached query AND:
+#   - the user's data_version is unchanged (bumped on every transaction or
+#     policy write, so other workers' writes invalidate too),
+#   - the structured filters parsed from both queries are identical
+#     ("groceries last month" vs. "groceries this month" embed very close),
+#   - the entry was answered today, so relative dates still mean the same thing,
+#   - the entry is younger than ANSWER_CACHE_TTL_SECONDS.
+# Users are LRU-evicted beyond ANSWER_CACHE_MAX_USERS, and each user keeps at
+# most ANSWER_CACHE_MAX_PER_USER answers.
+
+
+class CachedAnswer:
+    def __init__(self, query_vector: np.ndarray, filters_key: str, data_version: int, answer: str,
+                 sources: List[RetrievedTransaction], latency: float):
+        self.query_vector = query_vector
+        self.filters_key = filters_key
+        self.data_version = data_version
+        self.answer = answer
+        self.sources = sources
+        self.latency = latency  # seconds it took to produce the answer originally
+        self.created = time.monotonic()
+        self.day = date.today()
+
+
+class _UserAnswers:
+    """ One user's entries with their query vectors stacked for a single matrix-vector lookup. """
+
+    def __init__(self):
+        self.entries: List[CachedAnswer] = []
+        self.matrix: Optional[np.ndarray] = None
+
+    def _rebuild(self):
+        self.matrix = np.vstack([e.query_vector for e in self.entries]) if self.entries else None
+
+    def prune(self, data_version: int):
+        now, today = time.monotonic(), date.today()
+        live = [
+            e for e in self.entries
+            if e.data_version == data_version and e.day == today and now - e.created < ANSWER_CACHE_TTL_SECONDS
+        ]
+        if len(live) != len(self.entries):
+            self.entries = live
+            self._rebuild()
+
+    def add(self, entry: CachedAnswer):
+        self.entries.append(entry)
+        # Oldest first out once the per-user bound is reached.
+        self.entries = self.entries[-ANSWER_CACHE_MAX_PER_USER:]
+        self._rebuild()
+
+
+class AnswerCache:
+    def __init__(self):
+        self._users = LRUCache(ANSWER_CACHE_MAX_USERS)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.saved_latency = 0.0
+
+    def lookup(self, clerk_id: str, query_vector: np.ndarray, filters_key: str, data_version: int) -> Optional[CachedAnswer]:
+        """ Returns the closest cached answer that is still valid, or None. """
+        query_vector = np.asarray(query_vector, dtype=np.float32).reshape(-1)
+        with self._lock:
+            user = self._users.get(clerk_id)
+            best = None
+            if user is not None:
+                user.prune(data_version)
+                if user.matrix is not None:
+                    similarities = user.matrix @ query_vector
+                    for i in np.argsort(-similarities):
+                        if similarities[i] < ANSWER_CACHE_SIMILARITY_THRESHOLD:
+                            break
+                        if user.entries[i].filters_key == filters_key:
+                            best = user.entries[i]
+                            break
+            if best is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self.saved_latency += best.latency
+            return best
+
+    def store(self, clerk_id: str, query_vector: np.ndarray, filters_key: str, data_version: int, answer: str,
+              sources: List[RetrievedTransaction], latency: float) -> None:
+        entry = CachedAnswer(np.asarray(query_vector, dtype=np.float32).reshape(-1), filters_key, data_version,
+                             answer, sources, latency)
+        with self._lock:
+            user = self._users.get(clerk_id)
+            if user is None:
+                user = _UserAnswers()
+                self._users.put(clerk_id, user)
+            user.prune(data_version)
+            user.add(entry)
+
+    def invalidate(self, clerk_id: str) -> None:
+        """ Drops every cached answer for a user after their data changed. """
+        with self._lock:
+            self._users.pop(clerk_id)
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": self.hits / lookups if lookups else 0.0,
+            "saved_latency_seconds": round(self.saved_latency, 3),
+            "users": len(self._users),
+        }
+
+
+answer_cache = AnswerCache()
+
+
+def _collect_metrics() -> metrics.Collected:
+    return [
+        ("finchat_answer_cache_hits_total", "counter", "Chat answers served from the cache.", answer_cache.hits),
+        ("finchat_answer_cache_misses_total", "counter", "Chat answer cache lookups that missed.", answer_cache.misses),
+        ("finchat_answer_cache_saved_seconds_total", "counter", "Generation latency saved by cache hits.",
+         answer_cache.saved_latency),
+        ("finchat_answer_cache_users", "gauge", "Users with cached answers.", len(answer_cache._users)),
+    ]
+
+
+metrics.register_collector(_collect_metrics)
@@ -0,0 +1,333 @@
+import asyncio
+import logging
+import re
+import threading
+import weakref
+from collections import Counter, OrderedDict, defaultdict, deque
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from app.core.config import CATEGORIZER_MAX_USERS, CATEGORIZER_WARM_LIMIT
+from app.core.database import get_db
+from app.core.models import TransactionCategory
+
+logger = logging.getLogger(__name__)
+
+# =============================================================================
+# LOCAL TRANSACTION CATEGORIZER
+# =============================================================================
+# Tier 1 of categorization. Descriptions are normalized and matched against a
+# merchant/keyword index (Aho-Corasick automaton) before anything is sent to
+# the LLM. The index is seeded with common merchants, shared by everyone. On top
+# of the seeds each user has their own learned merchants: warmed from that user's
+# already categorized rows, and fed with the categories of their uploads and every
+# LLM result for them, so the same merchant is never sent to the LLM twice. One
+# user's rows never decide another user's categories.
+#
+# Learned merchants are matched exactly as soon as they are learned. Short ones
+# are also matched inside longer descriptions, through two automatons per user:
+# a main one, and a small one over the keys learned since the main one was built.
+# flush() (once per chunk or page) rebuilds only the small one, and folds it into
+# the main one once it reaches _REBUILD_RATIO of its size, so a large upload
+# doesn't rebuild the user's whole automaton per chunk. Building and matching are
+# pure Python: callers on the event loop run them in a worker thread.
+
+_NON_ALNUM = re.compile(r"[^A-Z0-9 ]+")
+_HAS_DIGIT = re.compile(r"\d")
+
+# Learned merchants longer than this are only matched exactly, which keeps the
+# automaton small; short ones ("BLUE BOTTLE") also match inside longer descriptions.
+_MAX_LEARNED_PATTERN_TOKENS = 3
+# The recent keys' automaton is folded into the main one once it holds this many
+# keys, or this fraction of the main one's.
+_REBUILD_MIN_KEYS = 256
+_REBUILD_RATIO = 0.25
+
+# Seed keyword table: normalized keyword -> category.
+SEED_KEYWORDS: Dict[TransactionCategory, List[str]] = {
+    TransactionCategory.FOOD_DRINK: [
+        "STARBUCKS", "DUNKIN", "MCDONALDS", "CHIPOTLE", "SUBWAY", "TACO BELL", "BURGER KING",
+        "WENDYS", "DOMINOS", "PIZZA HUT", "PANERA", "DOORDASH", "UBER EATS", "GRUBHUB",
+        "CAFE", "COFFEE", "RESTAURANT", "BAR", "PUB", "GRILL", "DINER", "BAKERY",
+    ],
+    TransactionCategory.GROCERIES: [
+        "WHOLE FOODS", "TRADER JOE", "TRADER JOES", "SAFEWAY", "KROGER", "ALDI", "PUBLIX",
+        "WEGMANS", "SPROUTS", "HEB", "GROCERY", "SUPERMARKET", "INSTACART",
+    ],
+    TransactionCategory.TRANSPORT: [
+        "UBER", "UBER TRIP", "LYFT", "METRO", "TRANSIT", "PARKING", "TOLL", "AMTRAK",
+        "AIRLINES", "DELTA AIR", "UNITED AIRLINES", "SOUTHWEST",
+    ],
+    TransactionCategory.GAS: [
+        "SHELL", "CHEVRON", "EXXON", "EXXONMOBIL", "BP", "MOBIL", "ARCO", "SUNOCO", "VALERO", "GAS STATION",
+    ],
+    TransactionCategory.SHOPPING: [
+        "AMAZON", "AMZN", "TARGET", "WALMART", "COSTCO", "EBAY", "ETSY", "NORDSTROM", "MACYS", "IKEA",
+    ],
+    TransactionCategory.ELECTRONICS: ["BEST BUY", "APPLE STORE", "NEWEGG", "MICRO CENTER"],
+    TransactionCategory.HOME_IMPROVEMENT: ["HOME DEPOT", "LOWES", "ACE HARDWARE", "MENARDS"],
+    TransactionCategory.ENTERTAINMENT: [
+        "NETFLIX", "SPOTIFY", "HULU", "DISNEY PLUS", "HBO", "STEAM", "PLAYSTATION", "XBOX",
+        "CINEMA", "AMC", "TICKETMASTER",
+    ],
+    TransactionCategory.UTILITIES: [
+        "ELECTRIC", "WATER", "PG E", "CON EDISON", "COMCAST", "XFINITY", "VERIZON", "AT T",
+        "T MOBILE", "SPECTRUM", "INTERNET",
+    ],
+    TransactionCategory.HOUSING: ["RENT", "MORTGAGE", "HOA", "APARTMENTS", "PROPERTY MGMT"],
+    TransactionCategory.HEALTH: [
+        "CVS", "WALGREENS", "PHARMACY", "DENTAL", "CLINIC", "HOSPITAL", "GYM", "FITNESS", "PLANET FITNESS",
+    ],
+    TransactionCategory.BILLS: ["INSURANCE", "GEICO", "STATE FARM", "PROGRESSIVE", "LOAN PAYMENT"],
+    TransactionCategory.INCOME: ["PAYROLL", "DIRECT DEP", "DIRECT DEPOSIT", "SALARY", "INTEREST PAID", "DIVIDEND"],
+    TransactionCategory.TRANSFERS: ["ZELLE", "VENMO", "PAYPAL", "TRANSFER", "CASH APP", "WIRE"],
+    TransactionCategory.REFUND: ["REFUND", "RETURN CREDIT", "REVERSAL"],
+}
+
+
+def normalize_description(description: str) -> str:
+    """
+    Canonical merchant form of a description: upper-case, punctuation stripped and
+    tokens containing digits (store numbers, card refs, dates) dropped.
+    "Starbucks #1234 Seattle" -> "STARBUCKS SEATTLE"
+    """
+    tokens = _NON_ALNUM.sub(" ", description.upper()).split()
+    return " ".join(t for t in tokens if not _HAS_DIGIT.search(t))
+
+
+class AhoCorasick:
+    """ Multi-pattern matcher: finds every pattern occurring in a text in one pass. """
+
+    def __init__(self, patterns: Dict[str, object]):
+        self._goto: List[Dict[str, int]] = [{}]
+        self._fail: List[int] = [0]
+        self._out: List[List[Tuple[str, object]]] = [[]]
+
+        for pattern, value in patterns.items():
+            node = 0
+            for ch in pattern:
+                nxt = self._goto[node].get(ch)
+                if nxt is None:
+                    nxt = len(self._goto)
+                    self._goto[node][ch] = nxt
+                    self._goto.append({})
+                    self._fail.append(0)
+                    self._out.append([])
+                node = nxt
+            self._out[node].append((pattern, value))
+
+        # Breadth-first pass to compute failure links.
+        queue = deque(self._goto[0].values())
+        while queue:
+            node = queue.popleft()
+            for ch, child in self._goto[node].items():
+                queue.append(child)
+                fail = self._fail[node]
+                while fail and ch not in self._goto[fail]:
+                    fail = self._fail[fail]
+                target = self._goto[fail].get(ch, 0)
+                self._fail[child] = target if target != child else 0
+                self._out[child] = self._out[child] + self._out[self._fail[child]]
+
+    def find_all(self, text: str) -> List[Tuple[str, object]]:
+        matches = []
+        node = 0
+        for ch in text:
+            while node and ch not in self._goto[node]:
+                node = self._fail[node]
+            node = self._goto[node].get(ch, 0)
+            if self._out[node]:
+                matches.extend(self._out[node])
+        return matches
+
+
+class _LearnedKeys:
+    """ One user's learned merchants: exact keys, plus automatons over the short ones. """
+
+    def __init__(self):
+        self.exact: Dict[str, TransactionCategory] = {}
+        self.automaton: Optional[AhoCorasick] = None
+        self.automaton_keys = 0
+        # Short keys learned since the main automaton was built, and their own automaton.
+        self.recent: Dict[str, TransactionCategory] = {}
+        self.recent_automaton: Optional[AhoCorasick] = None
+        self.pending = False
+        # Whether the user's categorized rows in the database have been learned (ensure_warm).
+        self.warmed = False
+
+
+class CategoryIndex:
+    """
+    Merchant/keyword -> TransactionCategory index.
+
+    Lookup order: exact normalized description learned from the user's earlier rows,
+    then the longest keyword found anywhere in the description (the user's learned
+    keys win ties over seeds). Learned keys of the least recently used users are
+    dropped beyond CATEGORIZER_MAX_USERS; ensure_warm loads them again.
+    """
+
+    def __init__(self):
+        self._seed: Dict[str, TransactionCategory] = {
+            keyword: category for category, keywords in SEED_KEYWORDS.items() for keyword in keywords
+        }
+        self._seed_automaton: Optional[AhoCorasick] = None
+        self._users: "OrderedDict[str, _LearnedKeys]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def warm(self) -> None:
+        """ Builds the shared seed automaton ahead of the first lookup. """
+        self._seed_matcher()
+
+    def _seed_matcher(self) -> AhoCorasick:
+        with self._lock:
+            if self._seed_automaton is None:
+                self._seed_automaton = _build_automaton(self._seed, 0)
+            return self._seed_automaton
+
+    def _learned(self, clerk_id: str) -> _LearnedKeys:
+        with self._lock:
+            learned = self._users.get(clerk_id)
+            if learned is None:
+                learned = self._users[clerk_id] = _LearnedKeys()
+                while len(self._users) > CATEGORIZER_MAX_USERS:
+                    self._users.popitem(last=False)
+            else:
+                self._users.move_to_end(clerk_id)
+            return learned
+
+    def is_warm(self, clerk_id: str) -> bool:
+        learned = self._users.get(clerk_id)
+        return learned is not None and learned.warmed
+
+    def match(self, clerk_id: str, description: str) -> Optional[TransactionCategory]:
+        key = normalize_description(description)
+        if not key:
+            self.misses += 1
+            return None
+
+        learned = self._learned(clerk_id)
+        category = learned.exact.get(key)
+        if category is None:
+            padded = f" {key} "
+            matches = self._seed_matcher().find_all(padded)
+            for automaton in (learned.automaton, learned.recent_automaton):
+                if automaton is not None:
+                    matches.extend(automaton.find_all(padded))
+            if matches:
+                _, (_, _, category) = max(matches, key=lambda m: m[1][:2])
+
+        if category is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return category
+
+    def learn(self, clerk_id: str, description: str, category: TransactionCategory) -> None:
+        """ Matched exactly right away; as a keyword inside longer descriptions after the next flush(). """
+        key = normalize_description(description)
+        learned = self._learned(clerk_id)
+        if not key or learned.exact.get(key) == category:
+            return
+        with self._lock:
+            learned.exact[key] = category
+            if key.count(" ") < _MAX_LEARNED_PATTERN_TOKENS:
+                learned.recent[key] = category
+                learned.pending = True
+
+    def learn_many(self, clerk_id: str, rows: Iterable[Tuple[str, TransactionCategory, int]]) -> None:
+        """
+        Warms the user's keys from (description, category, count) rows, keeping the
+        majority category per merchant. Builds the user's automaton: run it off the event loop.
+        """
+        votes: Dict[str, Counter] = defaultdict(Counter)
+        for description, category, count in rows:
+            key = normalize_description(description)
+            if key:
+                votes[key][category] += count
+        learned = self._learned(clerk_id)
+        with self._lock:
+            for key, counter in votes.items():
+                learned.exact[key] = counter.most_common(1)[0][0]
+            learned.warmed = True
+        self._rebuild(learned)
+
+    def flush(self, clerk_id: str) -> None:
+        """
+        Makes short keys learned since the last flush match inside longer descriptions.
+        Pure Python automaton building: run it off the event loop.
+        """
+        learned = self._learned(clerk_id)
+        if not learned.pending:
+            return
+        if len(learned.recent) >= max(_REBUILD_MIN_KEYS, _REBUILD_RATIO * learned.automaton_keys):
+            self._rebuild(learned)
+            return
+        with self._lock:
+            recent = dict(learned.recent)
+            learned.pending = False
+        learned.recent_automaton = _build_automaton(recent, 2)
+
+    def _rebuild(self, learned: _LearnedKeys) -> None:
+        """ Builds the main automaton over all of the user's short keys and empties the recent one. """
+        with self._lock:
+            short = {k: v for k, v in learned.exact.items() if k.count(" ") < _MAX_LEARNED_PATTERN_TOKENS}
+            learned.recent = {}
+            learned.pending = False
+        automaton = _build_automaton(short, 1) if short else None
+        learned.automaton, learned.automaton_keys, learned.recent_automaton = automaton, len(short), None
+
+    def __len__(self) -> int:
+        return len(self._seed) + sum(len(learned.exact) for learned in self._users.values())
+
+
+def _build_automaton(keys: Dict[str, TransactionCategory], priority: int) -> AhoCorasick:
+    # Patterns are padded with spaces so they only match whole words.
+    return AhoCorasick({f" {k} ": (len(k), priority, v) for k, v in keys.items()})
+
+
+# Shared, process-wide index
+category_index = CategoryIndex()
+
+# One warm-up per user at a time; held weakly, so a user's lock goes away once nobody waits on it.
+_warm_locks: "weakref.WeakValueDictionary[str, asyncio.Lock]" = weakref.WeakValueDictionary()
+
+
+def coerce_category(value) -> Optional[TransactionCategory]:
+    """ Returns the TransactionCategory for a value, or None if it is not a known category. """
+    try:
+        return TransactionCategory(value)
+    except ValueError:
+        return None
+
+
+async def ensure_warm(clerk_id: str) -> None:
+    """ Learns from the user's already-categorized rows in the database, once per user while they stay cached. """
+    if category_index.is_warm(clerk_id):
+        return
+    warm_lock = _warm_locks.get(clerk_id)
+    if warm_lock is None:
+        warm_lock = _warm_locks[clerk_id] = asyncio.Lock()
+    async with warm_lock:
+        if category_index.is_warm(clerk_id):
+            return
+        rows = []
+        try:
+            db = await get_db()
+            transactions_collection = db.get_collection("transactions")
+            pipeline = [
+                {"$match": {"clerk_id": clerk_id, "category": {"$ne": None}}},
+                {"$group": {
+                    "_id": {"description": "$description", "category": "$category"},
+                    "count": {"$sum": 1},
+                }},
+                {"$limit": CATEGORIZER_WARM_LIMIT},
+            ]
+            async for doc in transactions_collection.aggregate(pipeline):
+                category = coerce_category(doc["_id"]["category"])
+                if category is not None:
+                    rows.append((doc["_id"]["description"], category, doc["count"]))
+            logger.info(f"Category index warmed for user {clerk_id} from {len(rows)} categorized rows")
+        except Exception as e:
+            logger.error(f"Failed to warm category index for user {clerk_id} from the database: {e}")
+        await asyncio.to_thread(category_index.learn_many, clerk_id, rows)
@@ -0,0 +1,245 @@
+import io
+import os
+from typing import TYPE_CHECKING, List, Optional, Tuple
+
+import numpy as np
+
+from app.core import lazy_imports
+from app.core.models import TransactionCategory
+
+if TYPE_CHECKING:
+    import pandas as pd
+
+# =============================================================================
+# CSV CHUNK PARSING (runs in the parse pool)
+# =============================================================================
+# The CPU-bound half of an import: tokenizing CSV bytes, parsing dates and
+# amounts, and validating rows. Everything here is a plain function of its
+# arguments, so app.services.csv_parser can run it inline, in a thread, or in
+# a pool of worker processes. Keep this module's imports light: it is what
+# each pool process imports.
+#
+# A file is split into byte ranges that end on a record boundary (see
+# plan_chunks); each range is parsed independently into a ParsedChunk: parallel
+# NumPy arrays for the valid rows, rather than a DataFrame or per-row dicts.
+#
+# pandas is imported inside the functions that use it: the API process imports
+# this module at startup but only needs pandas once a file is actually parsed.
+
+REQUIRED_COLUMNS = ['date', 'description', 'amount']
+
+CATEGORY_VALUES: List[str] = [c.value for c in TransactionCategory]
+# Code for rows without a category.
+NO_CATEGORY = -1
+_CATEGORY_CODES = {value: code for code, value in enumerate(CATEGORY_VALUES)}
+
+# Tried in order against a sample of the date column; month-first before day-first,
+# as pandas' own inference does. Anything else falls back to pandas' guess.
+DATE_FORMATS = (
+    "%Y-%m-%d", "%m/%d/%Y", "%d/%m/%Y", "%m/%d/%y", "%d/%m/%y", "%Y/%m/%d",
+    "%m-%d-%Y", "%d-%m-%Y", "%d.%m.%Y", "%Y%m%d", "%d %b %Y", "%b %d, %Y",
+    "%Y-%m-%d %H:%M:%S", "%Y-%m-%dT%H:%M:%S", "%m/%d/%Y %H:%M",
+)
+
+_SAMPLE_BYTES = 256 * 1024
+_SAMPLE_ROWS = 200
+_MIN_CHUNK_BYTES = 64 * 1024
+
+
+class ParsedChunk:
+    """ The valid rows of one CSV chunk as parallel arrays. Row i of every array is the same transaction. """
+
+    def __init__(self, rows_read: int, dates: np.ndarray, amounts: np.ndarray, descriptions: List[str],
+                 category_codes: np.ndarray, accounts: Optional[List[Optional[str]]]):
+        self.rows_read = rows_read  # rows in the chunk, including the invalid ones that were dropped
+        self.dates = dates  # datetime64[D]
+        self.amounts = amounts  # float64
+        self.descriptions = descriptions
+        self.category_codes = category_codes  # int8 into CATEGORY_VALUES, NO_CATEGORY for none
+        self.accounts = accounts  # None when the file has no account column
+
+    def __len__(self) -> int:
+        return len(self.descriptions)
+
+
+class ChunkPlan:
+    """ How a file is split: the header line, the detected layout, and byte ranges ending on record boundaries. """
+
+    def __init__(self, header: bytes, columns: Tuple[str, ...], date_sample: List[str],
+                 chunk_bytes: int, ranges: List[Tuple[int, int]]):
+        self.header = header
+        self.columns = columns  # normalized column names: the bank layout
+        self.date_sample = date_sample
+        self.chunk_bytes = chunk_bytes
+        self.ranges = ranges
+        self.date_format: Optional[str] = None  # settled by the caller, see csv_parser.plan_csv
+
+
+def warm_worker() -> None:
+    """ Submitted once per pool process at startup, so the first upload does not pay the pandas import. """
+    lazy_imports.load("pandas")
+
+
+def normalize_columns(columns) -> "pd.Index":
+    pd = lazy_imports.load("pandas")
+
+    return pd.Index(columns).astype(str).str.strip().str.lower()
+
+
+def read_columns(path: str) -> "pd.Index":
+    """ The normalized header of a CSV file. """
+    pd = lazy_imports.load("pandas")
+
+    try:
+        return normalize_columns(pd.read_csv(path, nrows=0).columns)
+    except Exception:
+        raise ValueError("Invalid CSV format.")
+
+
+def _record_ends(path: str, start: int, chunk_bytes: int, size: int) -> List[int]:
+    """
+    Offsets just past the newline that closes a record, roughly every `chunk_bytes`.
+    A newline only ends a record outside double quotes, so the quote parity is tracked
+    from `start` (the first data row) on.
+    """
+    ends = []
+    target = start + chunk_bytes
+    offset, quotes = start, 0
+    with open(path, "rb") as f:
+        f.seek(start)
+        while offset < size:
+            block = f.read(1024 * 1024)
+            if not block:
+                break
+            position = 0
+            while offset + len(block) > target:
+                newline = block.find(b"\n", max(target - offset, position))
+                if newline < 0:
+                    break
+                if (quotes + block.count(b'"', position, newline)) % 2 == 0:
+                    ends.append(offset + newline + 1)
+                    target = offset + newline + 1 + chunk_bytes
+                else:
+                    # Inside a quoted field: the next candidate is a later newline.
+                    target = offset + newline + 1
+                quotes += block.count(b'"', position, newline + 1)
+                position = newline + 1
+            quotes += block.count(b'"', position)
+            offset += len(block)
+    if not ends or ends[-1] < size:
+        ends.append(size)
+    return ends
+
+
+def plan_chunks(path: str, chunk_size: int, chunk_bytes: Optional[int] = None) -> ChunkPlan:
+    """
+    Splits a CSV file into ranges of roughly `chunk_size` rows. The rows-to-bytes ratio is
+    estimated from the start of the file; pass the `chunk_bytes` of an earlier plan to
+    reproduce it exactly (resumed imports rely on identical chunk boundaries).
+    """
+    pd = lazy_imports.load("pandas")
+
+    size = os.path.getsize(path)
+    with open(path, "rb") as f:
+        head = f.read(_SAMPLE_BYTES)
+    header_end = head.find(b"\n") + 1 or len(head)
+    header = head[:header_end]
+    try:
+        sample = pd.read_csv(io.BytesIO(head), nrows=_SAMPLE_ROWS, dtype=str)
+    except Exception:
+        raise ValueError("Invalid CSV format.")
+    sample.columns = normalize_columns(sample.columns)
+    date_sample = sample['date'].dropna().tolist() if 'date' in sample.columns else []
+
+    if chunk_bytes is None:
+        sampled_rows = max(head.count(b"\n", header_end), 1)
+        bytes_per_row = (len(head) - header_end) / sampled_rows
+        chunk_bytes = max(int(chunk_size * bytes_per_row), _MIN_CHUNK_BYTES)
+    ends = _record_ends(path, header_end, chunk_bytes, size) if size > header_end else []
+    ranges = list(zip([header_end] + ends[:-1], ends))
+    return ChunkPlan(header, tuple(sample.columns), date_sample, chunk_bytes, ranges)
+
+
+def detect_date_format(sample: List[str]) -> Optional[str]:
+    """ The first known format that parses every sampled value, else pandas' guess from the first value. """
+    pd = lazy_imports.load("pandas")
+
+    if not sample:
+        return None
+    values = pd.Series(sample, dtype=str).str.strip()
+    for date_format in DATE_FORMATS:
+        if date_format_fits(date_format, values):
+            return date_format
+    guessed = pd.tseries.api.guess_datetime_format(values.iloc[0])
+    return guessed if guessed and date_format_fits(guessed, values) else None
+
+
+def date_format_fits(date_format: str, sample) -> bool:
+    pd = lazy_imports.load("pandas")
+
+    parsed = pd.to_datetime(pd.Series(sample, dtype=str).str.strip(), format=date_format, errors="coerce")
+    return bool(parsed.notna().all())
+
+
+def parse_frame(df: "pd.DataFrame", date_format: Optional[str]) -> ParsedChunk:
+    """
+    Validates and converts a raw frame. Rows are dropped (as pydantic validation used to)
+    when the description is not text or the category is not a known TransactionCategory;
+    unparseable dates fail the whole chunk.
+    """
+    pd = lazy_imports.load("pandas")
+
+    df.columns = normalize_columns(df.columns)
+    if not all(col in df.columns for col in REQUIRED_COLUMNS):
+        raise ValueError("Missing required columns: date, description, amount.")
+    rows_read = len(df)
+
+    # Rows without a date are dropped; a date that does not parse fails the chunk.
+    has_date = df['date'].notna().to_numpy()
+    dates = np.full(rows_read, np.datetime64("NaT"), dtype="datetime64[D]")
+    try:
+        parsed = pd.to_datetime(df['date'][has_date].astype(str).str.strip(), format=date_format)
+    except Exception as e:
+        raise ValueError(f"Error processing CSV data types: {e}")
+    dates[has_date] = parsed.to_numpy().astype("datetime64[D]")
+    amounts = pd.to_numeric(df['amount'], errors='coerce').fillna(0.0).to_numpy(dtype=np.float64)
+
+    descriptions = df['description']
+    valid = has_date & descriptions.map(lambda v: isinstance(v, str)).to_numpy(dtype=bool)
+    if 'category' in df.columns:
+        categories = df['category']
+        category_codes = categories.map(_CATEGORY_CODES).fillna(NO_CATEGORY).to_numpy(dtype=np.int8)
+        # A provided but unknown category invalidates the row.
+        valid &= ~(categories.notna().to_numpy() & (category_codes == NO_CATEGORY))
+    else:
+        category_codes = np.full(rows_read, NO_CATEGORY, dtype=np.int8)
+    accounts = None
+    if 'account' in df.columns:
+        accounts = [None if pd.isna(v) else str(v).strip() for v in df['account'].to_numpy()[valid]]
+
+    return ParsedChunk(
+        rows_read=rows_read,
+        dates=dates[valid],
+        amounts=amounts[valid],
+        descriptions=descriptions.to_numpy()[valid].tolist(),
+        category_codes=category_codes[valid],
+        accounts=accounts,
+    )
+
+
+def parse_bytes(data: bytes, date_format: Optional[str]) -> ParsedChunk:
+    pd = lazy_imports.load("pandas")
+
+    try:
+        df = pd.read_csv(io.BytesIO(data))
+    except Exception:
+        raise ValueError("Invalid CSV format.")
+    return parse_frame(df, date_format)
+
+
+def parse_range(path: str, header: bytes, start: int, end: int, date_format: Optional[str]) -> ParsedChunk:
+    """ Parses bytes [start, end) of a CSV file, which `plan_chunks` aligned to record boundaries. """
+    with open(path, "rb") as f:
+        f.seek(start)
+        body = f.read(end - start)
+    return parse_bytes(header + body, date_format)
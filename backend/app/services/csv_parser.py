@@ -1,85 +1,294 @@
-import pandas as pd
-import io
-import numpy as np
-from fastapi import UploadFile, HTTPException
-from typing import List
+import asyncio
+import logging
+import multiprocessing
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from fastapi import HTTPException
+from typing import AsyncIterator, List, Optional, Tuple
 import os
-from dotenv import load_dotenv
+from app.core import lazy_imports, metrics
+from app.core.cache import LRUCache
+from app.core.config import (CSV_CHUNK_SIZE, CSV_DATE_FORMAT, CSV_PARSE_MODE, CSV_PARSE_WORKERS, LLM_MAX_CONCURRENCY,
+                             LLM_MAX_RETRIES, CATEGORY_MEMO_SIZE, CATEGORY_MEMO_TTL_SECONDS)
 from app.core.models import TransactionCreate, CategorizedTransaction, TransactionCategory
+from app.services import categorizer, csv_chunks
+from app.services.csv_chunks import NO_CATEGORY, REQUIRED_COLUMNS, ChunkPlan, ParsedChunk
 
-# LangChain Imports
-from langchain_openai import ChatOpenAI
-from langchain_core.prompts import ChatPromptTemplate
+logger = logging.getLogger(__name__)
 
-load_dotenv()
+_CATEGORIES = [TransactionCategory(value) for value in csv_chunks.CATEGORY_VALUES]
 
-async def parse_csv(file: UploadFile) -> List[TransactionCreate]:
-    # --- Initial file reading and data cleaning (same as before) ---
-    content = await file.read()
-    try:
-        df = pd.read_csv(io.BytesIO(content))
-    except Exception:
-        raise HTTPException(status_code=400, detail="Invalid CSV format.")
+# Bank layout (normalized column names) -> date format detected for it.
+_layout_date_formats = LRUCache(256)
 
-    df.columns = df.columns.str.strip().str.lower()
+# Normalized description -> category returned by the LLM, shared across uploads.
+_llm_category_memo = LRUCache(CATEGORY_MEMO_SIZE, ttl=CATEGORY_MEMO_TTL_SECONDS)
 
-    required_columns = ['date', 'description', 'amount']
-    if not all(col in df.columns for col in required_columns):
-        raise HTTPException(status_code=400, detail="Missing required columns: date, description, amount.")
+ROWS_PARSED = metrics.Counter("finchat_csv_rows_parsed_total", "CSV rows parsed and validated.")
+ROWS_CATEGORIZED = metrics.Counter(
+    "finchat_rows_categorized_total",
+    "Rows by where their category came from: provided, local_index, llm (incl. memoized answers) or failed.",
+    ["source"],
+)
+LLM_CATEGORIZATION_REQUESTS = metrics.Counter("finchat_llm_categorization_requests_total",
+                                              "Categorization requests sent to the LLM.")
+
+
+def build_categorization_chain():
+    # LangChain takes about a second to import; only categorization needs it (warmed in the background at startup).
+    ChatOpenAI = lazy_imports.load("langchain_openai").ChatOpenAI
+    ChatPromptTemplate = lazy_imports.load("langchain_core.prompts").ChatPromptTemplate
 
-    try:
-        df['date'] = pd.to_datetime(df['date']).dt.date
-        df['amount'] = pd.to_numeric(df['amount'], errors='coerce').fillna(0.0)
-        if 'category' not in df.columns:
-            df['category'] = np.nan
-        df['category'] = df['category'].replace({np.nan: None})
-    except Exception as e:
-        raise HTTPException(status_code=400, detail=f"Error processing CSV data types: {e}")
-
-    # --- LangChain Setup (same as before) ---
     model = ChatOpenAI(model="gpt-5-nano", temperature=0, api_key = os.getenv("LLM"))
     structured_llm = model.with_structured_output(CategorizedTransaction)
     prompt = ChatPromptTemplate.from_template(
         "Categorize the following financial transaction based on its description: '{description}'"
     )
-    categorization_chain = prompt | structured_llm
-
-    records = df.to_dict(orient='records')
-    
-    # --- BATCH PROCESSING LOGIC ---
-    
-    # 1. Separate records into those that need categorization and those that don't.
-    records_to_categorize = []
-    finalized_records = []
-    for record in records:
-        if pd.isna(record.get('category')):
-            records_to_categorize.append(record)
+    # Retry transient failures (rate limits, timeouts) with exponential backoff + jitter.
+    return (prompt | structured_llm).with_retry(
+        stop_after_attempt=LLM_MAX_RETRIES,
+        wait_exponential_jitter=True,
+    )
+
+
+def description_key(description: str) -> str:
+    """ Key under which identical descriptions are collapsed into one LLM request. """
+    return categorizer.normalize_description(description) or description.strip().upper()
+
+
+async def categorize_with_llm(descriptions: List[str], categorization_chain) -> dict:
+    """
+    Categorizes descriptions through the LLM, one request per distinct normalized description.
+    Returns {normalized description: category}; descriptions that still fail after retries are omitted.
+    """
+    categories = {}
+    pending = {}  # normalized description -> representative original description
+    for description in descriptions:
+        key = description_key(description)
+        if key in categories or key in pending:
+            continue
+        memoized = _llm_category_memo.get(key)
+        if memoized is not None:
+            categories[key] = memoized
         else:
-            finalized_records.append(record)
-
-    # 2. If there are records that need categorization, process them in a batch.
-    if records_to_categorize:
-        # Create a list of inputs for the batch call.
-        batch_inputs = [{"description": r['description']} for r in records_to_categorize]
-        
-        # Make a single, efficient batch call to the API.
-        batch_results = await categorization_chain.abatch(batch_inputs)
-        
-        # 3. Merge the results back into the original records.
-        for record, result in zip(records_to_categorize, batch_results):
-            record['category'] = result.category
-        
-        # Add the newly categorized records to our final list.
-        finalized_records.extend(records_to_categorize)
-
-    # --- Final Validation and Conversion ---
-    parsed_transactions: List[TransactionCreate] = []
-    for record in finalized_records:
+            pending[key] = description
+
+    if pending:
+        keys = list(pending)
+        LLM_CATEGORIZATION_REQUESTS.inc(len(keys))
+        with metrics.span("csv.categorize_llm"):
+            batch_results = await categorization_chain.abatch(
+                [{"description": pending[key]} for key in keys],
+                config={"max_concurrency": LLM_MAX_CONCURRENCY},
+                return_exceptions=True,
+            )
+        for key, result in zip(keys, batch_results):
+            if isinstance(result, Exception):
+                logger.warning(f"LLM categorization failed for '{pending[key]}': {result}")
+                continue
+            categories[key] = result.category
+            _llm_category_memo.put(key, result.category)
+
+    logger.info(f"Categorized {len(descriptions)} rows with {len(pending)} LLM requests")
+    return categories
+
+
+# --- Parsing (see app.services.csv_chunks) ---
+
+_parse_pool: Optional[ProcessPoolExecutor] = None
+
+
+def _get_parse_pool() -> ProcessPoolExecutor:
+    global _parse_pool
+    if _parse_pool is None:
+        # Spawned, not forked: a fork would copy the event loop, Mongo client threads and locks.
+        _parse_pool = ProcessPoolExecutor(max_workers=CSV_PARSE_WORKERS, mp_context=multiprocessing.get_context("spawn"))
+        logger.info(f"Started CSV parse pool with {CSV_PARSE_WORKERS} processes")
+    return _parse_pool
+
+
+async def warm_parse_pool() -> None:
+    """ Starts the parse pool's processes ahead of the first upload (process mode only). """
+    if CSV_PARSE_MODE != "process":
+        return
+    loop = asyncio.get_running_loop()
+    pool = _get_parse_pool()
+    await asyncio.gather(*(loop.run_in_executor(pool, csv_chunks.warm_worker) for _ in range(CSV_PARSE_WORKERS)))
+
+
+def shutdown_parse_pool() -> None:
+    global _parse_pool
+    if _parse_pool is not None:
+        _parse_pool.shutdown(wait=True, cancel_futures=True)
+        _parse_pool = None
+
+
+async def _run_parse(fn, *args):
+    """ Runs a csv_chunks function per CSV_PARSE_MODE. Malformed data (ValueError) becomes a 400. """
+    global _parse_pool
+    try:
+        if CSV_PARSE_MODE == "process":
+            return await asyncio.get_running_loop().run_in_executor(_get_parse_pool(), fn, *args)
+        if CSV_PARSE_MODE == "thread":
+            return await asyncio.to_thread(fn, *args)
+        return fn(*args)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except BrokenProcessPool:
+        # A worker died (e.g. killed for memory); the next parse starts a fresh pool.
+        _parse_pool = None
+        raise
+
+
+def _date_format_for(plan: ChunkPlan) -> Optional[str]:
+    """ CSV_DATE_FORMAT, else the format cached for this layout if the sample still fits it, else a fresh detection. """
+    if CSV_DATE_FORMAT:
+        return CSV_DATE_FORMAT
+    cached = _layout_date_formats.get(plan.columns)
+    if cached is not None and (not plan.date_sample or csv_chunks.date_format_fits(cached, plan.date_sample)):
+        return cached
+    date_format = csv_chunks.detect_date_format(plan.date_sample)
+    if date_format is not None:
+        _layout_date_formats.put(plan.columns, date_format)
+    else:
+        logger.warning(f"No date format fits layout {plan.columns}; pandas will infer it per chunk")
+    return date_format
+
+
+def _plan_sync(path: str, chunk_size: int, chunk_bytes: Optional[int]) -> ChunkPlan:
+    plan = csv_chunks.plan_chunks(path, chunk_size, chunk_bytes)
+    if not all(col in plan.columns for col in REQUIRED_COLUMNS):
+        raise ValueError("Missing required columns: date, description, amount.")
+    plan.date_format = _date_format_for(plan)
+    return plan
+
+
+async def plan_csv(path: str, chunk_size: int = CSV_CHUNK_SIZE, chunk_bytes: Optional[int] = None) -> ChunkPlan:
+    """
+    Splits a CSV file into chunks of about `chunk_size` rows and settles its date format.
+    Pass a previous plan's `chunk_bytes` to get the same chunks again.
+    """
+    with metrics.span("csv.plan"):
         try:
-            filtered_record = {k: v for k, v in record.items() if k in TransactionCreate.__fields__}
-            transaction = TransactionCreate(**filtered_record)
-            parsed_transactions.append(transaction)
-        except Exception:
-            continue
+            return await asyncio.to_thread(_plan_sync, path, chunk_size, chunk_bytes)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+
+
+async def iter_parsed_chunks(path: str, plan: ChunkPlan) -> AsyncIterator[ParsedChunk]:
+    """
+    Yields the planned chunks of a CSV file in order, parsed into columns. In process
+    mode up to CSV_PARSE_WORKERS chunks are parsed ahead, so parsing overlaps with the
+    consumer's categorization and writes while memory stays bounded.
+    """
+    ranges = iter(plan.ranges)
+    pending = deque()
+
+    def parse_next() -> None:
+        byte_range = next(ranges, None)
+        if byte_range is not None:
+            pending.append(asyncio.ensure_future(
+                _run_parse(csv_chunks.parse_range, path, plan.header, *byte_range, plan.date_format)
+            ))
+
+    for _ in range(CSV_PARSE_WORKERS if CSV_PARSE_MODE == "process" else 1):
+        parse_next()
+    try:
+        while pending:
+            # Time the consumer actually waits for a parsed chunk.
+            with metrics.span("csv.parse_wait"):
+                chunk = await pending.popleft()
+            parse_next()
+            yield chunk
+    finally:
+        for future in pending:
+            future.cancel()
+
 
-    return parsed_transactions
\ No newline at end of file
+def _categorize_locally(chunk: ParsedChunk, clerk_id: str) -> Tuple[List[Optional[TransactionCategory]], List[int], int]:
+    """ (categories, rows left for the LLM, local matches) for a chunk, from provided categories and the local index. """
+    category_index = categorizer.category_index
+    descriptions = chunk.descriptions
+    categories: List[Optional[TransactionCategory]] = [None] * len(chunk)
+    to_categorize = []
+    local_matches = 0
+    for i, code in enumerate(chunk.category_codes.tolist()):
+        if code == NO_CATEGORY:
+            local_category = category_index.match(clerk_id, descriptions[i])
+            if local_category is None:
+                to_categorize.append(i)
+                continue
+            categories[i] = local_category
+            local_matches += 1
+        else:
+            categories[i] = _CATEGORIES[code]
+            category_index.learn(clerk_id, descriptions[i], categories[i])
+    return categories, to_categorize, local_matches
+
+
+async def categorize_chunk(chunk: ParsedChunk, categorization_chain, clerk_id: str) -> List[TransactionCreate]:
+    """
+    Fills in missing categories and converts the chunk to TransactionCreate, in file order.
+    Rows are resolved by the user's local category index first; only the misses go to the LLM.
+    """
+    await categorizer.ensure_warm(clerk_id)
+    category_index = categorizer.category_index
+    descriptions = chunk.descriptions
+
+    # 1. Keep provided categories (they also teach the local index about their merchant)
+    #    and look the rest up locally; collect the misses. Pure Python over the whole
+    #    chunk, so it runs in a worker thread.
+    with metrics.span("csv.categorize_local"):
+        categories, to_categorize, local_matches = await asyncio.to_thread(_categorize_locally, chunk, clerk_id)
+    ROWS_CATEGORIZED.inc(len(chunk) - len(to_categorize) - local_matches, source="provided")
+    ROWS_CATEGORIZED.inc(local_matches, source="local_index")
+
+    # 2. Send each distinct missing description to the LLM once, then fan the results
+    #    back out to every row and feed them to the local index.
+    if to_categorize:
+        llm_categories = await categorize_with_llm([descriptions[i] for i in to_categorize], categorization_chain)
+        resolved = 0
+        for i in to_categorize:
+            category = llm_categories.get(description_key(descriptions[i]))
+            if category is not None:
+                categories[i] = category
+                category_index.learn(clerk_id, descriptions[i], category)
+                resolved += 1
+        ROWS_CATEGORIZED.inc(resolved, source="llm")
+        ROWS_CATEGORIZED.inc(len(to_categorize) - resolved, source="failed")
+    # Fold this chunk's newly learned merchants into the user's keyword matcher, once.
+    await asyncio.to_thread(category_index.flush, clerk_id)
+
+    with metrics.span("csv.build"):
+        parsed_transactions = chunk_to_transactions(chunk, categories)
+    ROWS_PARSED.inc(len(parsed_transactions))
+    return parsed_transactions
+
+
+def chunk_to_transactions(chunk: ParsedChunk, categories: Optional[List[Optional[TransactionCategory]]] = None) -> List[TransactionCreate]:
+    """
+    Builds TransactionCreate objects from already-validated columns, without re-validating
+    each row. Without `categories`, the chunk's own (provided) categories are used; that is
+    how already-imported chunks are replayed when an import job resumes.
+    """
+    if categories is None:
+        categories = [None if code == NO_CATEGORY else _CATEGORIES[code] for code in chunk.category_codes.tolist()]
+    accounts = chunk.accounts if chunk.accounts is not None else [None] * len(chunk)
+    construct = TransactionCreate.model_construct
+    return [
+        construct(date=date, description=description, amount=amount, category=category, account=account)
+        for date, description, amount, category, account in zip(
+            chunk.dates.astype("datetime64[s]").tolist(), chunk.descriptions, chunk.amounts.tolist(), categories, accounts
+        )
+    ]
+
+
+def check_header(path: str) -> None:
+    """ Fails fast (400) on files that are not CSV or lack the required columns. """
+    try:
+        columns = csv_chunks.read_columns(path)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if not all(col in columns for col in REQUIRED_COLUMNS):
+        raise HTTPException(status_code=400, detail="Missing required columns: date, description, amount.")
@@ -0,0 +1,225 @@
+import asyncio
+import fcntl
+import hashlib
+import logging
+import os
+import re
+import threading
+from typing import Awaitable, Callable, Dict, List, Optional, Tuple
+
+import numpy as np
+
+from app.core import metrics
+from app.core.cache import LRUCache
+from app.core.config import EMBEDDING_CACHE_DIR, EMBEDDING_CACHE_MEMORY_SIZE
+
+logger = logging.getLogger(__name__)
+
+# =============================================================================
+# CONTENT-ADDRESSED EMBEDDING CACHE
+# =============================================================================
+# Descriptions repeat heavily across users ("UBER TRIP", payroll lines...), so
+# embeddings are cached by hash(model + normalized text) and shared by everyone.
+#
+#   Tier 1: bounded in-memory LRU of key -> float32 vector.
+#   Tier 2: per-model on-disk store, shared by all workers on the host:
+#           <slug>.f32  append-only float32 matrix, read through np.memmap
+#           <slug>.idx  append-only offset index, one "<key> <row>" per line
+#           <slug>.dim  embedding dimensionality
+#
+# Appends to both files happen under an exclusive flock, vectors first, so a
+# key is never visible before its row has been written.
+
+_WHITESPACE = re.compile(r"\s+")
+
+
+def normalize_text(text: str) -> str:
+    """ Case- and whitespace-insensitive form of a description used for cache keys. """
+    return _WHITESPACE.sub(" ", text).strip().lower()
+
+
+def cache_key(text: str, model: str) -> str:
+    return hashlib.sha1(f"{model}\x00{normalize_text(text)}".encode("utf-8")).hexdigest()
+
+
+class _DiskTier:
+    """ Append-only memory-mapped float32 matrix plus a key -> row offset index. """
+
+    def __init__(self, directory: str, model: str):
+        slug = re.sub(r"[^A-Za-z0-9_.-]", "_", model)
+        os.makedirs(directory, exist_ok=True)
+        self.vectors_path = os.path.join(directory, f"{slug}.f32")
+        self.keys_path = os.path.join(directory, f"{slug}.idx")
+        self.dim_path = os.path.join(directory, f"{slug}.dim")
+        self.dim: Optional[int] = None
+        self.offsets: Dict[str, int] = {}
+        self._keys_read = 0  # bytes of the key file already loaded into `offsets`
+        self._matrix: Optional[np.memmap] = None
+        self._lock = threading.Lock()
+        self._refresh()
+
+    def _refresh(self):
+        """ Picks up rows appended by this or other processes since the last read. """
+        if self.dim is None and os.path.exists(self.dim_path):
+            with open(self.dim_path, "r") as f:
+                self.dim = int(f.read().strip())
+        if not os.path.exists(self.keys_path):
+            return
+        with open(self.keys_path, "rb") as f:
+            f.seek(self._keys_read)
+            tail = f.read()
+        # Only consume complete lines; a partial line is finished by its writer.
+        complete = tail[:tail.rfind(b"\n") + 1]
+        for line in complete.splitlines():
+            key, row = line.decode("ascii").split(" ")
+            self.offsets[key] = int(row)
+        self._keys_read += len(complete)
+
+    def _rows(self, row: int) -> np.ndarray:
+        if self._matrix is None or self._matrix.shape[0] <= row:
+            n_rows = os.path.getsize(self.vectors_path) // (4 * self.dim)
+            self._matrix = np.memmap(self.vectors_path, dtype=np.float32, mode="r", shape=(n_rows, self.dim))
+        return self._matrix[row]
+
+    def get(self, key: str) -> Optional[np.ndarray]:
+        with self._lock:
+            row = self.offsets.get(key)
+            if row is None:
+                self._refresh()
+                row = self.offsets.get(key)
+                if row is None:
+                    return None
+            return np.array(self._rows(row))
+
+    def put_many(self, keys: List[str], vectors: np.ndarray):
+        vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+        with self._lock, open(self.keys_path, "ab") as keys_file:
+            fcntl.flock(keys_file, fcntl.LOCK_EX)
+            try:
+                self._refresh()
+                if self.dim is None:
+                    with open(self.dim_path, "w") as f:
+                        f.write(str(vectors.shape[1]))
+                    self.dim = vectors.shape[1]
+                if vectors.shape[1] != self.dim:
+                    logger.warning(f"Embedding dim {vectors.shape[1]} != cached dim {self.dim}; skipping disk cache write")
+                    return
+                fresh = [i for i, key in enumerate(keys) if key not in self.offsets]
+                if not fresh:
+                    return
+                row_bytes = 4 * self.dim
+                with open(self.vectors_path, "ab") as vectors_file:
+                    size = vectors_file.seek(0, os.SEEK_END)
+                    first_row = size // row_bytes
+                    if size != first_row * row_bytes:
+                        # An interrupted write left part of a row; appending after it would
+                        # shift every new row off the offsets recorded for it.
+                        vectors_file.truncate(first_row * row_bytes)
+                        logger.warning(f"Dropped {size - first_row * row_bytes} bytes of a partial row from {self.vectors_path}")
+                    vectors_file.write(vectors[fresh].tobytes())
+                    vectors_file.flush()
+                    os.fsync(vectors_file.fileno())
+                keys_file.write("".join(
+                    f"{keys[i]} {first_row + n}\n" for n, i in enumerate(fresh)
+                ).encode("ascii"))
+                keys_file.flush()
+                self._refresh()
+            finally:
+                fcntl.flock(keys_file, fcntl.LOCK_UN)
+
+
+class EmbeddingCache:
+    """ Two-tier (memory LRU + on-disk) embedding cache with hit-rate counters. """
+
+    def __init__(self, directory: str = EMBEDDING_CACHE_DIR, memory_size: int = EMBEDDING_CACHE_MEMORY_SIZE):
+        self.directory = directory
+        self.memory = LRUCache(memory_size)
+        self._disk: Dict[str, _DiskTier] = {}
+        self._disk_lock = threading.Lock()
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+    def _disk_tier(self, model: str) -> _DiskTier:
+        with self._disk_lock:
+            if model not in self._disk:
+                self._disk[model] = _DiskTier(self.directory, model)
+            return self._disk[model]
+
+    def lookup(self, texts: List[str], model: str) -> Tuple[List[str], Dict[str, np.ndarray], Dict[str, str]]:
+        """
+        Resolves texts against both tiers.
+        Returns (key per text, {key: vector} found, {key: first original text} missing).
+        """
+        keys = [cache_key(t, model) for t in texts]
+        found: Dict[str, np.ndarray] = {}
+        missing: Dict[str, str] = {}
+        disk = self._disk_tier(model)
+
+        for key, text in zip(keys, texts):
+            if key in found or key in missing:
+                continue
+            vector = self.memory.get(key)
+            if vector is not None:
+                self.memory_hits += 1
+                found[key] = vector
+                continue
+            vector = disk.get(key)
+            if vector is not None:
+                self.disk_hits += 1
+                self.memory.put(key, vector)
+                found[key] = vector
+                continue
+            self.misses += 1
+            missing[key] = text
+        return keys, found, missing
+
+    def store(self, model: str, keys: List[str], vectors: np.ndarray) -> None:
+        """ Writes freshly computed vectors to both tiers. """
+        for key, vector in zip(keys, vectors):
+            self.memory.put(key, vector)
+        try:
+            self._disk_tier(model).put_many(keys, vectors)
+        except OSError as e:
+            logger.warning(f"Could not persist embeddings to disk cache: {e}")
+
+    async def aget_or_compute(self, texts: List[str], model: str,
+                              compute: Callable[[List[str]], Awaitable[np.ndarray]]) -> np.ndarray:
+        """
+        Returns an (n, dim) float32 matrix of embeddings for `texts`. Only texts missing
+        from both tiers are passed to `compute`, each unique normalized text once.
+        Disk-tier reads and writes run in a worker thread.
+        """
+        keys, found, missing = await asyncio.to_thread(self.lookup, texts, model)
+        if missing:
+            missing_keys = list(missing)
+            vectors = np.asarray(await compute([missing[k] for k in missing_keys]), dtype=np.float32)
+            found.update(zip(missing_keys, vectors))
+            await asyncio.to_thread(self.store, model, missing_keys, vectors)
+        return np.vstack([found[key] for key in keys])
+
+    def stats(self) -> Dict[str, float]:
+        lookups = self.memory_hits + self.disk_hits + self.misses
+        return {
+            "memory_hits": self.memory_hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+            "hit_rate": (self.memory_hits + self.disk_hits) / lookups if lookups else 0.0,
+            "memory_entries": len(self.memory),
+        }
+
+
+# Shared, process-wide cache instance
+embedding_cache = EmbeddingCache()
+
+
+def _collect_metrics() -> metrics.Collected:
+    return [
+        ("finchat_embedding_cache_memory_hits_total", "counter", "Embeddings served from memory.", embedding_cache.memory_hits),
+        ("finchat_embedding_cache_disk_hits_total", "counter", "Embeddings served from disk.", embedding_cache.disk_hits),
+        ("finchat_embedding_cache_misses_total", "counter", "Embeddings that had to be computed.", embedding_cache.misses),
+        ("finchat_embedding_cache_memory_entries", "gauge", "Embeddings held in memory.", len(embedding_cache.memory)),
+    ]
+
+
+metrics.register_collector(_collect_metrics)
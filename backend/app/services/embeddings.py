@@ -0,0 +1,151 @@
+import asyncio
+import logging
+from typing import Callable, Dict, List, Optional
+
+import numpy as np
+
+from app.core import metrics
+from app.core.config import (
+    EMBEDDING_BACKEND,
+    EMBEDDING_BATCH_SIZE,
+    EMBEDDING_MODEL,
+    LOCAL_EMBEDDING_BATCH_SIZE,
+    OPENAI_EMBEDDING_TIMEOUT_SECONDS,
+)
+from app.services import local_embeddings, openai_client
+from app.services.embedding_cache import embedding_cache
+
+logger = logging.getLogger(__name__)
+
+EMBEDDED_TEXTS = metrics.Counter("finchat_embedding_texts_total", "Texts sent to the embeddings API (cache misses).")
+LOCAL_EMBEDDED_TEXTS = metrics.Counter("finchat_local_embedding_texts_total", "Texts embedded on the local CPU backend.")
+
+# =============================================================================
+# EMBEDDING BACKENDS
+# =============================================================================
+# embed_texts() is the only way the app turns text into vectors (vector index
+# writes and chat queries). EMBEDDING_BACKEND picks what computes them:
+#
+#   openai - EMBEDDING_MODEL over the API, one round trip per batch of cache
+#            misses, behind the shared embedding cache;
+#   local  - hashed word / character n-grams projected on the CPU
+#            (app.services.local_embeddings); no external calls, and cheaper to
+#            recompute than to look up, so the cache is skipped.
+#
+# The backend's `model` names its vector space. Vector indexes and cache entries
+# are keyed by it, so switching backends starts fresh indexes instead of mixing
+# vectors that are not comparable. Other backends plug in with register_backend.
+
+
+class EmbeddingBackend:
+    """ Computes embeddings for a list of texts: (n, dim) float32 with L2-normalized rows. """
+
+    model: str = ""
+    # Whether results go through the shared embedding cache.
+    cached: bool = True
+
+    async def embed(self, texts: List[str]) -> np.ndarray:
+        raise NotImplementedError
+
+    async def warm(self) -> None:
+        """ Loads whatever the first call would otherwise wait for (run by app.services.warmup). """
+
+
+class OpenAIEmbeddingBackend(EmbeddingBackend):
+
+    def __init__(self, model: str = EMBEDDING_MODEL):
+        self.model = model
+
+    async def embed(self, texts: List[str]) -> np.ndarray:
+        """ Calls the embeddings API in concurrent batches of EMBEDDING_BATCH_SIZE to stay under API limits. """
+        batches = await asyncio.gather(*(
+            self._embed_batch(texts[start:start + EMBEDDING_BATCH_SIZE])
+            for start in range(0, len(texts), EMBEDDING_BATCH_SIZE)
+        ))
+
+        embeddings = np.vstack(batches)
+        # Normalize so that inner product == cosine similarity
+        norms = np.linalg.norm(embeddings, axis=1, keepdims=True)
+        norms[norms == 0] = 1.0
+        return embeddings / norms
+
+    async def _embed_batch(self, texts: List[str]) -> np.ndarray:
+        async with openai_client.concurrency_limit():
+            with metrics.span("openai.embeddings"):
+                response = await openai_client.get_client().embeddings.create(
+                    input=texts,
+                    model=self.model,
+                    timeout=OPENAI_EMBEDDING_TIMEOUT_SECONDS,
+                )
+        EMBEDDED_TEXTS.inc(len(texts))
+        if response.usage is not None:
+            openai_client.LLM_TOKENS.inc(response.usage.prompt_tokens, model=self.model, kind="prompt")
+        return np.array([item.embedding for item in response.data], dtype=np.float32)
+
+    async def warm(self) -> None:
+        openai_client.get_client()
+
+
+class LocalEmbeddingBackend(EmbeddingBackend):
+    cached = False
+
+    def __init__(self):
+        self.model = local_embeddings.model_name()
+
+    async def embed(self, texts: List[str]) -> np.ndarray:
+        """ Vectorized batches of LOCAL_EMBEDDING_BATCH_SIZE, each in a thread off the event loop. """
+        batches = []
+        with metrics.span("embeddings.local"):
+            for start in range(0, len(texts), LOCAL_EMBEDDING_BATCH_SIZE):
+                batch = texts[start:start + LOCAL_EMBEDDING_BATCH_SIZE]
+                batches.append(await asyncio.to_thread(local_embeddings.embed, batch))
+        LOCAL_EMBEDDED_TEXTS.inc(len(texts))
+        return np.vstack(batches)
+
+    async def warm(self) -> None:
+        await asyncio.to_thread(local_embeddings.warm)
+
+
+_factories: Dict[str, Callable[[], EmbeddingBackend]] = {
+    "openai": OpenAIEmbeddingBackend,
+    "local": LocalEmbeddingBackend,
+}
+_backend: Optional[EmbeddingBackend] = None
+
+
+def register_backend(name: str, factory: Callable[[], EmbeddingBackend]) -> None:
+    """ Makes a backend selectable as EMBEDDING_BACKEND=`name`. """
+    _factories[name] = factory
+
+
+def get_backend() -> EmbeddingBackend:
+    """ The configured backend, created on first use. """
+    global _backend
+    if _backend is None:
+        factory = _factories.get(EMBEDDING_BACKEND)
+        if factory is None:
+            raise ValueError(f"Unknown EMBEDDING_BACKEND '{EMBEDDING_BACKEND}' (expected one of: {', '.join(_factories)})")
+        _backend = factory()
+        logger.info(f"Embedding backend: {EMBEDDING_BACKEND} ({_backend.model})")
+    return _backend
+
+
+def embedding_model() -> str:
+    """ The active vector space, for keying anything that stores embeddings. """
+    return get_backend().model
+
+
+async def embed_texts(texts: List[str]) -> np.ndarray:
+    """
+    Embeds a list of texts and returns an (n, dim) float32 matrix with L2-normalized rows.
+    With a cached backend, texts already embedded for any user are served from the shared
+    embedding cache and only cache misses reach the backend.
+    """
+    if not texts:
+        return np.empty((0, 0), dtype=np.float32)
+    backend = get_backend()
+    if not backend.cached:
+        return await backend.embed(texts)
+    result = await embedding_cache.aget_or_compute(texts, backend.model, backend.embed)
+    logger.debug(f"Embedding cache stats: {embedding_cache.stats()}")
+    return result
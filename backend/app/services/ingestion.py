@@ -0,0 +1,228 @@
+import asyncio
+import logging
+import os
+import shutil
+import uuid
+from collections import Counter
+from typing import BinaryIO, Dict, List, Optional, Set, Tuple
+
+from fastapi import HTTPException
+
+from app.core.config import CSV_CHUNK_SIZE, IMPORT_BATCH_SIZE, IMPORT_JOB_DIR
+from app.core.database import get_db
+from app.services import categorizer, csv_parser, jobs, user_service, vector_store
+
+logger = logging.getLogger(__name__)
+
+# =============================================================================
+# BACKGROUND INGESTION JOBS
+# =============================================================================
+# Job handlers for the work that used to run inside HTTP requests:
+#   - import_csv:        parse -> categorize -> persist an uploaded CSV, one chunk
+#                        of CSV_CHUNK_SIZE rows per checkpoint;
+#   - recategorize:      re-run categorization over a user's stored transactions;
+#   - backfill_index:    embed a user's history into their vector index.
+# Each handler checkpoints after every committed batch (see app.services.jobs).
+
+IMPORT_CSV, RECATEGORIZE, BACKFILL_INDEX = "import_csv", "recategorize", "backfill_index"
+
+# Users whose backfill this process is submitting, so concurrent chat turns queue one job.
+_backfills_submitting: Set[str] = set()
+
+
+def _upload_path(job_id: str) -> str:
+    return os.path.join(IMPORT_JOB_DIR, f"{job_id}.csv")
+
+
+def _store_upload(source: BinaryIO, path: str) -> int:
+    """ Copies the upload to the job directory. Returns its line count (a row-total estimate). """
+    os.makedirs(IMPORT_JOB_DIR, exist_ok=True)
+    source.seek(0)
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "wb") as out:
+        shutil.copyfileobj(source, out, length=1024 * 1024)
+    os.replace(tmp_path, path)
+    lines = 0
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1024 * 1024), b""):
+            lines += block.count(b"\n")
+    return lines
+
+
+async def submit_csv_import(clerk_id: str, source: BinaryIO, account: Optional[str] = None) -> dict:
+    """
+    Stores an uploaded CSV and queues its import. The header is checked up front so
+    obviously malformed files are still rejected synchronously (400).
+    """
+    job_id = str(uuid.uuid4())
+    path = _upload_path(job_id)
+    lines = await asyncio.to_thread(_store_upload, source, path)
+    try:
+        await asyncio.to_thread(csv_parser.check_header, path)
+    except Exception:
+        await asyncio.to_thread(os.remove, path)
+        raise
+    return await jobs.submit(IMPORT_CSV, clerk_id, {"path": path, "account": account},
+                             rows_total=max(lines - 1, 0), job_id=job_id)
+
+
+async def run_csv_import(ctx: jobs.JobContext) -> None:
+    try:
+        await _import_chunks(ctx)
+    except HTTPException as e:
+        # The parser reports malformed data as 400s; parsing again will not help.
+        raise jobs.JobFailed(e.detail)
+    if ctx.progress.rows_imported + ctx.progress.rows_skipped == 0:
+        raise jobs.JobFailed("No valid transactions found.")
+    ctx.progress.rows_total = ctx.progress.rows_processed
+    await ctx.save()
+
+
+async def _import_chunks(ctx: jobs.JobContext) -> None:
+    path, account = ctx.params["path"], ctx.params.get("account")
+    chunks_done = ctx.checkpoint.get("chunks_done", 0)
+    # A resumed job reuses the first attempt's chunk size, so chunk indexes line up.
+    plan = await csv_parser.plan_csv(path, CSV_CHUNK_SIZE, ctx.checkpoint.get("chunk_bytes"))
+    # Occurrence counts shared across chunks, so identical rows get distinct fingerprints.
+    seen = Counter()
+    categorization_chain = csv_parser.build_categorization_chain()
+    index = -1
+    repair = False
+    async for chunk in csv_parser.iter_parsed_chunks(path, plan):
+        index += 1
+        transactions = (csv_parser.chunk_to_transactions(chunk) if index < chunks_done
+                        else await csv_parser.categorize_chunk(chunk, categorization_chain, ctx.clerk_id))
+        if account:
+            for transaction in transactions:
+                transaction.account = transaction.account or account
+
+        if index < chunks_done:
+            # Committed by an earlier attempt: only replay its fingerprints.
+            user_service.replay_fingerprints(transactions, seen)
+            continue
+
+        result = await user_service.add_transactions_to_user(ctx.clerk_id, transactions, seen)
+        if result is None:
+            raise RuntimeError("Failed to update transactions or user not found.")
+        if ctx.resumed and index == chunks_done and result.skipped_count:
+            # An earlier attempt may have inserted part of this chunk and stopped before its
+            # post-write hooks ran; those rows now count as duplicates and their hooks never run.
+            repair = True
+        progress = ctx.progress
+        progress.rows_processed += chunk.rows_read
+        progress.rows_categorized += sum(1 for t in transactions if t.category is not None)
+        progress.rows_imported += result.imported_count
+        progress.rows_skipped += result.skipped_count
+        progress.failures += chunk.rows_read - len(transactions)
+        await ctx.save(checkpoint={"chunks_done": index + 1, "chunk_bytes": plan.chunk_bytes})
+
+    if repair:
+        logger.info(f"Import job {ctx.job_id} resumed over rows already stored; rebuilding derived state")
+        await user_service.rebuild_derived_state(ctx.clerk_id)
+        await jobs.submit(BACKFILL_INDEX, ctx.clerk_id)
+
+
+async def request_index_backfill(clerk_id: str) -> None:
+    """ Queues a backfill_index job for the user unless one is already queued or running. """
+    if clerk_id in _backfills_submitting:
+        return
+    _backfills_submitting.add(clerk_id)
+    try:
+        if await jobs.find_active(BACKFILL_INDEX, clerk_id) is None:
+            await jobs.submit(BACKFILL_INDEX, clerk_id)
+    finally:
+        _backfills_submitting.discard(clerk_id)
+
+
+async def _remove_upload(job: dict) -> None:
+    path = job.get("params", {}).get("path")
+    if path and os.path.exists(path):
+        await asyncio.to_thread(os.remove, path)
+
+
+def _match_page(clerk_id: str, page: List[dict]) -> Tuple[Dict[str, str], List[dict]]:
+    """ Categories the local index finds for a page, by transaction_id, and the documents it could not match. """
+    categories, pending = {}, []
+    for doc in page:
+        local_category = categorizer.category_index.match(clerk_id, doc["description"])
+        if local_category is not None:
+            categories[doc["transaction_id"]] = local_category.value
+        else:
+            pending.append(doc)
+    return categories, pending
+
+
+async def run_recategorize(ctx: jobs.JobContext) -> None:
+    """
+    Categorizes a user's stored transactions again: only uncategorized ones by default,
+    every transaction with params.all. Pages by transaction_id, one checkpoint per page.
+    """
+    db = await get_db()
+    transactions_collection = db.get_collection("transactions")
+    query = {"clerk_id": ctx.clerk_id}
+    if not ctx.params.get("all"):
+        query["category"] = None
+    if ctx.progress.rows_total is None:
+        ctx.progress.rows_total = await transactions_collection.count_documents(query)
+
+    await categorizer.ensure_warm(ctx.clerk_id)
+    categorization_chain = csv_parser.build_categorization_chain()
+    last_id = ctx.checkpoint.get("last_transaction_id")
+    changed = ctx.checkpoint.get("changed", 0)
+    while True:
+        page_query = dict(query, **({"transaction_id": {"$gt": last_id}} if last_id else {}))
+        page = await transactions_collection.find(
+            page_query, {"_id": 0, "transaction_id": 1, "description": 1, "category": 1}
+        ).sort("transaction_id", 1).limit(IMPORT_BATCH_SIZE).to_list(length=IMPORT_BATCH_SIZE)
+        if not page:
+            break
+
+        categories, pending = await asyncio.to_thread(_match_page, ctx.clerk_id, page)
+        if pending:
+            llm_categories = await csv_parser.categorize_with_llm([d["description"] for d in pending], categorization_chain)
+            for doc in pending:
+                category = llm_categories.get(csv_parser.description_key(doc["description"]))
+                if category is not None:
+                    categories[doc["transaction_id"]] = category.value
+                    categorizer.category_index.learn(ctx.clerk_id, doc["description"], category)
+            await asyncio.to_thread(categorizer.category_index.flush, ctx.clerk_id)
+        stored = {doc["transaction_id"]: doc.get("category") for doc in page}
+        updates = {tid: category for tid, category in categories.items() if category != stored[tid]}
+        changed += await user_service.update_transaction_categories(ctx.clerk_id, updates)
+
+        last_id = page[-1]["transaction_id"]
+        ctx.progress.rows_processed += len(page)
+        ctx.progress.rows_categorized += len(categories)
+        await ctx.save(checkpoint={"last_transaction_id": last_id, "changed": changed})
+
+    if changed:
+        await user_service.on_transactions_recategorized(ctx.clerk_id)
+    logger.info(f"Recategorized {changed} transactions for user {ctx.clerk_id}")
+
+
+async def run_backfill_index(ctx: jobs.JobContext) -> None:
+    """ Embeds any of the user's transactions missing from their vector index, page by page. """
+    db = await get_db()
+    transactions_collection = db.get_collection("transactions")
+    query = {"clerk_id": ctx.clerk_id}
+    if ctx.progress.rows_total is None:
+        ctx.progress.rows_total = await transactions_collection.count_documents(query)
+
+    last_id = ctx.checkpoint.get("last_transaction_id")
+    while True:
+        page_query = dict(query, **({"transaction_id": {"$gt": last_id}} if last_id else {}))
+        page = await transactions_collection.find(
+            page_query, {"_id": 0, "transaction_id": 1, "description": 1}
+        ).sort("transaction_id", 1).limit(IMPORT_BATCH_SIZE).to_list(length=IMPORT_BATCH_SIZE)
+        if not page:
+            break
+        # index_rows skips transactions already in the index, so a replayed page costs nothing.
+        await vector_store.index_rows(ctx.clerk_id, [d["transaction_id"] for d in page], [d["description"] for d in page])
+        last_id = page[-1]["transaction_id"]
+        ctx.progress.rows_processed += len(page)
+        await ctx.save(checkpoint={"last_transaction_id": last_id})
+
+
+jobs.register_handler(IMPORT_CSV, run_csv_import, cleanup=_remove_upload)
+jobs.register_handler(RECATEGORIZE, run_recategorize)
+jobs.register_handler(BACKFILL_INDEX, run_backfill_index)
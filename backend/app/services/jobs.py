@@ -0,0 +1,317 @@
+import asyncio
+import logging
+import time
+import uuid
+from datetime import datetime, timedelta
+from typing import Awaitable, Callable, Dict, List, Optional
+
+from pymongo import ReturnDocument
+
+from app.core import metrics
+from app.core.config import JOB_LEASE_SECONDS, JOB_MAX_ATTEMPTS, JOB_POLL_SECONDS, JOB_WORKERS
+from app.core.database import get_db
+from app.core.models import JobProgress, JobStatusResponse
+
+logger = logging.getLogger(__name__)
+
+# =============================================================================
+# BACKGROUND JOB WORKERS
+# =============================================================================
+# Long-running work (CSV imports, recategorization, vector index backfills) runs
+# as jobs instead of inside HTTP requests. A job is a document in the `jobs`
+# collection; each worker process runs JOB_WORKERS asyncio workers that claim
+# queued jobs atomically, so any number of processes can share the queue.
+#
+# A running job holds a lease that its worker renews. Handlers save a checkpoint
+# after every committed batch; if the process dies (or the job raises), the job
+# goes back to the queue and the next attempt resumes from the last checkpoint.
+# Handlers must therefore be idempotent per batch, which the import path already
+# is (fingerprinted rows are never inserted twice).
+
+JOBS_COLLECTION = "jobs"
+QUEUED, RUNNING, SUCCEEDED, FAILED = "queued", "running", "succeeded", "failed"
+
+JOBS_FINISHED = metrics.Counter("finchat_jobs_finished_total", "Background jobs finished, by kind and status.",
+                                ["kind", "status"])
+JOB_DURATION = metrics.Histogram("finchat_job_duration_seconds", "Background job attempt duration.", ["kind"],
+                                 buckets=(1, 5, 15, 30, 60, 120, 300, 600, 1800, 3600))
+
+
+class JobLeaseLost(Exception):
+    """ Another worker took over the job (our lease expired); this attempt must stop. """
+
+
+class JobFailed(Exception):
+    """ Raised by handlers for errors a retry cannot fix (e.g. malformed input): fails the job at once. """
+
+
+class JobContext:
+    """ What a handler sees of its job: parameters, the last checkpoint, and progress reporting. """
+
+    def __init__(self, job: dict, owner: str):
+        self.job_id = job["job_id"]
+        self.kind = job["kind"]
+        self.clerk_id = job["clerk_id"]
+        self.params = job.get("params", {})
+        self.checkpoint = job.get("checkpoint") or {}
+        self.progress = JobProgress(**job.get("progress", {}))
+        # Whether an earlier attempt ran (and may have written some of its work before stopping).
+        self.resumed = job.get("resumed", False)
+        self.owner = owner
+
+    async def save(self, checkpoint: Optional[dict] = None) -> None:
+        """ Persists the current progress (and checkpoint, once a batch is committed), renewing the lease. """
+        update = {
+            "progress": self.progress.model_dump(),
+            "updated_at": datetime.utcnow(),
+            "lease_until": datetime.utcnow() + timedelta(seconds=JOB_LEASE_SECONDS),
+        }
+        if checkpoint is not None:
+            self.checkpoint = checkpoint
+            update["checkpoint"] = checkpoint
+        db = await get_db()
+        result = await db.get_collection(JOBS_COLLECTION).update_one(
+            {"job_id": self.job_id, "owner": self.owner, "status": RUNNING}, {"$set": update}
+        )
+        if result.matched_count == 0:
+            raise JobLeaseLost(self.job_id)
+
+
+Handler = Callable[[JobContext], Awaitable[None]]
+Cleanup = Callable[[dict], Awaitable[None]]
+
+_handlers: Dict[str, Handler] = {}
+_cleanups: Dict[str, Cleanup] = {}
+_workers: List[asyncio.Task] = []
+_wake = asyncio.Event()
+
+
+def register_handler(kind: str, handler: Handler, cleanup: Optional[Cleanup] = None) -> None:
+    """
+    Registers the coroutine that runs jobs of `kind`. `cleanup(job)` runs once the
+    job reaches a terminal state (e.g. to delete its uploaded file).
+    """
+    _handlers[kind] = handler
+    if cleanup is not None:
+        _cleanups[kind] = cleanup
+
+
+async def submit(kind: str, clerk_id: str, params: Optional[dict] = None, rows_total: Optional[int] = None,
+                 job_id: Optional[str] = None) -> dict:
+    """ Queues a job and wakes this process's workers. Returns the job document. """
+    now = datetime.utcnow()
+    job = {
+        "job_id": job_id or str(uuid.uuid4()),
+        "kind": kind,
+        "clerk_id": clerk_id,
+        "params": params or {},
+        "status": QUEUED,
+        "progress": JobProgress(rows_total=rows_total).model_dump(),
+        "checkpoint": {},
+        "attempts": 0,
+        "error": None,
+        "owner": None,
+        "lease_until": None,
+        "created_at": now,
+        "updated_at": now,
+        "started_at": None,
+        "finished_at": None,
+    }
+    db = await get_db()
+    await db.get_collection(JOBS_COLLECTION).insert_one(dict(job))
+    logger.info(f"Queued {kind} job {job['job_id']} for user {clerk_id}")
+    _wake.set()
+    return job
+
+
+async def find_active(kind: str, clerk_id: str) -> Optional[dict]:
+    """ A queued or running job of `kind` for the user, if there is one. """
+    db = await get_db()
+    return await db.get_collection(JOBS_COLLECTION).find_one(
+        {"kind": kind, "clerk_id": clerk_id, "status": {"$in": [QUEUED, RUNNING]}}, {"_id": 0}
+    )
+
+
+async def get_job(job_id: str) -> Optional[dict]:
+    db = await get_db()
+    return await db.get_collection(JOBS_COLLECTION).find_one({"job_id": job_id}, {"_id": 0})
+
+
+def _eta_seconds(job: dict) -> Optional[float]:
+    """ Remaining rows at the rate observed since the current attempt started. """
+    progress = job.get("progress", {})
+    total, processed = progress.get("rows_total"), progress.get("rows_processed", 0)
+    resumed_at, resumed_rows = job.get("resumed_at"), job.get("resumed_rows", 0)
+    if job["status"] != RUNNING or not total or not resumed_at or processed <= resumed_rows:
+        return None
+    rate = (processed - resumed_rows) / max((datetime.utcnow() - resumed_at).total_seconds(), 1e-6)
+    return round(max(total - processed, 0) / rate, 1)
+
+
+def to_status(job: dict) -> JobStatusResponse:
+    return JobStatusResponse(
+        job_id=job["job_id"],
+        kind=job["kind"],
+        clerk_id=job["clerk_id"],
+        status=job["status"],
+        progress=JobProgress(**job.get("progress", {})),
+        eta_seconds=_eta_seconds(job),
+        attempts=job.get("attempts", 0),
+        error=job.get("error"),
+        created_at=job["created_at"],
+        started_at=job.get("started_at"),
+        finished_at=job.get("finished_at"),
+    )
+
+
+# --- Worker loop ---
+
+async def _claim(owner: str) -> Optional[dict]:
+    """ Atomically takes the oldest queued job, or a running one whose lease expired. """
+    db = await get_db()
+    jobs_collection = db.get_collection(JOBS_COLLECTION)
+    now = datetime.utcnow()
+    # Jobs whose worker died on their last allowed attempt will never be claimed again,
+    # nor will queued jobs that somehow have no attempts left.
+    abandoned = {"$or": [{"status": RUNNING, "lease_until": {"$lt": now}}, {"status": QUEUED}],
+                 "attempts": {"$gte": JOB_MAX_ATTEMPTS}}
+    async for job in jobs_collection.find(abandoned, {"_id": 0}):
+        await _finish(job, FAILED, "Worker stopped responding on the last attempt." if job["status"] == RUNNING
+                      else "No attempts left.")
+
+    job = await jobs_collection.find_one_and_update(
+        {"$or": [{"status": QUEUED}, {"status": RUNNING, "lease_until": {"$lt": now}}],
+         "attempts": {"$lt": JOB_MAX_ATTEMPTS}},
+        {"$set": {"status": RUNNING, "owner": owner, "lease_until": now + timedelta(seconds=JOB_LEASE_SECONDS),
+                  "resumed_at": now, "updated_at": now},
+         "$inc": {"attempts": 1}},
+        sort=[("created_at", 1)],
+        return_document=ReturnDocument.AFTER,
+    )
+    if job is None:
+        return None
+    job.pop("_id", None)
+    # Rows done before this attempt, so the ETA only uses this attempt's rate.
+    job["resumed_rows"] = job["progress"].get("rows_processed", 0)
+    job["resumed"] = job.get("started_at") is not None
+    job["started_at"] = job.get("started_at") or now
+    await jobs_collection.update_one(
+        {"job_id": job["job_id"], "owner": owner},
+        {"$set": {"resumed_rows": job["resumed_rows"], "started_at": job["started_at"]}},
+    )
+    return job
+
+
+async def _finish(job: dict, status: str, error: Optional[str] = None, owner: Optional[str] = None) -> None:
+    db = await get_db()
+    now = datetime.utcnow()
+    query = {"job_id": job["job_id"]}
+    if owner is not None:
+        query["owner"] = owner
+    result = await db.get_collection(JOBS_COLLECTION).update_one(
+        query,
+        {"$set": {"status": status, "error": error, "owner": None, "lease_until": None,
+                  "finished_at": now, "updated_at": now}},
+    )
+    if result.matched_count == 0:
+        return
+    JOBS_FINISHED.inc(kind=job["kind"], status=status)
+    cleanup = _cleanups.get(job["kind"])
+    if cleanup is not None:
+        try:
+            await cleanup(job)
+        except Exception as e:
+            logger.warning(f"Cleanup failed for job {job['job_id']}: {e}")
+
+
+async def _release(job: dict, owner: str, error: Optional[str] = None, count_attempt: bool = True) -> None:
+    """
+    Puts a job back in the queue; the next attempt resumes from its checkpoint.
+    With count_attempt=False (shutdown) the attempt taken by _claim is given back.
+    """
+    db = await get_db()
+    update = {"$set": {"status": QUEUED, "error": error, "owner": None, "lease_until": None,
+                       "updated_at": datetime.utcnow()}}
+    if not count_attempt:
+        update["$inc"] = {"attempts": -1}
+    await db.get_collection(JOBS_COLLECTION).update_one({"job_id": job["job_id"], "owner": owner}, update)
+
+
+async def _heartbeat(job_id: str, owner: str) -> None:
+    """ Renews the lease while a handler is busy between checkpoints (e.g. waiting on the LLM). """
+    db = await get_db()
+    jobs_collection = db.get_collection(JOBS_COLLECTION)
+    while True:
+        await asyncio.sleep(JOB_LEASE_SECONDS / 3)
+        await jobs_collection.update_one(
+            {"job_id": job_id, "owner": owner, "status": RUNNING},
+            {"$set": {"lease_until": datetime.utcnow() + timedelta(seconds=JOB_LEASE_SECONDS)}},
+        )
+
+
+async def _run(job: dict, owner: str) -> None:
+    handler = _handlers.get(job["kind"])
+    if handler is None:
+        await _finish(job, FAILED, f"No handler for job kind '{job['kind']}'.")
+        return
+
+    logger.info(f"Running {job['kind']} job {job['job_id']} (attempt {job['attempts']})")
+    heartbeat = asyncio.create_task(_heartbeat(job["job_id"], owner))
+    started = time.perf_counter()
+    try:
+        await handler(JobContext(job, owner))
+    except JobLeaseLost:
+        logger.warning(f"Lost the lease on job {job['job_id']}; another worker resumed it")
+        return
+    except asyncio.CancelledError:
+        # Shutdown: hand the job back so the next process resumes it right away. Being
+        # stopped isn't the job's fault, so it doesn't use up one of its attempts.
+        await _release(job, owner, count_attempt=False)
+        raise
+    except Exception as e:
+        message = getattr(e, "detail", None) or str(e) or type(e).__name__
+        logger.error(f"Job {job['job_id']} failed on attempt {job['attempts']}: {message}")
+        if isinstance(e, JobFailed) or job["attempts"] >= JOB_MAX_ATTEMPTS:
+            await _finish(job, FAILED, message, owner)
+        else:
+            await _release(job, owner, message)
+            _wake.set()
+        return
+    finally:
+        heartbeat.cancel()
+        JOB_DURATION.observe(time.perf_counter() - started, kind=job["kind"])
+    await _finish(job, SUCCEEDED, owner=owner)
+    logger.info(f"Finished {job['kind']} job {job['job_id']}")
+
+
+async def _worker(index: int) -> None:
+    owner = f"{uuid.uuid4()}:{index}"
+    while True:
+        try:
+            job = await _claim(owner)
+        except Exception as e:
+            logger.error(f"Job worker {index} could not claim a job: {e}")
+            job = None
+        if job is None:
+            _wake.clear()
+            try:
+                await asyncio.wait_for(_wake.wait(), JOB_POLL_SECONDS)
+            except asyncio.TimeoutError:
+                pass
+            continue
+        await _run(job, owner)
+
+
+def start_workers() -> None:
+    """ Starts this process's job workers (app startup). """
+    if not _workers:
+        _workers.extend(asyncio.create_task(_worker(i)) for i in range(JOB_WORKERS))
+        logger.info(f"Started {JOB_WORKERS} job workers")
+
+
+async def stop_workers() -> None:
+    """ Cancels the workers; running jobs are released back to the queue. """
+    for task in _workers:
+        task.cancel()
+    await asyncio.gather(*_workers, return_exceptions=True)
+    _workers.clear()
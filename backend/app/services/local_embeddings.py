@@ -0,0 +1,96 @@
+import re
+from functools import lru_cache
+from typing import TYPE_CHECKING, List, Tuple
+
+import numpy as np
+
+from app.core import lazy_imports
+from app.core.config import LOCAL_EMBEDDING_DIM, LOCAL_EMBEDDING_FEATURES
+
+if TYPE_CHECKING:
+    import scipy.sparse
+
+# =============================================================================
+# LOCAL CPU EMBEDDINGS
+# =============================================================================
+# Vectors for transaction descriptions and chat queries computed in-process,
+# with no network call (EMBEDDING_BACKEND=local, see app.services.embeddings).
+#
+# A text is lowercased with digit runs collapsed ("#1234" and "#88" match), then
+# hashed into LOCAL_EMBEDDING_FEATURES buckets twice: word unigrams and bigrams,
+# and character 3-5 grams inside words, which match merchant names across
+# abbreviations and store suffixes ("STARBUCKS" / "STARBUCKS#0"). Counts are
+# damped (1 + log tf), each block is L2-normalized so words and characters weigh
+# the same, and a fixed sparse random projection reduces the sum to
+# LOCAL_EMBEDDING_DIM dense dimensions, which preserves inner products.
+#
+# Nothing is fitted to a corpus: no vocabulary and no IDF. Transactions are
+# embedded once when written and compared with queries embedded much later, so
+# a text must map to the same vector in every process and after every upload.
+# The hashing (murmurhash3) and the projection (a seeded legacy RandomState
+# stream) are deterministic; changing anything here must bump _VERSION, which is
+# part of model_name() and so keys separate indexes and cache entries.
+#
+# scikit-learn and SciPy are imported on first use, not at app startup.
+
+_VERSION = 1
+_SEED = 20240601
+# Non-zeros per hashed feature in the projection (Achlioptas / Li et al.: a few
+# suffice; each is +-1/sqrt(s)).
+_PROJECTION_NONZEROS = 4
+_DIGITS = re.compile(r"\d+")
+
+
+def model_name() -> str:
+    """ Identifies the vector space: same name, same vector for the same text. """
+    return f"local-ngram-v{_VERSION}-{LOCAL_EMBEDDING_FEATURES}x{LOCAL_EMBEDDING_DIM}"
+
+
+@lru_cache(maxsize=1)
+def _vectorizers() -> Tuple:
+    HashingVectorizer = lazy_imports.load("sklearn.feature_extraction.text").HashingVectorizer
+
+    common = dict(n_features=LOCAL_EMBEDDING_FEATURES, alternate_sign=False, norm=None, lowercase=False,
+                  dtype=np.float32)
+    words = HashingVectorizer(analyzer="word", ngram_range=(1, 2), token_pattern=r"(?u)\b\w+\b", **common)
+    chars = HashingVectorizer(analyzer="char_wb", ngram_range=(3, 5), **common)
+    return words, chars
+
+
+@lru_cache(maxsize=1)
+def _projection() -> "scipy.sparse.csr_matrix":
+    """ The (LOCAL_EMBEDDING_FEATURES, LOCAL_EMBEDDING_DIM) sparse random projection. """
+    sp = lazy_imports.load("scipy.sparse")
+
+    rng = np.random.RandomState(_SEED)
+    features, s = LOCAL_EMBEDDING_FEATURES, _PROJECTION_NONZEROS
+    rows = np.repeat(np.arange(features, dtype=np.int64), s)
+    cols = rng.randint(0, LOCAL_EMBEDDING_DIM, size=features * s)
+    values = (rng.randint(0, 2, size=features * s) * 2 - 1).astype(np.float32) / np.float32(np.sqrt(s))
+    return sp.csr_matrix((values, (rows, cols)), shape=(features, LOCAL_EMBEDDING_DIM), dtype=np.float32)
+
+
+def warm() -> None:
+    """ Imports scikit-learn and builds the projection, so the first embedding call does not. """
+    _vectorizers()
+    _projection()
+
+
+def embed(texts: List[str]) -> np.ndarray:
+    """
+    Embeds a batch in one vectorized pass: (n, LOCAL_EMBEDDING_DIM) float32 with
+    L2-normalized rows (all-zero for empty texts). CPU-bound; callers on the event
+    loop run it in a thread.
+    """
+    normalize = lazy_imports.load("sklearn.preprocessing").normalize
+
+    cleaned = [_DIGITS.sub("0", text.lower()) for text in texts]
+    features = None
+    for vectorizer in _vectorizers():
+        block = vectorizer.transform(cleaned)
+        np.log(block.data, out=block.data)
+        block.data += 1.0
+        block = normalize(block, copy=False)
+        features = block if features is None else features + block
+    dense = (features @ _projection()).toarray()
+    return normalize(dense, copy=False).astype(np.float32, copy=False)
@@ -0,0 +1,86 @@
+import asyncio
+import logging
+from typing import List
+
+from pymongo.errors import BulkWriteError
+
+from app.core.database import get_db
+from app.core.models import TransactionDB
+from app.services import policy_engine, rollups
+
+logger = logging.getLogger(__name__)
+
+# =============================================================================
+# EMBEDDED TRANSACTIONS -> `transactions` COLLECTION
+# =============================================================================
+# Older user documents carry every transaction in an embedded `transactions`
+# array. These helpers copy them into the `transactions` collection and unset
+# the array. Migration is idempotent: the unique (clerk_id, transaction_id)
+# index turns re-inserted rows into ignored duplicate-key errors.
+#
+# Users are migrated lazily the first time their context is read, or all at
+# once with:  python -m app.services.migrations
+
+DUPLICATE_KEY_ERROR = 11000
+
+
+def transaction_document(clerk_id: str, transaction: TransactionDB) -> dict:
+    """ The `transactions` collection document for one transaction. """
+    return {"clerk_id": clerk_id, **transaction.model_dump(by_alias=True)}
+
+
+async def insert_transaction_documents(documents: List[dict]) -> int:
+    """ Unordered bulk insert that skips rows already present. Returns the number inserted. """
+    if not documents:
+        return 0
+    db = await get_db()
+    transactions_collection = db.get_collection("transactions")
+    try:
+        result = await transactions_collection.insert_many(documents, ordered=False)
+        return len(result.inserted_ids)
+    except BulkWriteError as e:
+        errors = e.details.get("writeErrors", [])
+        if any(err.get("code") != DUPLICATE_KEY_ERROR for err in errors):
+            raise
+        return e.details.get("nInserted", 0)
+
+
+async def migrate_user_transactions(clerk_id: str) -> int:
+    """ Moves one user's embedded transactions into the `transactions` collection. """
+    db = await get_db()
+    users_collection = db.get_collection("users")
+    user_data = await users_collection.find_one({"clerk_id": clerk_id}, {"transactions": 1})
+    embedded = (user_data or {}).get("transactions") or []
+
+    documents = []
+    for raw in embedded:
+        try:
+            documents.append(transaction_document(clerk_id, TransactionDB(**raw)))
+        except Exception as e:
+            logger.warning(f"Skipping invalid embedded transaction for {clerk_id}: {e}")
+
+    inserted = await insert_transaction_documents(documents)
+    await users_collection.update_one({"clerk_id": clerk_id}, {"$unset": {"transactions": ""}})
+
+    # Migrated rows bypass the write hooks, so derive budgets and rollups from scratch.
+    await rollups.rebuild_rollups(clerk_id)
+    await policy_engine.recompute_policies(clerk_id)
+    logger.info(f"Migrated {inserted}/{len(embedded)} embedded transactions for user {clerk_id}")
+    return inserted
+
+
+async def migrate_all_users() -> int:
+    """ Migrates every user that still has an embedded transactions array. """
+    db = await get_db()
+    users_collection = db.get_collection("users")
+    total = 0
+    cursor = users_collection.find({"transactions.0": {"$exists": True}}, {"clerk_id": 1})
+    async for user in cursor:
+        total += await migrate_user_transactions(user["clerk_id"])
+    logger.info(f"Migration complete: {total} transactions moved")
+    return total
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    asyncio.run(migrate_all_users())
@@ -0,0 +1,63 @@
+import asyncio
+from typing import TYPE_CHECKING, Optional
+
+from app.core import lazy_imports, metrics
+from app.core.config import OPENAI_MAX_CONCURRENCY, OPENAI_MAX_RETRIES
+
+if TYPE_CHECKING:
+    from openai import AsyncOpenAI
+
+# =============================================================================
+# SHARED ASYNC OPENAI CLIENT
+# =============================================================================
+# One AsyncOpenAI client per worker, so HTTP connections are pooled and reused
+# across requests, plus a semaphore that bounds how many OpenAI calls a worker
+# has in flight. Callers pass their own per-call `timeout=`.
+# The openai and httpx packages (slow to import) are loaded with the first client.
+
+_client: Optional["AsyncOpenAI"] = None
+_semaphore: Optional[asyncio.Semaphore] = None
+
+LLM_TOKENS = metrics.Counter("finchat_llm_tokens_total", "Tokens reported by OpenAI usage, by model and kind.",
+                             ["model", "kind"])
+
+
+def get_client() -> "AsyncOpenAI":
+    global _client
+    if _client is None:
+        openai = lazy_imports.load("openai")
+        httpx = lazy_imports.load("httpx")
+
+        _client = openai.AsyncOpenAI(
+            max_retries=OPENAI_MAX_RETRIES,
+            http_client=openai.DefaultAsyncHttpxClient(
+                limits=httpx.Limits(
+                    max_connections=OPENAI_MAX_CONCURRENCY,
+                    max_keepalive_connections=OPENAI_MAX_CONCURRENCY,
+                ),
+            ),
+        )
+    return _client
+
+
+def concurrency_limit() -> asyncio.Semaphore:
+    """ Semaphore to hold while an OpenAI request is in flight. """
+    global _semaphore
+    if _semaphore is None:
+        _semaphore = asyncio.Semaphore(OPENAI_MAX_CONCURRENCY)
+    return _semaphore
+
+
+def _collect_metrics() -> metrics.Collected:
+    in_use = OPENAI_MAX_CONCURRENCY - _semaphore._value if _semaphore is not None else 0
+    return [("finchat_openai_requests_in_flight", "gauge", "OpenAI calls holding a concurrency slot.", in_use)]
+
+
+metrics.register_collector(_collect_metrics)
+
+
+async def close_client() -> None:
+    global _client
+    if _client is not None:
+        await _client.close()
+        _client = None
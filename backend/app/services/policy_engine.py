@@ -0,0 +1,236 @@
+import logging
+from datetime import datetime, timedelta
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+
+from app.core.database import get_db
+from app.core.models import PolicyDB, TransactionCategory, TransactionDB
+from app.services import working_set
+
+logger = logging.getLogger(__name__)
+
+# =============================================================================
+# POLICY SPENDING ENGINE
+# =============================================================================
+# Keeps PolicyDB.current_spending equal to the spending in the policy's target
+# category during its current timeframe window (window_start), so budget status
+# is an O(policies) read instead of an O(transactions) scan.
+#
+#   - apply_transactions: on every insert, one atomic $inc per user covering
+#     every matching policy (arrayFilters guard on policy_id + window_start).
+#   - roll_windows: when a period ends, compare-and-set the policy onto the new
+#     window and seed it from the transactions already dated inside it.
+#   - recompute_policies: vectorized masks over the user's columnar working
+#     set for backfills and repairs.
+#
+# Amounts are signed: negative amounts are money out and count as spending.
+
+def window_start(timeframe: str, when: datetime) -> datetime:
+    """ Start of the timeframe window containing `when`. Unknown timeframes are treated as monthly. """
+    day = datetime(when.year, when.month, when.day)
+    if timeframe == "daily":
+        return day
+    if timeframe == "weekly":
+        return day - timedelta(days=day.weekday())
+    if timeframe == "yearly":
+        return datetime(when.year, 1, 1)
+    return datetime(when.year, when.month, 1)
+
+
+def window_end(timeframe: str, start: datetime) -> datetime:
+    """ Exclusive end of the window beginning at `start`. """
+    if timeframe == "daily":
+        return start + timedelta(days=1)
+    if timeframe == "weekly":
+        return start + timedelta(days=7)
+    if timeframe == "yearly":
+        return datetime(start.year + 1, 1, 1)
+    return datetime(start.year + start.month // 12, start.month % 12 + 1, 1)
+
+
+def spend_amount(amount: float) -> float:
+    """ How much a transaction counts towards spending: outflows only. """
+    return -amount if amount < 0 else 0.0
+
+
+def resolve_category(target_category: str) -> str:
+    """ Maps a policy's free-text target category onto the stored TransactionCategory value. """
+    wanted = target_category.strip().lower()
+    for category in TransactionCategory:
+        if category.value.lower() == wanted:
+            return category.value
+    return target_category
+
+
+def _category_value(category) -> Optional[str]:
+    return category.value if isinstance(category, TransactionCategory) else category
+
+
+async def _window_spending(clerk_id: str, category: str, start: datetime, end: datetime) -> float:
+    """ Spending in one category over [start, end), summed inside Mongo via the (clerk_id, category) index. """
+    db = await get_db()
+    transactions_collection = db.get_collection("transactions")
+    pipeline = [
+        {"$match": {"clerk_id": clerk_id, "category": category, "date": {"$gte": start, "$lt": end}, "amount": {"$lt": 0}}},
+        {"$group": {"_id": None, "total": {"$sum": "$amount"}}},
+    ]
+    result = await transactions_collection.aggregate(pipeline).to_list(length=1)
+    return -result[0]["total"] if result else 0.0
+
+
+async def initialize_policy(clerk_id: str, policy: PolicyDB, now: Optional[datetime] = None) -> PolicyDB:
+    """ Sets a new policy's window and seeds current_spending from existing transactions. """
+    start = window_start(policy.timeframe, now or datetime.utcnow())
+    policy.window_start = start
+    policy.current_spending = await _window_spending(
+        clerk_id, resolve_category(policy.target_category), start, window_end(policy.timeframe, start)
+    )
+    return policy
+
+
+async def _load_policies(clerk_id: str) -> List[PolicyDB]:
+    db = await get_db()
+    users_collection = db.get_collection("users")
+    user_data = await users_collection.find_one({"clerk_id": clerk_id}, {"policies": 1})
+    return [PolicyDB(**p) for p in (user_data or {}).get("policies", [])]
+
+
+async def roll_windows(clerk_id: str, now: Optional[datetime] = None) -> Tuple[List[PolicyDB], set]:
+    """
+    Moves every policy whose window has ended onto the current window.
+    Returns (policies as they are now, ids of the policies this call rolled and seeded).
+    """
+    now = now or datetime.utcnow()
+    policies = await _load_policies(clerk_id)
+    rolled = set()
+
+    db = await get_db()
+    users_collection = db.get_collection("users")
+    for policy in policies:
+        current = window_start(policy.timeframe, now)
+        if policy.window_start == current:
+            continue
+
+        spending = await _window_spending(
+            clerk_id, resolve_category(policy.target_category), current, window_end(policy.timeframe, current)
+        )
+        # Compare-and-set on the old window so concurrent rollovers only apply once.
+        result = await users_collection.update_one(
+            {"clerk_id": clerk_id},
+            {"$set": {"policies.$[p].window_start": current, "policies.$[p].current_spending": spending}},
+            array_filters=[{"p.policy_id": policy.policy_id, "p.window_start": policy.window_start}],
+        )
+        if result.modified_count:
+            logger.info(f"Rolled policy {policy.policy_id} for {clerk_id} to window {current.date()}")
+            policy.window_start = current
+            policy.current_spending = spending
+            rolled.add(policy.policy_id)
+            continue
+        # A concurrent roller moved the policy first, seeded from an aggregate that may
+        # predate the caller's rows: take its stored state so they are still $inc'ed.
+        stored = next((p for p in await _load_policies(clerk_id) if p.policy_id == policy.policy_id), None)
+        if stored is not None:
+            policy.window_start = stored.window_start
+            policy.current_spending = stored.current_spending
+
+    return policies, rolled
+
+
+async def apply_transactions(clerk_id: str, transactions: Iterable[TransactionDB], now: Optional[datetime] = None) -> None:
+    """ Atomically adds newly inserted transactions to the spending of every matching policy. """
+    policies, rolled = await roll_windows(clerk_id, now)
+    if not policies:
+        return
+
+    increments: Dict[str, float] = {}
+    transactions = list(transactions)
+    for policy in policies:
+        # A just-rolled policy was seeded from the collection, which already includes these rows.
+        if policy.policy_id in rolled:
+            continue
+        category = resolve_category(policy.target_category)
+        total = sum(
+            spend_amount(t.amount) for t in transactions
+            if _category_value(t.category) == category
+            and window_start(policy.timeframe, t.date) == policy.window_start
+        )
+        if total:
+            increments[policy.policy_id] = total
+
+    if not increments:
+        return
+
+    update, array_filters = {}, []
+    for i, (policy_id, total) in enumerate(increments.items()):
+        update[f"policies.$[p{i}].current_spending"] = total
+        window = next(p.window_start for p in policies if p.policy_id == policy_id)
+        array_filters.append({f"p{i}.policy_id": policy_id, f"p{i}.window_start": window})
+
+    db = await get_db()
+    users_collection = db.get_collection("users")
+    await users_collection.update_one({"clerk_id": clerk_id}, {"$inc": update}, array_filters=array_filters)
+
+
+def evaluate_policies(columns: "working_set.TransactionColumns", policies: List[PolicyDB], now: datetime) -> Dict[str, float]:
+    """
+    Spending of each policy's category in its current window, computed with vectorized
+    masks over the working-set columns. Returns {policy_id: spending}.
+    """
+    spending_rows = columns.amounts < 0
+    totals = {}
+    for policy in policies:
+        start = window_start(policy.timeframe, now)
+        end = window_end(policy.timeframe, start)
+        mask = (
+            spending_rows
+            & (columns.category_codes == working_set.category_code(resolve_category(policy.target_category)))
+            & (columns.timestamps >= np.datetime64(start, "s"))
+            & (columns.timestamps < np.datetime64(end, "s"))
+        )
+        totals[policy.policy_id] = float(-columns.amounts[mask].sum())
+    return totals
+
+
+async def recompute_policies(clerk_id: str, now: Optional[datetime] = None) -> List[PolicyDB]:
+    """
+    Full recompute of every policy's current window from the user's transactions,
+    evaluated over the user's (cached) working set.
+    """
+    now = now or datetime.utcnow()
+    ws = await working_set.get_working_set(clerk_id)
+    policies = ws.policy_models() if ws else []
+    if not policies:
+        return []
+
+    totals = evaluate_policies(ws.columns, policies, now)
+    update, array_filters = {}, []
+    for i, policy in enumerate(policies):
+        policy.window_start = window_start(policy.timeframe, now)
+        policy.current_spending = totals[policy.policy_id]
+        update[f"policies.$[p{i}].window_start"] = policy.window_start
+        update[f"policies.$[p{i}].current_spending"] = policy.current_spending
+        array_filters.append({f"p{i}.policy_id": policy.policy_id})
+
+    db = await get_db()
+    users_collection = db.get_collection("users")
+    await users_collection.update_one({"clerk_id": clerk_id}, {"$set": update}, array_filters=array_filters)
+    logger.info(f"Recomputed {len(policies)} policies for {clerk_id} from {ws.columns.size} transactions")
+    return policies
+
+
+async def recompute_all_users(now: Optional[datetime] = None) -> int:
+    """ Backfill: recomputes the policies of every user that has any. """
+    db = await get_db()
+    users_collection = db.get_collection("users")
+    count = 0
+    async for user in users_collection.find({"policies.0": {"$exists": True}}, {"clerk_id": 1}):
+        await recompute_policies(user["clerk_id"], now)
+        count += 1
+    return count
+
+
+if __name__ == "__main__":
+    import asyncio
+    logging.basicConfig(level=logging.INFO)
+    asyncio.run(recompute_all_users())
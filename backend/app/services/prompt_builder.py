@@ -0,0 +1,318 @@
+import logging
+import re
+import threading
+from collections import OrderedDict
+from typing import Dict, List, Optional, Tuple
+
+from fastapi import HTTPException
+
+from app.core import lazy_imports, metrics
+from app.core.config import CHAT_MODEL, PROMPT_TOKEN_BUDGET, PROMPT_TOKENIZER
+from app.core.models import GoalDB, PolicyDB, RetrievalFilters, RetrievalResult
+from app.services.categorizer import normalize_description
+from app.services.policy_engine import resolve_category
+
+logger = logging.getLogger(__name__)
+
+PROMPT_TOKENS = metrics.Histogram("finchat_chat_prompt_tokens", "Tokens per chat prompt, counted before the call.",
+                                  buckets=(250, 500, 1000, 1500, 2000, 3000, 4000, 8000, 16000))
+
+# =============================================================================
+# TOKEN-BUDGETED CHAT PROMPT
+# =============================================================================
+# A chat turn's messages are assembled under PROMPT_TOKEN_BUDGET tokens (the
+# user's message included) from the retrieval result and the user's policies
+# and goals. Context comes in sections, each a list of lines in order of value:
+#
+#   transactions - the retrieved rows, best first; repeats of one merchant
+#                  collapse into a line with count, date range, total and average;
+#   policies     - spending limits with the current period's spending and what is
+#                  left, those on the question's categories and nearest their limit first;
+#   goals        - savings goals and their progress;
+#   categories   - totals per category over every matching transaction;
+#   months       - income and spending per month over the matching transactions,
+#                  recent months listed and older ones collapsed into one line.
+#
+# Lines are taken in two passes until the budget is spent: first the leading
+# lines of every section (the best few transactions, every policy and goal, the
+# top categories, recent months), then the rest in the same section order. The
+# instructions and the totals over all matching transactions are always sent.
+#
+# Tokens are counted with tiktoken's encoding for CHAT_MODEL. tiktoken fetches
+# its vocabulary on first use (or reads TIKTOKEN_CACHE_DIR), which must not
+# block a chat turn or fail an offline deployment, so the encoding is loaded in
+# the background and a deliberately high estimate is used until it is ready.
+#
+# A user message that leaves no room for the instructions is rejected (413)
+# before anything is retrieved or embedded; one that only just fits with them
+# is cut short at assembly rather than sent over the budget.
+
+# Chat format overhead: tokens per message, and for priming the reply.
+_MESSAGE_TOKENS = 4
+_REPLY_TOKENS = 3
+_MAX_DESCRIPTION_CHARS = 60
+# Months listed one by one; older matching months share one line.
+_RECENT_MONTHS = 6
+# Kept for the filters and totals lines of the header when a message is checked
+# before retrieval has produced them.
+_HEADER_RESERVE_TOKENS = 80
+# Estimate: every letter run, 1-3 digit group, newline and punctuation mark is at
+# least a token, and long words are split further.
+_TOKEN_PIECES = re.compile(r"[A-Za-z]+|\d{1,3}|\n|[^\sA-Za-z\d]")
+
+_INSTRUCTIONS = """You are FinChat, an expert AI financial co-pilot.
+Your goal is to provide data-driven, insightful advice based on the user's actual spending.
+Amounts are signed: negative is money spent, positive is money received."""
+
+_CLOSING = """When answering, you MUST base your answer on these figures and the context above.
+Use this specific data to provide a concise, helpful, and direct response to the user's message."""
+
+
+# --- Token counting ---
+
+_encoding = None
+_load_lock = threading.Lock()
+_load_attempted = False
+
+
+def load_tokenizer() -> None:
+    """ Loads tiktoken's encoding for CHAT_MODEL. Blocking (may download the vocabulary); run in a thread. """
+    global _encoding, _load_attempted
+    if PROMPT_TOKENIZER != "auto":
+        return
+    with _load_lock:
+        if _load_attempted:
+            return
+        _load_attempted = True
+        try:
+            tiktoken = lazy_imports.load("tiktoken")
+
+            try:
+                encoding = tiktoken.encoding_for_model(CHAT_MODEL)
+            except KeyError:
+                # A model tiktoken does not know: the GPT-4 family's encoding is the closest guess.
+                encoding = tiktoken.get_encoding("cl100k_base")
+        except Exception as e:
+            logger.warning(f"tiktoken unavailable, estimating prompt tokens: {e}")
+            return
+        _encoding = encoding
+        logger.info(f"Counting prompt tokens with tiktoken's {encoding.name} encoding")
+
+
+def tokenizer_name() -> str:
+    return _encoding.name if _encoding is not None else "estimate"
+
+
+def count_tokens(text: str) -> int:
+    """ Tokens `text` costs with CHAT_MODEL's encoding, or an over-estimate while it is not loaded. """
+    if _encoding is not None:
+        return len(_encoding.encode(text, disallowed_special=()))
+    if PROMPT_TOKENIZER == "auto" and not _load_attempted:
+        threading.Thread(target=load_tokenizer, name="tokenizer-load", daemon=True).start()
+    return sum(1 + len(piece) // 4 for piece in _TOKEN_PIECES.findall(text))
+
+
+def _truncate_tokens(text: str, tokens: int) -> str:
+    """ The longest prefix of `text` costing at most `tokens` tokens (by the same count as count_tokens). """
+    if tokens <= 0:
+        return ""
+    if _encoding is not None:
+        return _encoding.decode(_encoding.encode(text, disallowed_special=())[:tokens])
+    end = 0
+    for match in _TOKEN_PIECES.finditer(text):
+        tokens -= 1 + len(match.group()) // 4
+        if tokens < 0:
+            break
+        end = match.end()
+    return text[:end]
+
+
+def max_message_tokens() -> int:
+    """ Most tokens a user message may cost and still fit PROMPT_TOKEN_BUDGET with the instructions. """
+    overhead = count_tokens(_INSTRUCTIONS) + count_tokens(_CLOSING) + 2 * _MESSAGE_TOKENS + _REPLY_TOKENS
+    return PROMPT_TOKEN_BUDGET - overhead - _HEADER_RESERVE_TOKENS
+
+
+def check_message(user_message: str) -> None:
+    """ Rejects a message too long to answer within PROMPT_TOKEN_BUDGET (413). """
+    tokens = count_tokens(user_message)
+    limit = max_message_tokens()
+    if tokens > limit:
+        raise HTTPException(status_code=413,
+                            detail=f"Message is too long ({tokens} tokens, at most {limit}). Please shorten it.")
+
+
+# --- Context sections ---
+
+class _Section:
+    """ A titled list of context lines, most valuable first; `lead` lines are taken in the first pass. """
+
+    def __init__(self, title: str, lines: List[str], lead: int):
+        self.title = title
+        self.lines = lines
+        self.lead = lead
+        self.taken = 0
+
+    def render(self) -> str:
+        return "\n".join([self.title] + self.lines[:self.taken])
+
+
+def describe_filters(filters: RetrievalFilters) -> str:
+    parts = []
+    if filters.start_date or filters.end_date:
+        parts.append(f"dates {filters.start_date or 'any'} to {filters.end_date or 'any'}")
+    if filters.categories:
+        parts.append("categories " + ", ".join(c.value for c in filters.categories))
+    if filters.min_amount is not None:
+        parts.append(f"amount >= {filters.min_amount:.2f}")
+    if filters.max_amount is not None:
+        parts.append(f"amount <= {filters.max_amount:.2f}")
+    if filters.flow:
+        parts.append(f"{filters.flow} only")
+    return "; ".join(parts) or "none"
+
+
+def _clip(description: str) -> str:
+    description = " ".join(description.split())
+    return description if len(description) <= _MAX_DESCRIPTION_CHARS else description[:_MAX_DESCRIPTION_CHARS - 3] + "..."
+
+
+def _transaction_lines(result: RetrievalResult) -> List[str]:
+    """ One line per merchant and category, in order of each group's best-ranked transaction. """
+    groups: Dict[Tuple[str, Optional[str]], list] = OrderedDict()
+    for t in result.transactions:
+        key = (normalize_description(t.description) or t.description, t.category)
+        groups.setdefault(key, []).append(t)
+    lines = []
+    for (merchant, category), transactions in groups.items():
+        category = category or "Uncategorized"
+        if len(transactions) == 1:
+            t = transactions[0]
+            lines.append(f'- {t.date.date()} | "{_clip(t.description)}" | {t.amount:.2f} | {category}')
+            continue
+        dates = sorted(t.date.date() for t in transactions)
+        span = f"{dates[0]}" if dates[0] == dates[-1] else f"{dates[0]} to {dates[-1]}"
+        total = sum(t.amount for t in transactions)
+        lines.append(f'- {span} | "{_clip(merchant)}" x{len(transactions)} | '
+                     f'total {total:.2f}, avg {total / len(transactions):.2f} | {category}')
+    return lines
+
+
+def _policy_lines(policies: List[PolicyDB], spending: Dict[str, float], filters: RetrievalFilters) -> List[str]:
+    asked = {c.value for c in filters.categories}
+
+    def utilization(policy: PolicyDB) -> float:
+        spent = spending.get(policy.policy_id, policy.current_spending)
+        return spent / policy.limit_amount if policy.limit_amount > 0 else float("inf")
+
+    ordered = sorted(policies, key=lambda p: (resolve_category(p.target_category) not in asked, -utilization(p)))
+    lines = []
+    for policy in ordered:
+        spent = spending.get(policy.policy_id, policy.current_spending)
+        left = policy.limit_amount - spent
+        status = f"{left:.2f} left" if left >= 0 else f"over by {-left:.2f}"
+        percent = f" ({spent / policy.limit_amount:.0%})" if policy.limit_amount > 0 else ""
+        lines.append(f"- {_clip(policy.description)}: {resolve_category(policy.target_category)}, {policy.timeframe} "
+                     f"limit {policy.limit_amount:.2f}; spent {spent:.2f}{percent}, {status}")
+    return lines
+
+
+def _goal_lines(goals: List[GoalDB]) -> List[str]:
+    lines = []
+    for goal in goals:
+        percent = f" ({goal.current_amount / goal.target_amount:.0%})" if goal.target_amount > 0 else ""
+        lines.append(f"- {_clip(goal.name)}: {goal.current_amount:.2f} of {goal.target_amount:.2f}{percent}")
+    return lines
+
+
+def _category_lines(result: RetrievalResult) -> List[str]:
+    lines = []
+    for c in result.categories:
+        received = c.total + c.spending
+        lines.append(f"- {c.category}: {c.transaction_count} | spent {c.spending:.2f}"
+                     + (f" | received {received:.2f}" if received > 0.005 else ""))
+    return lines
+
+
+def _month_lines(result: RetrievalResult) -> List[str]:
+    """ Newest month first; months before the last _RECENT_MONTHS are averaged on one line. """
+    recent = result.months[-_RECENT_MONTHS:][::-1]
+    lines = [f"- {m.month}: {m.transaction_count} | income {m.income:.2f} | spending {m.spending:.2f}" for m in recent]
+    older = result.months[:-_RECENT_MONTHS]
+    if older:
+        count = sum(m.transaction_count for m in older)
+        income = sum(m.income for m in older) / len(older)
+        spending = sum(m.spending for m in older) / len(older)
+        lines.append(f"- {older[0].month} to {older[-1].month} ({len(older)} months): {count} | "
+                     f"income {income:.2f}/month | spending {spending:.2f}/month")
+    return lines
+
+
+# --- Assembly ---
+
+def build_messages(user_message: str, result: RetrievalResult, policies: List[PolicyDB],
+                   policy_spending: Dict[str, float], goals: List[GoalDB]) -> Tuple[List[dict], dict]:
+    """
+    The chat messages for one turn within PROMPT_TOKEN_BUDGET, and what went into them:
+    {"tokens", "budget", "tokenizer", "sections": {name: [lines sent, lines available]}}.
+    `policy_spending` is each policy's spending in its current window, by policy_id.
+    """
+    header = (f"{_INSTRUCTIONS}\n\n"
+              f"Filters understood from the question: {describe_filters(result.filters)}.\n"
+              f"Across all {result.matched_count} matching transactions: total spending "
+              f"{max(result.total_spending, 0.0):.2f}, total income {result.total_income:.2f}.")
+    # Priority order: the first pass goes through the sections in this order, then the second.
+    sections: Dict[str, _Section] = OrderedDict(
+        transactions=_Section("Most relevant matching transactions (date | description | amount | category):",
+                              _transaction_lines(result), lead=5),
+        policies=_Section("Spending limits, current period:",
+                          _policy_lines(policies, policy_spending, result.filters), lead=len(policies)),
+        goals=_Section("Savings goals:", _goal_lines(goals), lead=len(goals)),
+        categories=_Section("By category, over the matching transactions (count | spent | received):",
+                            _category_lines(result) if len(result.categories) > 1 else [], lead=5),
+        months=_Section("By month, over the matching transactions (count | income | spending):",
+                        _month_lines(result) if len(result.months) > 1 else [], lead=3),
+    )
+
+    fixed = count_tokens(header) + count_tokens(_CLOSING) + count_tokens(user_message) + 2 * _MESSAGE_TOKENS + _REPLY_TOKENS
+    remaining = PROMPT_TOKEN_BUDGET - fixed
+    taken: List[_Section] = []
+    for first_pass in (True, False):
+        for section in sections.values():
+            limit = min(section.lead, len(section.lines)) if first_pass else len(section.lines)
+            while section.taken < limit:
+                # Blank line and title with the first line, then one line (and its newline) each.
+                cost = count_tokens(section.lines[section.taken] + "\n")
+                if section.taken == 0:
+                    cost += count_tokens("\n\n" + section.title)
+                if cost > remaining:
+                    break
+                remaining -= cost
+                section.taken += 1
+                taken.append(section)
+
+    def render() -> Tuple[List[dict], int]:
+        parts = [header] + [s.render() for s in sections.values() if s.taken] + [_CLOSING]
+        messages = [{"role": "system", "content": "\n\n".join(parts)}, {"role": "user", "content": user_message}]
+        tokens = sum(count_tokens(m["content"]) + _MESSAGE_TOKENS for m in messages) + _REPLY_TOKENS
+        return messages, tokens
+
+    messages, tokens = render()
+    # Lines were costed one at a time; drop the last taken if the whole text counts higher.
+    while tokens > PROMPT_TOKEN_BUDGET and taken:
+        taken.pop().taken -= 1
+        messages, tokens = render()
+    # Only the message is left to give: cut it to fit (check_message keeps this to a few tokens).
+    while tokens > PROMPT_TOKEN_BUDGET and user_message:
+        original = count_tokens(user_message)
+        user_message = _truncate_tokens(user_message, original - (tokens - PROMPT_TOKEN_BUDGET))
+        messages, tokens = render()
+        logger.warning(f"Chat message cut from {original} to {count_tokens(user_message)} tokens "
+                       f"to fit the prompt budget ({PROMPT_TOKEN_BUDGET})")
+    PROMPT_TOKENS.observe(tokens)
+    return messages, {
+        "tokens": tokens,
+        "budget": PROMPT_TOKEN_BUDGET,
+        "tokenizer": tokenizer_name(),
+        "sections": {name: [s.taken, len(s.lines)] for name, s in sections.items()},
+    }
@@ -0,0 +1,442 @@
+import calendar
+import logging
+import math
+import re
+from collections import Counter, defaultdict
+from datetime import date, timedelta
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+from app.core import metrics
+from app.core.config import (RETRIEVAL_MAX_K, RETRIEVAL_MIN_K, RETRIEVAL_RELATIVE_CUTOFF, RETRIEVAL_VECTOR_CANDIDATES,
+                             RETRIEVAL_VECTOR_WEIGHT)
+from app.core.models import (CategorySummary, MonthSummary, RetrievalFilters, RetrievalResult, RetrievedTransaction,
+                             TransactionCategory)
+from app.services import vector_store, working_set
+from app.services.categorizer import normalize_description
+from app.services.embeddings import embed_texts
+from app.services.working_set import TransactionColumns, UserWorkingSet
+
+logger = logging.getLogger(__name__)
+
+# =============================================================================
+# HYBRID TRANSACTION RETRIEVAL
+# =============================================================================
+# A chat query is answered from three signals over the user's columnar
+# working set (app.services.working_set):
+#   1. structured pre-filters parsed from the query (date range, categories,
+#      amount thresholds, spending vs. income),
+#   2. BM25 over an inverted index of normalized descriptions,
+#   3. vector similarity from the user's FAISS index, restricted to the rows
+#      that passed the filters.
+# The two scores are fused and the result size adapts to the score
+# distribution instead of a fixed top-3.
+
+# --- Query parsing ---
+
+_MONTHS = {name.lower(): i for i, name in enumerate(calendar.month_name) if name}
+_MONTHS.update({name.lower(): i for i, name in enumerate(calendar.month_abbr) if name and name.lower() != "may"})
+
+# Query words that select a category. Category names themselves are added below.
+_CATEGORY_SYNONYMS: Dict[str, TransactionCategory] = {
+    "grocery": TransactionCategory.GROCERIES, "groceries": TransactionCategory.GROCERIES,
+    "supermarket": TransactionCategory.GROCERIES,
+    "food": TransactionCategory.FOOD_DRINK, "restaurant": TransactionCategory.FOOD_DRINK,
+    "restaurants": TransactionCategory.FOOD_DRINK, "dining": TransactionCategory.FOOD_DRINK,
+    "eating out": TransactionCategory.FOOD_DRINK, "drinks": TransactionCategory.FOOD_DRINK,
+    "takeout": TransactionCategory.FOOD_DRINK,
+    "transportation": TransactionCategory.TRANSPORT, "rides": TransactionCategory.TRANSPORT,
+    "commute": TransactionCategory.TRANSPORT, "travel": TransactionCategory.TRANSPORT,
+    "rent": TransactionCategory.HOUSING, "mortgage": TransactionCategory.HOUSING,
+    "fuel": TransactionCategory.GAS, "gasoline": TransactionCategory.GAS,
+    "subscriptions": TransactionCategory.ENTERTAINMENT, "streaming": TransactionCategory.ENTERTAINMENT,
+    "salary": TransactionCategory.INCOME, "paycheck": TransactionCategory.INCOME,
+    "medical": TransactionCategory.HEALTH, "pharmacy": TransactionCategory.HEALTH,
+    "fitness": TransactionCategory.HEALTH, "gym": TransactionCategory.HEALTH,
+    "refunds": TransactionCategory.REFUND, "transfer": TransactionCategory.TRANSFERS,
+    "utility": TransactionCategory.UTILITIES, "bill": TransactionCategory.BILLS,
+    "insurance": TransactionCategory.BILLS, "gadgets": TransactionCategory.ELECTRONICS,
+}
+for _category in TransactionCategory:
+    if _category is not TransactionCategory.OTHER:
+        _CATEGORY_SYNONYMS[_category.value.lower()] = _category
+_CATEGORY_PATTERN = re.compile(
+    r"\b(" + "|".join(re.escape(k) for k in sorted(_CATEGORY_SYNONYMS, key=len, reverse=True)) + r")\b"
+)
+
+_AMOUNT = r"\$?\s*(\d[\d,]*(?:\.\d+)?)"
+_AMOUNT_BETWEEN = re.compile(r"\bbetween\s+" + _AMOUNT + r"\s+and\s+" + _AMOUNT)
+_AMOUNT_MIN = re.compile(r"(?:\b(?:over|above|more than|greater than|at least|exceeding)|>=?)\s*" + _AMOUNT)
+_AMOUNT_MAX = re.compile(r"(?:\b(?:under|below|less than|at most|cheaper than)|<=?)\s*" + _AMOUNT)
+
+_ISO_DATE = re.compile(r"\b(\d{4})-(\d{2})-(\d{2})\b")
+_RELATIVE_SPAN = re.compile(r"\b(?:last|past|previous)\s+(\d+)\s+(day|week|month|year)s?\b")
+_NAMED_PERIOD = re.compile(r"\b(today|yesterday|(?:this|last|previous)\s+(?:week|month|year))\b")
+_MONTH_NAME = re.compile(
+    r"\b(?:(in|during|since)\s+)?(" + "|".join(sorted(_MONTHS, key=len, reverse=True)) + r"|may)\b\.?(?:\s+(\d{4}))?"
+)
+_YEAR = re.compile(r"\b(?:in|during)\s+(\d{4})\b")
+
+_SPENDING_WORDS = re.compile(r"\b(spend|spent|spending|overspend|overspending|expenses?|paid for|cost|bought|purchases?)\b")
+_INCOME_WORDS = re.compile(r"\b(income|earn|earned|earnings|salary|paycheck|deposits?|received|refunds?)\b")
+
+_STOPWORDS = frozenset("""
+a an and are at be by did do does for from how i in is it me much my of on or so than that the this
+to was we were what when where which who why with you your have has had many am any all can show
+tell list give spend spent spending overspend overspending expense expenses cost bought purchase
+purchases paid money total transactions transaction
+""".split())
+
+
+def _month_range(year: int, month: int) -> Tuple[date, date]:
+    return date(year, month, 1), date(year, month, calendar.monthrange(year, month)[1])
+
+
+def _shift_month(year: int, month: int, delta: int) -> Tuple[int, int]:
+    index = year * 12 + (month - 1) + delta
+    return index // 12, index % 12 + 1
+
+
+def _named_period(phrase: str, today: date) -> Tuple[date, date]:
+    phrase = " ".join(phrase.split())
+    if phrase == "today":
+        return today, today
+    if phrase == "yesterday":
+        return today - timedelta(days=1), today - timedelta(days=1)
+    kind, unit = phrase.split()
+    offset = 0 if kind == "this" else -1
+    if unit == "week":
+        start = today - timedelta(days=today.weekday()) + timedelta(weeks=offset)
+        return start, start + timedelta(days=6)
+    if unit == "month":
+        return _month_range(*_shift_month(today.year, today.month, offset))
+    return date(today.year + offset, 1, 1), date(today.year + offset, 12, 31)
+
+
+def parse_query(query: str, today: Optional[date] = None) -> RetrievalFilters:
+    """
+    Extracts date range, categories, amount thresholds and spending/income direction
+    from a natural-language query. Whatever is not consumed by a filter is kept as
+    free-text search terms.
+    """
+    today = today or date.today()
+    text = query.lower()
+    filters = RetrievalFilters()
+
+    def consume(match: re.Match) -> None:
+        nonlocal text
+        text = text[:match.start()] + " " * (match.end() - match.start()) + text[match.end():]
+
+    # Amounts first, so "over 2000" is a threshold and not read as a year below.
+    match = _AMOUNT_BETWEEN.search(text)
+    if match:
+        low, high = (float(g.replace(",", "")) for g in match.groups())
+        filters.min_amount, filters.max_amount = min(low, high), max(low, high)
+        consume(match)
+    else:
+        match = _AMOUNT_MIN.search(text)
+        if match:
+            filters.min_amount = float(match.group(1).replace(",", ""))
+            consume(match)
+        match = _AMOUNT_MAX.search(text)
+        if match:
+            filters.max_amount = float(match.group(1).replace(",", ""))
+            consume(match)
+
+    # Dates: explicit ISO dates win over relative phrases, which win over month names.
+    iso_dates = []
+    for match in list(_ISO_DATE.finditer(text)):
+        try:
+            iso_dates.append(date(*(int(g) for g in match.groups())))
+        except ValueError:
+            continue
+        consume(match)
+    if iso_dates:
+        filters.start_date, filters.end_date = min(iso_dates), max(iso_dates)
+    elif (match := _RELATIVE_SPAN.search(text)):
+        count, unit = int(match.group(1)), match.group(2)
+        if unit == "month":
+            year, month = _shift_month(today.year, today.month, -count)
+            start = date(year, month, min(today.day, calendar.monthrange(year, month)[1]))
+        elif unit == "year":
+            start = date(today.year - count, today.month, min(today.day, 28 if today.month == 2 else today.day))
+        else:
+            start = today - timedelta(days=count * (7 if unit == "week" else 1))
+        filters.start_date, filters.end_date = start, today
+        consume(match)
+    elif (match := _NAMED_PERIOD.search(text)):
+        filters.start_date, filters.end_date = _named_period(match.group(1), today)
+        consume(match)
+    else:
+        for match in _MONTH_NAME.finditer(text):
+            preposition, name, year = match.groups()
+            # "may" is only a month when it clearly reads as one ("in may", "may 2024").
+            if name == "may" and not (preposition or year):
+                continue
+            month = _MONTHS.get(name, 5)
+            if year:
+                year = int(year)
+            else:
+                # Most recent occurrence of that month that is not in the future.
+                year = today.year if month <= today.month else today.year - 1
+            start, end = _month_range(year, month)
+            if preposition == "since":
+                end = today
+            filters.start_date, filters.end_date = start, end
+            consume(match)
+            break
+        else:
+            match = _YEAR.search(text)
+            if match:
+                year = int(match.group(1))
+                filters.start_date, filters.end_date = date(year, 1, 1), date(year, 12, 31)
+                consume(match)
+
+    # Category words stay in the text: they can also appear in descriptions.
+    for match in _CATEGORY_PATTERN.finditer(text):
+        category = _CATEGORY_SYNONYMS[match.group(1)]
+        if category not in filters.categories:
+            filters.categories.append(category)
+
+    if _SPENDING_WORDS.search(text) and TransactionCategory.INCOME not in filters.categories:
+        filters.flow = "spending"
+    elif _INCOME_WORDS.search(text):
+        filters.flow = "income"
+
+    filters.terms = [t for t in normalize_description(text).lower().split() if t not in _STOPWORDS and len(t) > 1]
+    return filters
+
+
+# --- Lexical index over the working set ---
+
+_EPOCH = date(1970, 1, 1)
+
+
+def _epoch_day(day: date) -> int:
+    return (day - _EPOCH).days
+
+
+class LexicalIndex:
+    """
+    BM25 inverted index over the normalized descriptions of a user's working-set
+    columns. Built once per working set and cached on it.
+    """
+
+    K1 = 1.2
+    B = 0.75
+
+    def __init__(self, columns: TransactionColumns):
+        n = columns.size
+        self.size = n
+        codes = columns.description_codes
+
+        # Postings: term -> (row ids, term frequencies). Each distinct description is
+        # tokenized once; rows are grouped by description code.
+        order = np.argsort(codes, kind="stable")
+        boundaries = np.flatnonzero(np.diff(codes[order])) + 1
+        rows_of = dict(zip(codes[order[np.r_[0, boundaries]]].tolist(), np.split(order, boundaries))) if n else {}
+
+        postings: Dict[str, List[Tuple[np.ndarray, int]]] = defaultdict(list)
+        distinct_lengths = np.zeros(len(columns.descriptions), dtype=np.float32)
+        for code, rows in rows_of.items():
+            tokens = normalize_description(columns.descriptions[code]).lower().split()
+            distinct_lengths[code] = len(tokens)
+            for token, tf in Counter(tokens).items():
+                postings[token].append((rows, tf))
+        self.postings = {
+            term: (np.concatenate([rows for rows, _ in entries]),
+                   np.concatenate([np.full(rows.size, tf, dtype=np.float32) for rows, tf in entries]))
+            for term, entries in postings.items()
+        }
+        lengths = distinct_lengths[codes]
+        self.length_norm = self.K1 * (1 - self.B + self.B * lengths / max(float(lengths.mean()) if n else 1.0, 1.0))
+
+    @property
+    def nbytes(self) -> int:
+        return sum(rows.nbytes + tf.nbytes for rows, tf in self.postings.values()) + self.length_norm.nbytes
+
+    def bm25(self, terms: List[str]) -> np.ndarray:
+        """ BM25 score of every row for the given query terms. """
+        scores = np.zeros(self.size, dtype=np.float32)
+        for term in set(terms):
+            posting = self.postings.get(term)
+            if posting is None:
+                continue
+            rows, tf = posting
+            idf = math.log(1 + (self.size - rows.size + 0.5) / (rows.size + 0.5))
+            scores[rows] += idf * tf * (self.K1 + 1) / (tf + self.length_norm[rows])
+        return scores
+
+
+def get_lexical_index(ws: UserWorkingSet) -> LexicalIndex:
+    index = ws.derived.get("lexical_index")
+    if index is None:
+        index = LexicalIndex(ws.columns)
+        working_set.attach(ws, "lexical_index", index, index.nbytes)
+    return index
+
+
+class VectorRows:
+    """ Working-set rows <-> positions in the user's vector index, for one size of that index. """
+
+    def __init__(self, ntotal: int, index_positions: np.ndarray):
+        self.ntotal = ntotal
+        # Index position of each row (-1 if not indexed yet), and the row of each index position.
+        self.index_positions = index_positions
+        self.rows = np.full(ntotal, -1, dtype=np.int64)
+        indexed = np.flatnonzero(index_positions >= 0)
+        self.rows[index_positions[indexed]] = indexed
+
+    @property
+    def nbytes(self) -> int:
+        return self.index_positions.nbytes + self.rows.nbytes
+
+
+async def get_vector_rows(clerk_id: str, ws: UserWorkingSet) -> VectorRows:
+    """
+    Maps the working set's rows to vector index positions once, and again only when the
+    index has grown (e.g. background indexing caught up), so queries pass int positions
+    instead of decoding and looking up transaction ids.
+    """
+    ntotal = (await vector_store.get_user_index(clerk_id)).ntotal
+    vector_rows = ws.derived.get("vector_rows")
+    if vector_rows is None or vector_rows.ntotal != ntotal:
+        ntotal, index_positions = await vector_store.row_positions(clerk_id, ws.columns.transaction_id_list())
+        vector_rows = VectorRows(ntotal, index_positions)
+        working_set.attach(ws, "vector_rows", vector_rows, vector_rows.nbytes)
+    return vector_rows
+
+
+def filter_mask(columns: TransactionColumns, filters: RetrievalFilters) -> np.ndarray:
+    """ Rows passing the structured filters, evaluated vectorized over the columns. """
+    mask = np.ones(columns.size, dtype=bool)
+    if filters.start_date:
+        mask &= columns.days >= _epoch_day(filters.start_date)
+    if filters.end_date:
+        mask &= columns.days <= _epoch_day(filters.end_date)
+    if filters.categories:
+        mask &= np.isin(columns.category_codes, [working_set.category_code(c.value) for c in filters.categories])
+    magnitude = np.abs(columns.amounts)
+    if filters.min_amount is not None:
+        mask &= magnitude >= filters.min_amount
+    if filters.max_amount is not None:
+        mask &= magnitude <= filters.max_amount
+    if filters.flow == "spending":
+        mask &= columns.amounts < 0
+    elif filters.flow == "income":
+        mask &= columns.amounts > 0
+    return mask
+
+
+def summarize(columns: TransactionColumns, rows: np.ndarray) -> Tuple[List[CategorySummary], List[MonthSummary]]:
+    """ Per-category (by spending, largest first) and per-month (oldest first) totals over `rows`, vectorized. """
+    amounts = columns.amounts[rows]
+    spending = np.where(amounts < 0, -amounts, 0.0)
+    income = np.where(amounts > 0, amounts, 0.0)
+
+    codes = columns.category_codes[rows].astype(np.int64)
+    slots = working_set.UNCATEGORIZED_CODE + 1
+    counts = np.bincount(codes, minlength=slots)
+    totals = np.bincount(codes, weights=amounts, minlength=slots)
+    spent = np.bincount(codes, weights=spending, minlength=slots)
+    categories = [
+        CategorySummary(category=working_set.CATEGORY_VALUES[code] if code < working_set.UNCATEGORIZED_CODE
+                        else "Uncategorized",
+                        total=float(totals[code]), spending=float(spent[code]), transaction_count=int(counts[code]),
+                        average=float(totals[code] / counts[code]))
+        for code in np.flatnonzero(counts)
+    ]
+    categories.sort(key=lambda c: c.spending, reverse=True)
+
+    month_values, month_index = np.unique(columns.timestamps[rows].astype("datetime64[M]"), return_inverse=True)
+    month_counts = np.bincount(month_index, minlength=month_values.size)
+    month_income = np.bincount(month_index, weights=income, minlength=month_values.size)
+    month_spending = np.bincount(month_index, weights=spending, minlength=month_values.size)
+    months = [
+        MonthSummary(month=str(month_values[i]), income=float(month_income[i]), spending=float(month_spending[i]),
+                     transaction_count=int(month_counts[i]))
+        for i in range(month_values.size)
+    ]
+    return categories, months
+
+
+# --- Scoring ---
+
+def _adaptive_cut(order: np.ndarray, scores: np.ndarray) -> np.ndarray:
+    """ Keeps results scoring within RETRIEVAL_RELATIVE_CUTOFF of the best, bounded to [MIN_K, MAX_K]. """
+    if order.size == 0:
+        return order
+    best = scores[order[0]]
+    keep = int(np.count_nonzero(scores[order] >= best * RETRIEVAL_RELATIVE_CUTOFF)) if best > 0 else 0
+    return order[:min(max(keep, RETRIEVAL_MIN_K), RETRIEVAL_MAX_K)]
+
+
+async def retrieve(clerk_id: str, query: str, ws: UserWorkingSet, today: Optional[date] = None,
+                   semantic_search: bool = True) -> RetrievalResult:
+    """
+    Hybrid retrieval for one chat query over the user's working set.
+    Aggregates (totals, category and month summaries) cover every row that passes
+    the parsed filters; `transactions` holds the best-scoring rows, as many as the
+    score distribution supports. Without `semantic_search` rows are ranked by
+    lexical scores only and the query is not embedded.
+    """
+    filters = parse_query(query, today)
+    columns = ws.columns
+    with metrics.span("retrieval.filter"):
+        candidates = np.flatnonzero(filter_mask(columns, filters))
+    result = RetrievalResult(filters=filters, matched_count=int(candidates.size))
+    if candidates.size == 0:
+        return result
+
+    _, result.total_income, result.total_spending = columns.totals(candidates)
+    with metrics.span("retrieval.summarize"):
+        result.categories, result.months = summarize(columns, candidates)
+
+    with metrics.span("retrieval.bm25"):
+        lexical_index = get_lexical_index(ws)
+        lexical = lexical_index.bm25(filters.terms)[candidates]
+    if lexical.size and lexical.max() > 0:
+        lexical = lexical / lexical.max()
+
+    semantic = np.zeros(candidates.size, dtype=np.float32)
+    if semantic_search:
+        try:
+            query_vector = await embed_texts([query])
+            vector_rows = await get_vector_rows(clerk_id, ws)
+            subset = None if candidates.size == columns.size else vector_rows.index_positions[candidates]
+            hits, hit_scores = await vector_store.search_positions(clerk_id, query_vector, RETRIEVAL_VECTOR_CANDIDATES, subset)
+            # Rows indexed after the mapping was taken are not in this working set.
+            known = hits < vector_rows.ntotal
+            rows = vector_rows.rows[hits[known]]
+            if rows.size:
+                position = np.full(columns.size, -1, dtype=np.int64)
+                position[candidates] = np.arange(candidates.size)
+                hit_positions = np.where(rows >= 0, position[np.maximum(rows, 0)], -1)
+                scores = np.maximum(hit_scores[known], 0.0)
+                semantic[hit_positions[hit_positions >= 0]] = scores[hit_positions >= 0]
+        except Exception as e:
+            # Lexical + structured retrieval still answers most questions.
+            logger.warning(f"Vector retrieval unavailable for user {clerk_id}, using lexical scores only: {e}")
+
+    scores = RETRIEVAL_VECTOR_WEIGHT * semantic + (1 - RETRIEVAL_VECTOR_WEIGHT) * lexical
+    if filters.is_structured() and candidates.size <= RETRIEVAL_MAX_K:
+        # The filters already pinned down a small set; every row is relevant.
+        order = np.argsort(-scores, kind="stable")
+    elif not scores.any():
+        # Nothing to rank by (e.g. "what did I buy last week"): most recent first.
+        order = np.argsort(-columns.days[candidates], kind="stable")[:RETRIEVAL_MAX_K]
+    else:
+        order = _adaptive_cut(np.argsort(-scores, kind="stable"), scores)
+
+    for i in order:
+        row = int(candidates[i])
+        result.transactions.append(RetrievedTransaction(
+            transaction_id=columns.transaction_id(row),
+            date=columns.timestamp(row),
+            description=columns.description(row),
+            amount=float(columns.amounts[row]),
+            category=columns.category(row),
+            score=float(scores[i]),
+        ))
+    return result
@@ -0,0 +1,182 @@
+import logging
+from collections import defaultdict
+from typing import Dict, Iterable, Optional, Tuple
+
+from pymongo import ReplaceOne, UpdateOne
+
+from app.core.database import get_db
+from app.core.models import (CategoryMonthRollup, CategorySummary, MonthSummary, SpendingSummary,
+                             TransactionCategory, TransactionDB, UserAggregates)
+
+logger = logging.getLogger(__name__)
+
+# =============================================================================
+# MATERIALIZED SPENDING ROLLUPS
+# =============================================================================
+# One `spending_rollups` document per (clerk_id, month, category) with running
+# count / net total / income / spending. Writes $inc the affected cells, so
+# dashboards and the chat prompt read a few hundred small documents instead of
+# scanning years of transactions.
+#
+# Amounts are signed: positive is income, negative is spending.
+
+ROLLUPS_COLLECTION = "spending_rollups"
+UNCATEGORIZED = "Uncategorized"
+
+
+def _month(transaction: TransactionDB) -> str:
+    return transaction.date.strftime("%Y-%m")
+
+
+def _category(transaction: TransactionDB) -> str:
+    category = transaction.category
+    if category is None:
+        return UNCATEGORIZED
+    return category.value if isinstance(category, TransactionCategory) else category
+
+
+async def apply_transactions(clerk_id: str, transactions: Iterable[TransactionDB]) -> None:
+    """ Adds newly inserted transactions to their (month, category) cells with one bulk upsert. """
+    cells: Dict[Tuple[str, str], Dict[str, float]] = defaultdict(lambda: {"count": 0, "total": 0.0, "income": 0.0, "spending": 0.0})
+    for t in transactions:
+        cell = cells[(_month(t), _category(t))]
+        cell["count"] += 1
+        cell["total"] += t.amount
+        if t.amount > 0:
+            cell["income"] += t.amount
+        else:
+            cell["spending"] -= t.amount
+    if not cells:
+        return
+
+    db = await get_db()
+    rollups_collection = db.get_collection(ROLLUPS_COLLECTION)
+    await rollups_collection.bulk_write([
+        UpdateOne({"clerk_id": clerk_id, "month": month, "category": category}, {"$inc": increments}, upsert=True)
+        for (month, category), increments in cells.items()
+    ], ordered=False)
+
+
+async def rebuild_rollups(clerk_id: str) -> int:
+    """ Recomputes all of a user's rollups from the transactions collection, inside Mongo. """
+    db = await get_db()
+    rollups_collection = db.get_collection(ROLLUPS_COLLECTION)
+    transactions_collection = db.get_collection("transactions")
+
+    pipeline = [
+        {"$match": {"clerk_id": clerk_id}},
+        {"$group": {
+            "_id": {
+                "month": {"$dateToString": {"format": "%Y-%m", "date": "$date"}},
+                "category": {"$ifNull": ["$category", UNCATEGORIZED]},
+            },
+            "count": {"$sum": 1},
+            "total": {"$sum": "$amount"},
+            "income": {"$sum": {"$cond": [{"$gt": ["$amount", 0]}, "$amount", 0]}},
+            "spending": {"$sum": {"$cond": [{"$lt": ["$amount", 0]}, {"$abs": "$amount"}, 0]}},
+        }},
+    ]
+    # Cells are replaced in place and stale ones deleted afterwards, so readers never
+    # see an empty summary. Only cells that existed before the aggregate can be stale:
+    # one created since then holds an $inc for rows the aggregate did not see.
+    existing = {(row["month"], row["category"])
+                async for row in rollups_collection.find({"clerk_id": clerk_id}, {"_id": 0, "month": 1, "category": 1})}
+    cells = [
+        {"clerk_id": clerk_id, "month": row["_id"]["month"], "category": row["_id"]["category"],
+         "count": row["count"], "total": row["total"], "income": row["income"], "spending": row["spending"]}
+        async for row in transactions_collection.aggregate(pipeline)
+    ]
+    if cells:
+        await rollups_collection.bulk_write([
+            ReplaceOne({"clerk_id": clerk_id, "month": cell["month"], "category": cell["category"]}, cell, upsert=True)
+            for cell in cells
+        ], ordered=False)
+    stale = existing - {(cell["month"], cell["category"]) for cell in cells}
+    if stale:
+        await rollups_collection.delete_many({
+            "clerk_id": clerk_id, "$or": [{"month": month, "category": category} for month, category in stale],
+        })
+    logger.info(f"Rebuilt {len(cells)} spending rollups for user {clerk_id}")
+    return len(cells)
+
+
+async def _load_rollups(clerk_id: str, start_month: Optional[str] = None, end_month: Optional[str] = None) -> list:
+    db = await get_db()
+    rollups_collection = db.get_collection(ROLLUPS_COLLECTION)
+    query: dict = {"clerk_id": clerk_id}
+    month_range = {}
+    if start_month:
+        month_range["$gte"] = start_month
+    if end_month:
+        month_range["$lte"] = end_month
+    if month_range:
+        query["month"] = month_range
+
+    rows = await rollups_collection.find(query, {"_id": 0, "clerk_id": 0}).sort("month", 1).to_list(length=None)
+    if not rows and not month_range:
+        # Users whose transactions predate rollups get them built on first read.
+        transactions_collection = db.get_collection("transactions")
+        if await transactions_collection.count_documents({"clerk_id": clerk_id}, limit=1):
+            await rebuild_rollups(clerk_id)
+            rows = await rollups_collection.find(query, {"_id": 0, "clerk_id": 0}).sort("month", 1).to_list(length=None)
+    return rows
+
+
+async def get_spending_summary(clerk_id: str, start_month: Optional[str] = None, end_month: Optional[str] = None) -> SpendingSummary:
+    """ Category x month totals, per-month income vs. spending and per-category averages, from rollups only. """
+    rows = await _load_rollups(clerk_id, start_month, end_month)
+
+    months: Dict[str, MonthSummary] = {}
+    categories: Dict[str, CategorySummary] = {}
+    cells = []
+    for row in rows:
+        cell = CategoryMonthRollup(**row, average=row["total"] / row["count"] if row["count"] else 0.0)
+        cells.append(cell)
+
+        month = months.setdefault(cell.month, MonthSummary(month=cell.month))
+        month.income += cell.income
+        month.spending += cell.spending
+        month.transaction_count += cell.count
+
+        category = categories.setdefault(cell.category, CategorySummary(category=cell.category))
+        category.total += cell.total
+        category.spending += cell.spending
+        category.transaction_count += cell.count
+
+    for category in categories.values():
+        category.average = category.total / category.transaction_count if category.transaction_count else 0.0
+
+    return SpendingSummary(
+        total_income=sum(m.income for m in months.values()),
+        total_spending=sum(m.spending for m in months.values()),
+        months=list(months.values()),
+        categories=sorted(categories.values(), key=lambda c: c.spending, reverse=True),
+        rollups=cells,
+    )
+
+
+async def get_aggregates(clerk_id: str) -> UserAggregates:
+    """ Lifetime transaction count and income/spending totals, summed from rollups. """
+    rows = await _load_rollups(clerk_id)
+    return UserAggregates(
+        transaction_count=sum(r["count"] for r in rows),
+        total_income=sum(r["income"] for r in rows),
+        total_spending=sum(r["spending"] for r in rows),
+    )
+
+
+async def rebuild_all_users() -> int:
+    """ Backfill: rebuilds rollups for every user. """
+    db = await get_db()
+    users_collection = db.get_collection("users")
+    count = 0
+    async for user in users_collection.find({}, {"clerk_id": 1}):
+        await rebuild_rollups(user["clerk_id"])
+        count += 1
+    return count
+
+
+if __name__ == "__main__":
+    import asyncio
+    logging.basicConfig(level=logging.INFO)
+    asyncio.run(rebuild_all_users())
@@ -1,12 +1,95 @@
+import base64
+import hashlib
+import json
 import logging
+from collections import Counter
+from datetime import date, datetime, time, timedelta
 from fastapi import HTTPException
+import orjson
+from pymongo import UpdateOne
+from pymongo.errors import BulkWriteError
 from pymongo.results import UpdateResult
+from app.core import metrics
+from app.core.config import IMPORT_BATCH_SIZE
 from app.core.database import get_db
-from app.core.models import UserDocumentDB, BankAccountDB, TransactionDB, FinancialContext, UserDocument, UserLoginRequest, AddTransactionRequest, AddPolicyRequest, PolicyDB
-from typing import List, Tuple
+from app.core.models import UserDocumentDB, BankAccountDB, GoalDB, TransactionDB, FinancialContext, UserDocument, UserLoginRequest, AddTransactionRequest, AddPolicyRequest, PolicyDB, TransactionCreate, TransactionPage, UserAggregates, PolicyStatus, SpendingSummary, ImportResult
+from app.services import policy_engine, rollups, vector_store, working_set
+from app.services.answer_cache import answer_cache
+from app.services.migrations import DUPLICATE_KEY_ERROR, migrate_user_transactions, transaction_document
+from typing import Any, Callable, Dict, List, Optional, Tuple
 
 logger = logging.getLogger(__name__)
 
+async def _on_transactions_added(clerk_id: str, transactions: List[TransactionDB]) -> None:
+    """
+    Post-write hook for newly persisted transactions:
+      - schedules embedding them once into the user's persistent vector index, so
+        chat requests never have to re-embed history (in the background; the
+        caller doesn't wait for the embeddings);
+      - adds them to the current spending of matching policies;
+      - adds them to the per-(month, category) spending rollups;
+      - drops the user's cached working set;
+      - bumps the user's data_version, which invalidates cached chat answers.
+    Failures are logged, not raised: the write already succeeded, the next chat
+    request backfills the index, and policy_engine.recompute_policies /
+    rollups.rebuild_rollups repair budgets and rollups.
+    """
+    working_set.invalidate(clerk_id)
+    answer_cache.invalidate(clerk_id)
+
+    try:
+        db = await get_db()
+        users_collection = db.get_collection("users")
+        await users_collection.update_one({"clerk_id": clerk_id}, {"$inc": {"data_version": 1}})
+    except Exception as e:
+        logger.error(f"Failed to bump data version for {clerk_id}: {e}")
+
+    try:
+        with metrics.span("ingest.policies"):
+            await policy_engine.apply_transactions(clerk_id, transactions)
+    except Exception as e:
+        logger.error(f"Failed to update policy spending for {clerk_id}: {e}")
+
+    try:
+        with metrics.span("ingest.rollups"):
+            await rollups.apply_transactions(clerk_id, transactions)
+    except Exception as e:
+        logger.error(f"Failed to update spending rollups for {clerk_id}: {e}")
+
+    vector_store.index_in_background(clerk_id, [t.transaction_id for t in transactions],
+                                     [t.description for t in transactions])
+
+async def update_transaction_categories(clerk_id: str, categories: Dict[str, str]) -> int:
+    """
+    Sets the category of existing transactions ({transaction_id: category}) in one bulk write.
+    Callers run on_transactions_recategorized once they are done.
+    """
+    if not categories:
+        return 0
+    db = await get_db()
+    transactions_collection = db.get_collection("transactions")
+    result = await transactions_collection.bulk_write([
+        UpdateOne({"clerk_id": clerk_id, "transaction_id": transaction_id}, {"$set": {"category": category}})
+        for transaction_id, category in categories.items()
+    ], ordered=False)
+    return result.modified_count
+
+async def on_transactions_recategorized(clerk_id: str) -> None:
+    """ Post-write hook for category changes. """
+    await rebuild_derived_state(clerk_id)
+
+async def rebuild_derived_state(clerk_id: str) -> None:
+    """
+    Drops cached working set and answers, bumps data_version, and rebuilds the rollups
+    and policy spending from the user's stored transactions.
+    """
+    working_set.invalidate(clerk_id)
+    answer_cache.invalidate(clerk_id)
+    db = await get_db()
+    await db.get_collection("users").update_one({"clerk_id": clerk_id}, {"$inc": {"data_version": 1}})
+    await rollups.rebuild_rollups(clerk_id)
+    await policy_engine.recompute_policies(clerk_id)
+
 async def get_or_create_user(login_data: UserLoginRequest) -> Tuple[bool, UserDocument]:
     """
     Fetches a user, or creates one with a default account if they don't exist.
@@ -40,46 +123,312 @@ async def get_or_create_user(login_data: UserLoginRequest) -> Tuple[bool, UserDo
     
     return False, UserDocument.model_validate(new_user_db_model.model_dump())
 
-async def add_single_transaction(clerk_id: str, transaction_data: AddTransactionRequest) -> bool:
-    """ Adds a single transaction to the user's top-level transactions array in MongoDB. """
+async def _user_exists(clerk_id: str) -> bool:
+    db = await get_db()
+    users_collection = db.get_collection("users")
+    return await users_collection.count_documents({"clerk_id": clerk_id}, limit=1) > 0
+
+async def add_single_transaction(clerk_id: str, transaction_data: AddTransactionRequest) -> Optional[TransactionDB]:
+    """
+    Adds a single transaction for the user to the `transactions` collection.
+    Returns the stored transaction, or None if the user was not found or the write failed.
+    """
     logger.info(f"Attempting to add single transaction for user: {clerk_id}")
     try:
+        if not await _user_exists(clerk_id):
+            logger.error(f"Failed to add transaction for user {clerk_id}. User not found.")
+            return None
+
         db = await get_db()
-        users_collection = db.get_collection("users")
-        transaction_db_model = TransactionDB(**transaction_data.dict())
-        transaction_dict = transaction_db_model.dict(by_alias=True)
-        
-        # --- THIS IS THE FIX ---
-        # The update path now correctly targets the top-level 'transactions' array.
-        result: UpdateResult = await users_collection.update_one(
-            {"clerk_id": clerk_id},
-            {"$push": {"transactions": transaction_dict}}
-        )
-        
-        if result.matched_count == 0 or result.modified_count == 0:
-            logger.error(f"Failed to add transaction for user {clerk_id}. User not found or no document modified.")
-            return False
-        return True
+        transactions_collection = db.get_collection("transactions")
+        transaction_db_model = TransactionDB(**transaction_data.model_dump())
+        await transactions_collection.insert_one(transaction_document(clerk_id, transaction_db_model))
     except Exception as e:
         logger.error(f"Error adding transaction for {clerk_id}: {e}")
-        return False
-    
-async def get_user_financial_context(clerk_id: str) -> FinancialContext | None:
-    """ Retrieves the complete financial context for a user. """
+        return None
+
+    await _on_transactions_added(clerk_id, [transaction_db_model])
+    return transaction_db_model
+
+def _fingerprint_description(description: str) -> str:
+    # Case and whitespace only: digits (check numbers, card refs) tell rows apart.
+    return " ".join(description.upper().split())
+
+def fingerprint_transactions(transactions: List[TransactionDB], seen: Optional[Counter] = None) -> None:
+    """
+    Sets each transaction's import fingerprint: a hash of (date, amount, normalized description,
+    account) plus how many times that key already occurred in this upload. Two identical purchases
+    on the same day stay distinct, while re-uploading the same rows reproduces the same fingerprints.
+    Pass the same `seen` counter for every chunk of one upload.
+    """
+    seen = seen if seen is not None else Counter()
+    for t in transactions:
+        key = _fingerprint_key(t)
+        occurrence = seen[key]
+        seen[key] += 1
+        t.fingerprint = hashlib.sha1(f"{key}|{occurrence}".encode("utf-8")).hexdigest()
+
+def _fingerprint_key(t) -> str:
+    return f"{t.date.date().isoformat()}|{t.amount:.2f}|{_fingerprint_description(t.description)}|{(t.account or '').strip().upper()}"
+
+def replay_fingerprints(transactions: List[TransactionCreate], seen: Counter) -> None:
+    """ Advances `seen` as fingerprint_transactions would, for rows an earlier run already imported. """
+    seen.update(_fingerprint_key(t) for t in transactions)
+
+async def _insert_unique(clerk_id: str, batch: List[TransactionDB]) -> List[TransactionDB]:
+    """
+    Inserts one batch with an unordered insert_many, skipping rows whose fingerprint is
+    already stored. Returns the transactions that were actually written.
+    """
+    db = await get_db()
+    transactions_collection = db.get_collection("transactions")
+
+    # Served by the (clerk_id, fingerprint) index; a full re-upload never reaches insert_many.
+    existing = {
+        doc["fingerprint"]
+        async for doc in transactions_collection.find(
+            {"clerk_id": clerk_id, "fingerprint": {"$in": [t.fingerprint for t in batch]}},
+            {"_id": 0, "fingerprint": 1},
+        )
+    }
+    fresh = [t for t in batch if t.fingerprint not in existing]
+    if not fresh:
+        return []
+
+    try:
+        await transactions_collection.insert_many([transaction_document(clerk_id, t) for t in fresh], ordered=False)
+        return fresh
+    except BulkWriteError as e:
+        # A concurrent upload of the same rows won the race; the unique index rejected ours.
+        errors = e.details.get("writeErrors", [])
+        if any(err.get("code") != DUPLICATE_KEY_ERROR for err in errors):
+            raise
+        rejected = {err["index"] for err in errors}
+        return [t for i, t in enumerate(fresh) if i not in rejected]
+
+async def add_transactions_to_user(clerk_id: str, transactions: List[TransactionCreate],
+                                   seen: Optional[Counter] = None) -> Optional[ImportResult]:
+    """
+    Idempotently imports a batch of parsed transactions (e.g. one CSV chunk) for the user.
+    Rows already imported by an earlier upload are skipped via their fingerprint.
+    Returns imported/skipped counts, or None if the user was not found or the write failed.
+    """
+    logger.info(f"Attempting to add {len(transactions)} transactions for user: {clerk_id}")
+    inserted: List[TransactionDB] = []
+    try:
+        if not await _user_exists(clerk_id):
+            logger.error(f"Failed to add transactions for user {clerk_id}. User not found.")
+            return None
+
+        transaction_db_models = [TransactionDB(**t.model_dump()) for t in transactions]
+        fingerprint_transactions(transaction_db_models, seen)
+        for start in range(0, len(transaction_db_models), IMPORT_BATCH_SIZE):
+            with metrics.span("mongo.insert_transactions"):
+                inserted.extend(await _insert_unique(clerk_id, transaction_db_models[start:start + IMPORT_BATCH_SIZE]))
+    except Exception as e:
+        logger.error(f"Error adding transactions for {clerk_id}: {e}")
+        return None
+    finally:
+        # Whatever was written, even before a failure, must reach the rollups, policies and index.
+        if inserted:
+            await _on_transactions_added(clerk_id, inserted)
+
+    return ImportResult(imported_count=len(inserted), skipped_count=len(transactions) - len(inserted))
+
+# --- Read helpers (filters, pagination, aggregates) ---
+
+def _transaction_filter(clerk_id: str, start_date: Optional[date] = None, end_date: Optional[date] = None,
+                        categories: Optional[List[str]] = None) -> dict:
+    """ Mongo filter for a user's transactions; the date range is inclusive on both ends. """
+    query: dict = {"clerk_id": clerk_id}
+    date_range = {}
+    if start_date:
+        date_range["$gte"] = datetime.combine(start_date, time.min)
+    if end_date:
+        date_range["$lt"] = datetime.combine(end_date + timedelta(days=1), time.min)
+    if date_range:
+        query["date"] = date_range
+    if categories:
+        query["category"] = {"$in": categories}
+    return query
+
+def _encode_cursor(transaction: dict) -> str:
+    payload = json.dumps([transaction["date"].isoformat(), transaction["transaction_id"]])
+    return base64.urlsafe_b64encode(payload.encode("utf-8")).decode("ascii")
+
+def _decode_cursor(cursor: str) -> Tuple[datetime, str]:
+    """ Raises ValueError for malformed cursors. """
+    try:
+        date_str, transaction_id = json.loads(base64.urlsafe_b64decode(cursor.encode("ascii")))
+        return datetime.fromisoformat(date_str), transaction_id
+    except Exception as e:
+        raise ValueError(f"Invalid cursor: {cursor}") from e
+
+async def list_transactions(clerk_id: str, start_date: Optional[date] = None, end_date: Optional[date] = None,
+                            categories: Optional[List[str]] = None, cursor: Optional[str] = None,
+                            limit: int = 100, fields: Optional[List[str]] = None) -> TransactionPage:
+    """
+    Returns one page of the user's transactions, newest first, ordered by (date, transaction_id).
+    Filters, the keyset cursor and the field projection are all pushed down to Mongo.
+    """
+    query = _transaction_filter(clerk_id, start_date, end_date, categories)
+    if cursor:
+        cursor_date, cursor_id = _decode_cursor(cursor)
+        query = {"$and": [query, {"$or": [
+            {"date": {"$lt": cursor_date}},
+            {"date": cursor_date, "transaction_id": {"$lt": cursor_id}},
+        ]}]}
+
+    # The sort keys are always projected so the next cursor can be built.
+    projection = {"_id": 0}
+    if fields:
+        projection.update({f: 1 for f in (set(fields) & set(TransactionDB.model_fields)) | {"date", "transaction_id"}})
+    else:
+        projection["clerk_id"] = 0
+
+    db = await get_db()
+    transactions_collection = db.get_collection("transactions")
+    documents = await (
+        transactions_collection.find(query, projection)
+        .sort([("date", -1), ("transaction_id", -1)])
+        .limit(limit + 1)
+        .to_list(length=limit + 1)
+    )
+
+    next_cursor = _encode_cursor(documents[limit - 1]) if len(documents) > limit else None
+    return TransactionPage(transactions=documents[:limit], next_cursor=next_cursor)
+
+async def get_user_aggregates(clerk_id: str) -> UserAggregates:
+    """
+    Transaction count and income/spending totals for the user: summed over the cached
+    working set when it is resident and current, otherwise read from the spending rollups.
+    """
+    ws = await working_set.get_working_set(clerk_id, load=False)
+    if ws is not None:
+        return ws.aggregates()
+    return await rollups.get_aggregates(clerk_id)
+
+async def get_spending_summary(clerk_id: str, start_month: Optional[str] = None, end_month: Optional[str] = None) -> SpendingSummary:
+    """ Per-category / per-month totals for dashboards, read from the spending rollups. """
+    return await rollups.get_spending_summary(clerk_id, start_month, end_month)
+
+# Only what FinancialContext needs. The $slice peeks at the legacy embedded array
+# to see whether this user still needs migrating.
+_USER_CONTEXT_PROJECTION = {
+    "_id": 0, "goals": 1, "policies": 1,
+    "transactions": {"$slice": 1},
+}
+# Every TransactionDB field; leaves out clerk_id.
+_TRANSACTION_CONTEXT_PROJECTION = {"_id": 0, **{name: 1 for name in TransactionDB.model_fields}}
+
+
+def _wire_fields(model) -> List[Tuple[str, Callable[[], Any], bool]]:
+    """ (name, default, is_float) per field of `model`, in declaration order. """
+    fields = []
+    for name, field in model.model_fields.items():
+        if field.default_factory is not None:
+            default = field.default_factory
+        else:
+            value = None if field.is_required() else field.default
+            default = lambda value=value: value
+        fields.append((name, default, field.annotation is float))
+    return fields
+
+
+_GOAL_FIELDS = _wire_fields(GoalDB)
+_POLICY_FIELDS = _wire_fields(PolicyDB)
+_TRANSACTION_FIELDS = _wire_fields(TransactionDB)
+
+
+def _to_wire(documents: List[dict], fields: List[Tuple[str, Callable[[], Any], bool]]) -> List[dict]:
+    """
+    Shapes stored documents the way the pydantic model would dump them: every declared
+    field (missing ones at their default), nothing else, floats as floats.
+    """
+    shaped = []
+    for document in documents:
+        item = {}
+        for name, default, is_float in fields:
+            value = document[name] if name in document else default()
+            item[name] = float(value) if is_float and value is not None else value
+        shaped.append(item)
+    return shaped
+
+
+async def get_data_version(clerk_id: str) -> Optional[int]:
+    """ Counter bumped on every transaction or policy write; None if the user does not exist. """
     db = await get_db()
     users_collection = db.get_collection("users")
-    user_data = await users_collection.find_one({"clerk_id": clerk_id})
+    user_data = await users_collection.find_one({"clerk_id": clerk_id}, {"_id": 0, "data_version": 1})
+    if user_data is None:
+        return None
+    return user_data.get("data_version", 0)
+
+async def _load_context_documents(clerk_id: str, start_date: Optional[date] = None, end_date: Optional[date] = None,
+                                  categories: Optional[List[str]] = None, transaction_limit: Optional[int] = None,
+                                  include_transactions: bool = True) -> Optional[dict]:
+    """ Raw goals/policies/transactions documents for a user's context, or None if the user does not exist. """
+    db = await get_db()
+    users_collection = db.get_collection("users")
+    user_data = await users_collection.find_one({"clerk_id": clerk_id}, _USER_CONTEXT_PROJECTION)
     if not user_data:
         return None
-    
-    # We validate against the DB model first
-    user_db_model = UserDocumentDB(**user_data)
-    # Then we convert to the FinancialContext API model
-    return FinancialContext.model_validate(user_db_model.model_dump())
+    if user_data.get("transactions"):
+        await migrate_user_transactions(clerk_id)
+
+    transactions = []
+    if include_transactions:
+        transactions_collection = db.get_collection("transactions")
+        query = _transaction_filter(clerk_id, start_date, end_date, categories)
+        cursor = transactions_collection.find(query, _TRANSACTION_CONTEXT_PROJECTION)
+        with metrics.span("mongo.context_read"):
+            if transaction_limit:
+                cursor = cursor.sort([("date", -1), ("transaction_id", -1)]).limit(transaction_limit)
+                transactions = list(reversed(await cursor.to_list(length=transaction_limit)))
+            else:
+                transactions = await cursor.sort("date", 1).to_list(length=None)
+
+    return {
+        "goals": user_data.get("goals", []),
+        "policies": user_data.get("policies", []),
+        "transactions": transactions,
+    }
 
-async def add_policy_to_user(clerk_id: str, policy_data: AddPolicyRequest) -> bool:
+async def get_user_financial_context(clerk_id: str, start_date: Optional[date] = None, end_date: Optional[date] = None,
+                                     categories: Optional[List[str]] = None, transaction_limit: Optional[int] = None,
+                                     include_transactions: bool = True) -> FinancialContext | None:
+    """
+    Retrieves the financial context for a user. By default this is the complete history;
+    the optional filters narrow the transactions, and transaction_limit keeps only the most recent ones.
+    The documents are validated once, straight into FinancialContext.
+    """
+    documents = await _load_context_documents(clerk_id, start_date, end_date, categories, transaction_limit, include_transactions)
+    if documents is None:
+        return None
+    return FinancialContext.model_validate(documents)
+
+async def get_user_financial_context_json(clerk_id: str, start_date: Optional[date] = None, end_date: Optional[date] = None,
+                                          categories: Optional[List[str]] = None, transaction_limit: Optional[int] = None,
+                                          include_transactions: bool = True) -> bytes | None:
+    """
+    Same context as get_user_financial_context, serialized straight to JSON bytes for API responses.
+    Skips pydantic validation (every stored document was validated by this service when it was
+    written) but keeps FinancialContext's wire shape.
+    """
+    documents = await _load_context_documents(clerk_id, start_date, end_date, categories, transaction_limit, include_transactions)
+    if documents is None:
+        return None
+    with metrics.span("context.serialize"):
+        return orjson.dumps({
+            "goals": _to_wire(documents["goals"], _GOAL_FIELDS),
+            "policies": _to_wire(documents["policies"], _POLICY_FIELDS),
+            "transactions": _to_wire(documents["transactions"], _TRANSACTION_FIELDS),
+        })
+
+async def add_policy_to_user(clerk_id: str, policy_data: AddPolicyRequest) -> Optional[PolicyDB]:
     """
     Adds a new spending policy to the user's 'policies' list in MongoDB.
+    Returns the stored policy, or None if the user was not found or the write failed.
     """
     logger.info(f"Attempting to add policy for user: {clerk_id}")
     try:
@@ -89,22 +438,41 @@ async def add_policy_to_user(clerk_id: str, policy_data: AddPolicyRequest) -> bo
         # Convert the incoming request data to the full PolicyDB model.
         # This automatically adds default values like policy_id, timeframe, etc.
         policy_db_model = PolicyDB(**policy_data.dict())
+        # Start tracking the current window, seeded from transactions already in it.
+        policy_db_model = await policy_engine.initialize_policy(clerk_id, policy_db_model)
         policy_dict = policy_db_model.dict(by_alias=True)
 
         # Find the user by clerk_id and push the new policy into their 'policies' array.
+        # data_version changes with it so cached chat answers are not reused.
         result: UpdateResult = await users_collection.update_one(
             {"clerk_id": clerk_id},
-            {"$push": {"policies": policy_dict}}
+            {"$push": {"policies": policy_dict}, "$inc": {"data_version": 1}}
         )
 
         # Check if a document was found and modified.
         if result.modified_count == 0:
             logger.warning(f"Could not add policy for {clerk_id}. User not found or no changes made.")
-            return False
+            return None
 
+        answer_cache.invalidate(clerk_id)
         logger.info(f"Successfully added policy for user: {clerk_id}")
-        return True
+        return policy_db_model
 
     except Exception as e:
         logger.error(f"An unexpected error occurred while adding policy for {clerk_id}: {e}")
-        return False
\ No newline at end of file
+        return None
+
+async def get_policy_statuses(clerk_id: str) -> List[PolicyStatus]:
+    """
+    Budget status for each of the user's policies. Reads the maintained counters
+    (rolling any window that has ended) instead of scanning transactions.
+    """
+    policies, _ = await policy_engine.roll_windows(clerk_id)
+    return [
+        PolicyStatus(
+            **policy.model_dump(),
+            remaining=policy.limit_amount - policy.current_spending,
+            utilization=policy.current_spending / policy.limit_amount if policy.limit_amount else 0.0,
+        )
+        for policy in policies
+    ]
@@ -0,0 +1,540 @@
+import asyncio
+import fcntl
+import hashlib
+import json
+import logging
+import os
+import struct
+import threading
+import weakref
+from contextlib import contextmanager, nullcontext
+from typing import TYPE_CHECKING, Dict, Iterator, List, Optional, Set, Tuple
+
+import numpy as np
+
+from app.core import lazy_imports, metrics
+from app.core.cache import LRUCache
+from app.core.config import (VECTOR_CACHE_MAX_BYTES, VECTOR_CACHE_MAX_USERS, VECTOR_INDEX_DIR,
+                             VECTOR_LOG_COMPACT_MIN_ROWS, VECTOR_LOG_COMPACT_RATIO)
+from app.core.models import TransactionDB
+from app.services import ann_index
+from app.services.embeddings import embed_texts, embedding_model
+
+if TYPE_CHECKING:
+    import faiss
+
+logger = logging.getLogger(__name__)
+
+# =============================================================================
+# PERSISTENT PER-USER VECTOR INDEX
+# =============================================================================
+# Each user gets one FAISS index on local disk plus a JSON sidecar that maps
+# FAISS row positions back to transaction ids and descriptions. Transactions
+# are embedded exactly once, when they are first written (in the background,
+# see index_in_background); a chat request only has to embed the user's query.
+#
+# Appends don't rewrite that snapshot. New rows go to an append-only log next to
+# it (ids, descriptions and vectors per record), which loading replays on top of
+# the snapshot. The log is compacted into a fresh snapshot once it holds
+# VECTOR_LOG_COMPACT_RATIO of the snapshot's rows (and at least
+# VECTOR_LOG_COMPACT_MIN_ROWS), and right after the index is rebuilt as another
+# type. An flock on a per-user lock file orders appends and compaction between
+# processes; a record cut short by a crash is dropped by the next append.
+#
+# The index type (exact flat, HNSW or IVF-PQ) follows the user's corpus size and
+# is rebuilt as the next type when the user outgrows it; see app.services.ann_index.
+# IVF-PQ indexes also keep their full vectors in a third file, which is
+# memory-mapped to re-score search candidates. Files are keyed by the embedding
+# backend's vector space (embeddings.embedding_model()) as well as the user.
+# faiss is imported where an index is built, read or written, not at app startup.
+
+
+# Filtered searches over at most this many rows of an approximate index are scored exactly.
+_EXACT_SUBSET_ROWS = 4096
+# Memory per row besides its vector and text: two str objects, list slots and a dict entry.
+_ROW_OVERHEAD_BYTES = 200
+
+
+class UserVectorIndex:
+    """ A FAISS inner-product index over one user's transaction descriptions. """
+
+    def __init__(self, clerk_id: str, index: Optional["faiss.Index"] = None,
+                 transaction_ids: Optional[List[str]] = None,
+                 descriptions: Optional[List[str]] = None,
+                 params: Optional[dict] = None):
+        self.clerk_id = clerk_id
+        self.index = index
+        # Index type and tuned search settings (ann_index.build); indexes saved before these existed are flat.
+        self.params: dict = params or {"kind": ann_index.FLAT}
+        self.transaction_ids: List[str] = transaction_ids or []
+        self.descriptions: List[str] = descriptions or []
+        self._positions: Dict[str, int] = {tid: pos for pos, tid in enumerate(self.transaction_ids)}
+        self._text_bytes = _text_bytes(self.transaction_ids, self.descriptions)
+        # Which snapshot this was loaded from (its meta file's mtime), how far into the
+        # log it has replayed, how many rows came from the log, and whether add()
+        # rebuilt the index since the snapshot was written.
+        self.snapshot_mtime = 0
+        self.log_offset = 0
+        self.log_rows = 0
+        self.rebuilt = False
+        # An IVF-PQ index's full vectors (float32, one row per position).
+        self.vectors_path = _user_paths(clerk_id).vectors
+        self._vectors: Optional[np.ndarray] = None
+
+    @property
+    def ntotal(self) -> int:
+        return self.index.ntotal if self.index is not None else 0
+
+    @property
+    def kind(self) -> str:
+        return self.params.get("kind", ann_index.FLAT)
+
+    @property
+    def memory_bytes(self) -> int:
+        """ Estimated memory of the FAISS index (not the id/description lists or memory-mapped vectors). """
+        return ann_index.estimate_bytes(self.kind, self.ntotal, self.index.d) if self.index is not None else 0
+
+    @property
+    def nbytes(self) -> int:
+        """ Estimated memory of the whole entry: the FAISS index plus the id and description lists. """
+        return self.memory_bytes + self._text_bytes
+
+    def contains(self, transaction_id: str) -> bool:
+        return transaction_id in self._positions
+
+    def add(self, transaction_ids: List[str], descriptions: List[str], embeddings: np.ndarray):
+        """
+        Appends already-normalized embeddings. Row i of the index == transaction_ids[i].
+        Rebuilds the index as another type when the grown corpus calls for one.
+        """
+        embeddings = np.ascontiguousarray(embeddings, dtype=np.float32)
+        start = len(self.transaction_ids)
+        kind = ann_index.choose_kind(start + len(embeddings), embeddings.shape[1])
+        vectors, offset = embeddings, start
+        if self.index is None:
+            self.index, self.params = ann_index.build(kind, embeddings)
+        elif kind != self.kind and ann_index.can_rebuild(self.kind):
+            previous = self.kind
+            vectors, offset = np.vstack([self.index.reconstruct_n(0, self.index.ntotal), embeddings]), 0
+            self.index, self.params = ann_index.build(kind, vectors)
+            logger.info(f"Rebuilt the vector index of user {self.clerk_id} as {kind} (was {previous}): {self.params}")
+            self.rebuilt = True
+        else:
+            self.index.add(embeddings)
+        if self.kind == ann_index.IVFPQ:
+            self._store_vectors(offset, vectors)
+        self.transaction_ids.extend(transaction_ids)
+        self.descriptions.extend(descriptions)
+        self._text_bytes += _text_bytes(transaction_ids, descriptions)
+        self._positions.update((tid, start + i) for i, tid in enumerate(transaction_ids))
+
+    def positions_of(self, transaction_ids: List[str]) -> np.ndarray:
+        """ Index position of each transaction id, -1 where it is not indexed. """
+        get = self._positions.get
+        return np.fromiter((get(tid, -1) for tid in transaction_ids), dtype=np.int64, count=len(transaction_ids))
+
+    def search(self, query_vector: np.ndarray, k: int,
+               transaction_ids: Optional[List[str]] = None) -> List[Tuple[str, str, float]]:
+        """
+        Returns up to k (transaction_id, description, score) tuples, best first.
+        If `transaction_ids` is given, only those rows are considered (see search_positions).
+        """
+        subset = None if transaction_ids is None else self.positions_of(transaction_ids)
+        positions, scores = self.search_positions(query_vector, k, subset)
+        return [(self.transaction_ids[pos], self.descriptions[pos], float(score)) for pos, score in zip(positions, scores)]
+
+    def search_positions(self, query_vector: np.ndarray, k: int,
+                         subset: Optional[np.ndarray] = None) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Returns the positions and scores of up to k rows, best first. If `subset` (index
+        positions; negative entries are ignored) is given, only those rows are considered
+        (FAISS ID selector), so structured pre-filters don't cost recall.
+        """
+        if self.ntotal == 0:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)
+        selector, fraction = None, 1.0
+        if subset is not None:
+            subset = np.ascontiguousarray(subset[subset >= 0], dtype=np.int64)
+            if subset.size == 0:
+                return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)
+            k = min(k, subset.size)
+            if self.kind != ann_index.FLAT and subset.size <= _EXACT_SUBSET_ROWS:
+                # An approximate search would mostly visit filtered-out rows; scoring the few exactly is cheaper.
+                return self._search_exact(query_vector, k, subset)
+            faiss = lazy_imports.load("faiss")
+
+            selector, fraction = faiss.IDSelectorBatch(subset), subset.size / self.ntotal
+        vectors = self._full_vectors() if self.kind == ann_index.IVFPQ else None
+        scores, positions = ann_index.search(self.index, self.params, query_vector, min(k, self.ntotal),
+                                             selector, fraction, vectors)
+        if subset is not None and self.kind != ann_index.FLAT and len(positions) < k:
+            # The graph / probed lists held too few of the selected rows (they sit far from
+            # the query); score the subset exactly rather than return a short list.
+            return self._search_exact(query_vector, k, subset)
+        return np.asarray(positions, dtype=np.int64), np.asarray(scores, dtype=np.float32)
+
+    def _search_exact(self, query_vector: np.ndarray, k: int, positions: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        rows = self._full_vectors()[positions] if self.kind == ann_index.IVFPQ else self.index.reconstruct_batch(positions)
+        scores = np.asarray(rows, dtype=np.float32) @ np.asarray(query_vector, dtype=np.float32).reshape(-1)
+        best = np.argsort(-scores, kind="stable")[:k]
+        return positions[best], scores[best]
+
+    def _full_vectors(self) -> np.ndarray:
+        if self._vectors is None or len(self._vectors) < self.ntotal:
+            self._vectors = np.memmap(self.vectors_path, dtype=np.float32, mode="r").reshape(-1, self.index.d)
+        return self._vectors
+
+    def _store_vectors(self, start: int, vectors: np.ndarray):
+        """ Writes rows from position `start` on, dropping any rows an interrupted write left past them. """
+        os.makedirs(VECTOR_INDEX_DIR, exist_ok=True)
+        with open(self.vectors_path, "r+b" if start and os.path.exists(self.vectors_path) else "wb") as f:
+            f.seek(start * vectors.shape[1] * 4)
+            f.write(np.ascontiguousarray(vectors, dtype=np.float32).tobytes())
+            f.truncate()
+        self._vectors = None
+
+
+def _text_bytes(transaction_ids: List[str], descriptions: List[str]) -> int:
+    return (sum(map(len, transaction_ids)) + sum(map(len, descriptions))
+            + _ROW_OVERHEAD_BYTES * len(transaction_ids))
+
+
+# --- Storage helpers ---
+
+# Log record header: byte lengths of the JSON part (ids, descriptions) and of the float32 vectors.
+_RECORD_HEADER = struct.Struct("<II")
+
+
+class _Paths:
+    def __init__(self, clerk_id: str):
+        # Hash the id so arbitrary clerk ids can never escape the index directory.
+        key = hashlib.sha1(f"{embedding_model()}:{clerk_id}".encode("utf-8")).hexdigest()
+        base = os.path.join(VECTOR_INDEX_DIR, key)
+        self.index = base + ".faiss"
+        self.meta = base + ".json"
+        self.vectors = base + ".vectors"
+        self.log = base + ".log"
+        self.lock = base + ".lock"
+
+
+def _user_paths(clerk_id: str) -> _Paths:
+    return _Paths(clerk_id)
+
+
+def _mtime(path: str) -> int:
+    return os.stat(path).st_mtime_ns if os.path.exists(path) else 0
+
+
+def _size(path: str) -> int:
+    return os.path.getsize(path) if os.path.exists(path) else 0
+
+
+@contextmanager
+def _file_lock(paths: _Paths, exclusive: bool) -> Iterator[None]:
+    """ Cross-process lock on the user's files: shared to read them, exclusive to append or compact. """
+    os.makedirs(VECTOR_INDEX_DIR, exist_ok=True)
+    with open(paths.lock, "a+b") as f:
+        fcntl.flock(f, fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+        try:
+            yield
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+
+def _load(clerk_id: str) -> UserVectorIndex:
+    """ Reads the snapshot and replays the log after it. Caller holds the file lock. """
+    paths = _user_paths(clerk_id)
+    if os.path.exists(paths.index) and os.path.exists(paths.meta):
+        faiss = lazy_imports.load("faiss")
+
+        with open(paths.meta, "r", encoding="utf-8") as f:
+            meta = json.load(f)
+        user_index = UserVectorIndex(
+            clerk_id,
+            index=faiss.read_index(paths.index),
+            transaction_ids=meta["transaction_ids"],
+            descriptions=meta["descriptions"],
+            params=meta.get("index"),
+        )
+        user_index.snapshot_mtime = _mtime(paths.meta)
+    else:
+        user_index = UserVectorIndex(clerk_id)
+    _replay_log(user_index, paths)
+    return user_index
+
+
+def _replay_log(user_index: UserVectorIndex, paths: _Paths) -> bool:
+    """
+    Adds the log records past user_index.log_offset. Rows the index already holds
+    are skipped, so replaying is idempotent. Returns False if the log ends in a
+    partial record (a crashed append); the offset then stops before it.
+    """
+    if _size(paths.log) <= user_index.log_offset:
+        return True
+    with open(paths.log, "rb") as f:
+        f.seek(user_index.log_offset)
+        data = f.read()
+    position = 0
+    while position < len(data):
+        if len(data) - position < _RECORD_HEADER.size:
+            return False
+        header_bytes, vector_bytes = _RECORD_HEADER.unpack_from(data, position)
+        header_end = position + _RECORD_HEADER.size + header_bytes
+        end = header_end + vector_bytes
+        if end > len(data):
+            return False
+        record = json.loads(data[position + _RECORD_HEADER.size:header_end])
+        transaction_ids, descriptions = record["transaction_ids"], record["descriptions"]
+        vectors = np.frombuffer(data, dtype=np.float32, count=vector_bytes // 4, offset=header_end)
+        vectors = vectors.reshape(len(transaction_ids), -1)
+        fresh = [i for i, tid in enumerate(transaction_ids) if not user_index.contains(tid)]
+        if fresh:
+            user_index.add([transaction_ids[i] for i in fresh], [descriptions[i] for i in fresh], vectors[fresh])
+        user_index.log_rows += len(fresh)
+        user_index.log_offset += end - position
+        position = end
+    return True
+
+
+def _append_log(user_index: UserVectorIndex, paths: _Paths, transaction_ids: List[str],
+                descriptions: List[str], embeddings: np.ndarray):
+    """ Appends one record. Caller holds the exclusive file lock and has replayed the log to its end. """
+    header = json.dumps({"transaction_ids": transaction_ids, "descriptions": descriptions}).encode("utf-8")
+    vectors = np.ascontiguousarray(embeddings, dtype=np.float32).tobytes()
+    with open(paths.log, "ab") as f:
+        f.write(_RECORD_HEADER.pack(len(header), len(vectors)) + header + vectors)
+        user_index.log_offset = f.tell()
+    user_index.log_rows += len(transaction_ids)
+
+
+def _needs_compaction(user_index: UserVectorIndex, appended: int) -> bool:
+    """ Whether to snapshot instead of logging `appended` rows that add() just took in. """
+    log_rows = user_index.log_rows + appended
+    snapshot_rows = user_index.ntotal - log_rows
+    return user_index.rebuilt or log_rows >= max(VECTOR_LOG_COMPACT_MIN_ROWS, VECTOR_LOG_COMPACT_RATIO * snapshot_rows)
+
+
+def _save(user_index: UserVectorIndex):
+    """ Writes a snapshot of the whole index and empties the log. Caller holds the exclusive file lock. """
+    os.makedirs(VECTOR_INDEX_DIR, exist_ok=True)
+    paths = _user_paths(user_index.clerk_id)
+
+    faiss = lazy_imports.load("faiss")
+
+    # Write to temp files and swap them in so readers never see a half-written index.
+    faiss.write_index(user_index.index, paths.index + ".tmp")
+    with open(paths.meta + ".tmp", "w", encoding="utf-8") as f:
+        json.dump({
+            "clerk_id": user_index.clerk_id,
+            "model": embedding_model(),
+            "transaction_ids": user_index.transaction_ids,
+            "descriptions": user_index.descriptions,
+            "index": user_index.params,
+        }, f)
+    os.replace(paths.index + ".tmp", paths.index)
+    os.replace(paths.meta + ".tmp", paths.meta)
+    if os.path.exists(paths.log):
+        os.remove(paths.log)
+    user_index.snapshot_mtime = _mtime(paths.meta)
+    user_index.log_offset = user_index.log_rows = 0
+    user_index.rebuilt = False
+
+
+# --- In-process registry ---
+# Loaded indexes live in an LRU bounded by user count and estimated bytes. An
+# evicted index is simply read again (snapshot plus log) on its next use; every
+# append is on disk before it returns, so eviction never loses rows.
+# FAISS objects are only touched from worker threads, under a per-user threading
+# lock. The per-user asyncio lock serializes the embed-then-append sequence so
+# two concurrent writes can't embed the same rows twice. Both lock maps hold
+# weak references, so a user's locks go away once nobody is waiting on them.
+
+_indexes = LRUCache(VECTOR_CACHE_MAX_USERS, weigher=lambda user_index: user_index.nbytes,
+                    maxweight=VECTOR_CACHE_MAX_BYTES)
+_locks: "weakref.WeakValueDictionary[str, threading.Lock]" = weakref.WeakValueDictionary()
+_async_locks: "weakref.WeakValueDictionary[str, asyncio.Lock]" = weakref.WeakValueDictionary()
+_registry_lock = threading.Lock()
+
+
+def _user_lock(clerk_id: str) -> threading.Lock:
+    with _registry_lock:
+        lock = _locks.get(clerk_id)
+        if lock is None:
+            lock = _locks[clerk_id] = threading.Lock()
+        return lock
+
+
+def _user_async_lock(clerk_id: str) -> asyncio.Lock:
+    lock = _async_locks.get(clerk_id)
+    if lock is None:
+        lock = _async_locks[clerk_id] = asyncio.Lock()
+    return lock
+
+
+def _get_locked(clerk_id: str, file_locked: bool = False) -> UserVectorIndex:
+    """
+    Returns the cached index, brought up to date with the files: reloaded if another
+    process wrote a new snapshot, or the log records it appended replayed on top.
+    Caller holds the user lock, and the exclusive file lock if `file_locked`.
+    """
+    cached = _indexes.get(clerk_id)
+    paths = _user_paths(clerk_id)
+    log_size = _size(paths.log)
+    if cached is not None and _mtime(paths.meta) == cached.snapshot_mtime and log_size == cached.log_offset:
+        return cached
+    with nullcontext() if file_locked else _file_lock(paths, exclusive=False):
+        if cached is None or _mtime(paths.meta) != cached.snapshot_mtime or _size(paths.log) < cached.log_offset:
+            cached = _load(clerk_id)
+        else:
+            _replay_log(cached, paths)
+    # (Re-)insert to weigh the entry at its new size.
+    _indexes.put(clerk_id, cached)
+    return cached
+
+
+def _get_sync(clerk_id: str) -> UserVectorIndex:
+    with _user_lock(clerk_id):
+        return _get_locked(clerk_id)
+
+
+def _append_sync(clerk_id: str, transaction_ids: List[str], descriptions: List[str], embeddings: np.ndarray) -> UserVectorIndex:
+    paths = _user_paths(clerk_id)
+    with _user_lock(clerk_id), _file_lock(paths, exclusive=True):
+        user_index = _get_locked(clerk_id, file_locked=True)
+        if not _replay_log(user_index, paths):
+            # A crashed append left a partial record; cut it off before writing after it.
+            with open(paths.log, "r+b") as f:
+                f.truncate(user_index.log_offset)
+            logger.warning(f"Dropped a partial vector log record for user {clerk_id}")
+        fresh = [i for i, tid in enumerate(transaction_ids) if not user_index.contains(tid)]
+        if fresh:
+            new_ids, new_descriptions = [transaction_ids[i] for i in fresh], [descriptions[i] for i in fresh]
+            user_index.add(new_ids, new_descriptions, embeddings[fresh])
+            if _needs_compaction(user_index, len(fresh)):
+                _save(user_index)
+            else:
+                _append_log(user_index, paths, new_ids, new_descriptions, embeddings[fresh])
+            _indexes.put(clerk_id, user_index)
+        return user_index
+
+
+def _search_sync(clerk_id: str, query_vector: np.ndarray, k: int) -> List[Tuple[str, str, float]]:
+    with _user_lock(clerk_id):
+        return _get_locked(clerk_id).search(query_vector, k)
+
+
+def _search_positions_sync(clerk_id: str, query_vector: np.ndarray, k: int,
+                           subset: Optional[np.ndarray]) -> Tuple[np.ndarray, np.ndarray]:
+    with _user_lock(clerk_id):
+        return _get_locked(clerk_id).search_positions(query_vector, k, subset)
+
+
+def _positions_sync(clerk_id: str, transaction_ids: List[str]) -> Tuple[int, np.ndarray]:
+    with _user_lock(clerk_id):
+        user_index = _get_locked(clerk_id)
+        return user_index.ntotal, user_index.positions_of(transaction_ids)
+
+
+async def get_user_index(clerk_id: str) -> UserVectorIndex:
+    return await asyncio.to_thread(_get_sync, clerk_id)
+
+
+async def index_transactions(clerk_id: str, transactions: List[TransactionDB]) -> UserVectorIndex:
+    """
+    Embeds and appends any of the given transactions that are not yet in the user's index.
+    Already-indexed transactions are skipped, so this is safe to call with the full history
+    to backfill users created before the persistent index existed.
+    """
+    return await index_rows(clerk_id, [t.transaction_id for t in transactions], [t.description for t in transactions])
+
+
+async def index_rows(clerk_id: str, transaction_ids: List[str], descriptions: List[str]) -> UserVectorIndex:
+    """ index_transactions for parallel id/description lists (e.g. working-set columns). """
+    async with _user_async_lock(clerk_id):
+        user_index = await get_user_index(clerk_id)
+        fresh = [i for i, tid in enumerate(transaction_ids) if not user_index.contains(tid)]
+        if not fresh:
+            return user_index
+
+        new_ids = [transaction_ids[i] for i in fresh]
+        new_descriptions = [descriptions[i] for i in fresh]
+        embeddings = await embed_texts(new_descriptions)
+        with metrics.span("vector.append"):
+            user_index = await asyncio.to_thread(_append_sync, clerk_id, new_ids, new_descriptions, embeddings)
+        logger.info(f"Indexed {len(fresh)} new transactions for user {clerk_id} (total {user_index.ntotal})")
+        return user_index
+
+
+# --- Background indexing ---
+# Writes don't wait for their rows to be embedded: index_in_background runs the
+# append as a task. A task lost to a failure or shutdown is repaired by the
+# backfill_index job a chat turn queues when the index has fewer rows than the
+# working set.
+
+_background: Set[asyncio.Task] = set()
+
+
+def index_in_background(clerk_id: str, transaction_ids: List[str], descriptions: List[str]) -> None:
+    """ Schedules index_rows on the running loop and returns immediately. """
+    task = asyncio.create_task(_index_logged(clerk_id, transaction_ids, descriptions))
+    _background.add(task)
+    task.add_done_callback(_background.discard)
+
+
+async def _index_logged(clerk_id: str, transaction_ids: List[str], descriptions: List[str]):
+    try:
+        with metrics.span("ingest.vector_index"):
+            await index_rows(clerk_id, transaction_ids, descriptions)
+    except Exception as e:
+        logger.error(f"Failed to index new transactions for {clerk_id}: {e}")
+
+
+async def drain_background(timeout: float) -> None:
+    """ Waits up to `timeout` seconds for scheduled indexing at shutdown, then cancels the rest. """
+    if not _background:
+        return
+    pending = list(_background)
+    _, still_running = await asyncio.wait(pending, timeout=timeout)
+    for task in still_running:
+        task.cancel()
+    if still_running:
+        logger.warning(f"Cancelled {len(still_running)} background indexing tasks at shutdown")
+
+
+async def search(clerk_id: str, query: str, k: int) -> List[Tuple[str, str, float]]:
+    """ Embeds only the query and searches the user's persistent index off the event loop. """
+    if (await get_user_index(clerk_id)).ntotal == 0:
+        return []
+    query_vector = await embed_texts([query])
+    with metrics.span("vector.search"):
+        return await asyncio.to_thread(_search_sync, clerk_id, query_vector, k)
+
+
+async def search_positions(clerk_id: str, query_vector: np.ndarray, k: int,
+                           subset: Optional[np.ndarray] = None) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Searches with an already-embedded query, optionally restricted to a subset of index
+    positions (see row_positions). Returns (positions, scores), best first.
+    """
+    with metrics.span("vector.search"):
+        return await asyncio.to_thread(_search_positions_sync, clerk_id, query_vector, k, subset)
+
+
+async def row_positions(clerk_id: str, transaction_ids: List[str]) -> Tuple[int, np.ndarray]:
+    """
+    The index's current size and the index position of each transaction id (-1 where
+    not indexed yet). Positions never change once assigned, so callers can keep the
+    mapping until the index grows.
+    """
+    return await asyncio.to_thread(_positions_sync, clerk_id, transaction_ids)
+
+
+def _collect_metrics() -> metrics.Collected:
+    return [
+        ("finchat_vector_indexes", "gauge", "Per-user vector indexes loaded in this process.", len(_indexes)),
+        ("finchat_vector_index_bytes", "gauge", "Estimated memory of the loaded vector indexes and their id maps.",
+         _indexes.weight),
+    ]
+
+
+metrics.register_collector(_collect_metrics)
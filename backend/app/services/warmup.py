@@ -0,0 +1,85 @@
+import asyncio
+import logging
+import time
+from typing import Optional
+
+from app.core import lazy_imports, metrics
+from app.core.config import WARMUP_ENABLED
+from app.services import categorizer, csv_parser, embeddings, openai_client, prompt_builder
+
+logger = logging.getLogger(__name__)
+
+# =============================================================================
+# BACKGROUND WARMUP
+# =============================================================================
+# Heavy libraries (pandas, FAISS, the OpenAI SDK, LangChain) are imported where
+# they are first used, so importing app.main stays fast and a new pod starts
+# accepting requests quickly. Once the server is up, warm_up() loads them in the
+# background (imports in a thread, through app.core.lazy_imports like every lazy
+# import, so they never race the request path's), creates the OpenAI client,
+# starts the CSV parse pool's processes, readies the embedding backend, builds
+# the local categorizer's seed matcher and loads the prompt tokenizer, so the
+# first uploads and chats after a scale-up do not pay those costs either.
+
+HEAVY_MODULES = ("pandas", "faiss", "openai", "langchain_openai", "langchain_core.prompts")
+
+_task: Optional[asyncio.Task] = None
+_state = {"state": "pending" if WARMUP_ENABLED else "disabled", "seconds": None}
+
+
+async def warm_up() -> None:
+    _state["state"] = "running"
+    started = time.perf_counter()
+    with metrics.span("startup.warmup"):
+        for name in HEAVY_MODULES:
+            try:
+                await asyncio.to_thread(lazy_imports.load, name)
+            except Exception as e:
+                logger.warning(f"Warmup could not import {name}: {e}")
+        steps = (("openai client", _warm_openai_client), ("csv parse pool", csv_parser.warm_parse_pool),
+                 ("embedding backend", _warm_embedding_backend), ("categorizer", _warm_categorizer),
+                 ("tokenizer", _warm_tokenizer))
+        for label, step in steps:
+            try:
+                await step()
+            except Exception as e:
+                logger.warning(f"Warmup step '{label}' failed: {e}")
+    _state.update(state="done", seconds=round(time.perf_counter() - started, 3))
+    logger.info(f"Warmup finished in {_state['seconds']:.2f}s")
+
+
+async def _warm_openai_client() -> None:
+    openai_client.get_client()
+
+
+async def _warm_categorizer() -> None:
+    # Users' learned merchants are warmed per user on their first upload (categorizer.ensure_warm).
+    await asyncio.to_thread(categorizer.category_index.warm)
+
+
+async def _warm_embedding_backend() -> None:
+    await embeddings.get_backend().warm()
+
+
+async def _warm_tokenizer() -> None:
+    await asyncio.to_thread(prompt_builder.load_tokenizer)
+
+
+def status() -> dict:
+    """ Warmup progress for /health: state (pending/running/done/disabled) and duration once done. """
+    return dict(_state)
+
+
+def start_warmup() -> None:
+    """ Schedules warm_up() to run alongside request handling (app startup). """
+    global _task
+    if _task is None:
+        _task = asyncio.create_task(warm_up())
+
+
+async def stop_warmup() -> None:
+    global _task
+    if _task is not None:
+        _task.cancel()
+        await asyncio.gather(_task, return_exceptions=True)
+        _task = None
@@ -0,0 +1,238 @@
+import asyncio
+import logging
+import sys
+import weakref
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+
+from app.core import lazy_imports, metrics
+from app.core.cache import LRUCache
+from app.core.config import WORKING_SET_MAX_BYTES, WORKING_SET_MAX_USERS
+from app.core.database import get_db
+from app.core.models import PolicyDB, TransactionCategory, UserAggregates
+from app.services import migrations
+
+logger = logging.getLogger(__name__)
+
+# =============================================================================
+# HOT PER-USER WORKING SET
+# =============================================================================
+# Active users' financial data, cached in-process in a compact columnar form:
+# one NumPy array per field (timestamps, amounts, category codes, description
+# codes) plus interned distinct description strings, instead of a list of
+# pydantic TransactionDB objects. Chat retrieval, policy recomputes and
+# aggregates run vectorized over these arrays.
+#
+# The cache is LRU and bounded both by user count and by total bytes. An entry
+# is reused only while the user's data_version (bumped on every write) is
+# unchanged, so writes on other workers are picked up; user_service also
+# invalidates the local entry on write.
+
+CATEGORY_VALUES: List[str] = [c.value for c in TransactionCategory]
+# Code for transactions without a category.
+UNCATEGORIZED_CODE = len(CATEGORY_VALUES)
+_CATEGORY_CODES = {value: code for code, value in enumerate(CATEGORY_VALUES)}
+
+_TRANSACTION_PROJECTION = {"_id": 0, "transaction_id": 1, "date": 1, "description": 1, "amount": 1, "category": 1, "account": 1}
+_USER_PROJECTION = {"_id": 0, "goals": 1, "policies": 1, "data_version": 1, "transactions": {"$slice": 1}}
+
+
+def category_code(category: Optional[str]) -> int:
+    return _CATEGORY_CODES.get(category, UNCATEGORIZED_CODE) if category else UNCATEGORIZED_CODE
+
+
+class TransactionColumns:
+    """ One user's transactions, sorted by date, as parallel arrays. Row i of every array is the same transaction. """
+
+    def __init__(self, transaction_ids: np.ndarray, timestamps: np.ndarray, amounts: np.ndarray,
+                 category_codes: np.ndarray, description_codes: np.ndarray, descriptions: List[str],
+                 account_codes: np.ndarray, accounts: List[Optional[str]]):
+        self.transaction_ids = transaction_ids  # fixed-width ASCII bytes (S*), not Python strs
+        self.timestamps = timestamps  # datetime64[s]
+        self.amounts = amounts  # float64, signed: negative is spending
+        self.category_codes = category_codes  # int8 into CATEGORY_VALUES, UNCATEGORIZED_CODE for none
+        self.description_codes = description_codes  # int32 into `descriptions`
+        self.descriptions = descriptions  # distinct, interned
+        self.account_codes = account_codes  # int16 into `accounts`
+        self.accounts = accounts
+        self.days = timestamps.astype("datetime64[D]").astype(np.int32)  # days since the epoch
+
+    @classmethod
+    def from_documents(cls, documents: List[dict]) -> "TransactionColumns":
+        """ Builds the columns straight from Mongo documents, without pydantic. """
+        # pandas converts datetime objects ~8x faster than NumPy; imported here, not at app startup.
+        pd = lazy_imports.load("pandas")
+
+        n = len(documents)
+        descriptions: Dict[str, int] = {}
+        accounts: Dict[Optional[str], int] = {None: 0}
+        transaction_ids = [None] * n
+        dates = [None] * n
+        amounts = np.empty(n, dtype=np.float64)
+        category_codes = np.empty(n, dtype=np.int8)
+        description_codes = np.empty(n, dtype=np.int32)
+        account_codes = np.empty(n, dtype=np.int16)
+        for i, doc in enumerate(documents):
+            transaction_ids[i] = doc["transaction_id"]
+            dates[i] = doc["date"]
+            amounts[i] = doc["amount"]
+            category_codes[i] = category_code(doc.get("category"))
+            description_codes[i] = descriptions.setdefault(doc["description"], len(descriptions))
+            account_codes[i] = accounts.setdefault(doc.get("account"), len(accounts))
+        timestamps = pd.to_datetime(dates).to_numpy("datetime64[s]") if n else np.empty(0, dtype="datetime64[s]")
+        return cls(
+            np.array(transaction_ids, dtype=np.bytes_) if n else np.empty(0, dtype="S1"), timestamps, amounts, category_codes, description_codes,
+            [sys.intern(d) for d in descriptions], account_codes, list(accounts),
+        )
+
+    @property
+    def size(self) -> int:
+        return self.amounts.size
+
+    @property
+    def nbytes(self) -> int:
+        arrays = (self.transaction_ids, self.timestamps, self.amounts, self.category_codes,
+                  self.description_codes, self.account_codes, self.days)
+        return sum(a.nbytes for a in arrays) + sum(sys.getsizeof(d) for d in self.descriptions)
+
+    def transaction_id(self, row: int) -> str:
+        return self.transaction_ids[row].decode("ascii")
+
+    def transaction_id_list(self, rows: Optional[np.ndarray] = None) -> List[str]:
+        ids = self.transaction_ids if rows is None else self.transaction_ids[rows]
+        return np.char.decode(ids, "ascii").tolist()
+
+    def description(self, row: int) -> str:
+        return self.descriptions[self.description_codes[row]]
+
+    def category(self, row: int) -> Optional[str]:
+        code = self.category_codes[row]
+        return None if code == UNCATEGORIZED_CODE else CATEGORY_VALUES[code]
+
+    def timestamp(self, row: int) -> datetime:
+        return self.timestamps[row].astype(datetime)
+
+    def description_list(self, rows: Optional[np.ndarray] = None) -> List[str]:
+        codes = self.description_codes if rows is None else self.description_codes[rows]
+        return [self.descriptions[c] for c in codes]
+
+    def totals(self, rows: Optional[np.ndarray] = None) -> Tuple[int, float, float]:
+        """ (count, income, spending) over the given rows, or all rows. """
+        amounts = self.amounts if rows is None else self.amounts[rows]
+        return int(amounts.size), float(amounts[amounts > 0].sum()), float(-amounts[amounts < 0].sum())
+
+
+class UserWorkingSet:
+    def __init__(self, clerk_id: str, data_version: int, goals: List[dict], policies: List[dict],
+                 columns: TransactionColumns):
+        self.clerk_id = clerk_id
+        self.data_version = data_version
+        self.goals = goals
+        self.policies = policies
+        self.columns = columns
+        # Derived structures built on first use by their consumers (e.g. the retrieval index).
+        self.derived: Dict[str, Any] = {}
+        self.derived_sizes: Dict[str, int] = {}
+
+    @property
+    def nbytes(self) -> int:
+        return self.columns.nbytes + sum(self.derived_sizes.values())
+
+    def policy_models(self) -> List[PolicyDB]:
+        return [PolicyDB(**p) for p in self.policies]
+
+    def aggregates(self) -> UserAggregates:
+        count, income, spending = self.columns.totals()
+        return UserAggregates(transaction_count=count, total_income=income, total_spending=spending)
+
+
+_working_sets = LRUCache(WORKING_SET_MAX_USERS, weigher=lambda ws: ws.nbytes, maxweight=WORKING_SET_MAX_BYTES)
+# Held weakly: a user's lock goes away once no request is loading or waiting for them.
+_load_locks: "weakref.WeakValueDictionary[str, asyncio.Lock]" = weakref.WeakValueDictionary()
+_stats = {"hits": 0, "misses": 0}
+
+
+async def get_working_set(clerk_id: str, load: bool = True) -> Optional[UserWorkingSet]:
+    """
+    Returns the user's working set, loading it from Mongo on a miss.
+    With load=False only an up-to-date cached entry is returned (None otherwise).
+    Always costs one small read of the user document, for goals, policies and data_version.
+    """
+    db = await get_db()
+    users_collection = db.get_collection("users")
+    user_data = await users_collection.find_one({"clerk_id": clerk_id}, _USER_PROJECTION)
+    if not user_data:
+        return None
+    if user_data.get("transactions"):
+        await migrations.migrate_user_transactions(clerk_id)
+        invalidate(clerk_id)
+
+    data_version = user_data.get("data_version", 0)
+    cached = _working_sets.get(clerk_id)
+    if cached is None or cached.data_version != data_version:
+        if not load:
+            return None
+        # One load per user at a time; concurrent requests wait for it.
+        load_lock = _load_locks.get(clerk_id)
+        if load_lock is None:
+            load_lock = _load_locks[clerk_id] = asyncio.Lock()
+        async with load_lock:
+            cached = _working_sets.get(clerk_id)
+            if cached is None or cached.data_version != data_version:
+                _stats["misses"] += 1
+                with metrics.span("working_set.load"):
+                    cached = await _load(clerk_id, data_version, user_data)
+                _working_sets.put(clerk_id, cached)
+                return cached
+    _stats["hits"] += 1
+    # Policy counters move without a data_version bump (window rollover), so take them fresh.
+    cached.goals = user_data.get("goals", [])
+    cached.policies = user_data.get("policies", [])
+    return cached
+
+
+async def _load(clerk_id: str, data_version: int, user_data: dict) -> UserWorkingSet:
+    db = await get_db()
+    transactions_collection = db.get_collection("transactions")
+    cursor = transactions_collection.find({"clerk_id": clerk_id}, _TRANSACTION_PROJECTION).sort("date", 1)
+    documents = await cursor.to_list(length=None)
+    columns = await asyncio.to_thread(TransactionColumns.from_documents, documents)
+    logger.info(f"Loaded working set for {clerk_id}: {columns.size} transactions in {columns.nbytes / 1024:.0f} KiB")
+    return UserWorkingSet(clerk_id, data_version, user_data.get("goals", []), user_data.get("policies", []), columns)
+
+
+def attach(working_set: UserWorkingSet, key: str, value: Any, nbytes: int) -> None:
+    """ Stores (or replaces) a derived structure on a working set and re-weighs the cache entry. """
+    working_set.derived[key] = value
+    working_set.derived_sizes[key] = nbytes
+    if _working_sets.get(working_set.clerk_id) is working_set:
+        _working_sets.put(working_set.clerk_id, working_set)
+
+
+def invalidate(clerk_id: str) -> None:
+    """ Write-through invalidation: drops the user's cached working set. """
+    _working_sets.pop(clerk_id)
+
+
+def stats() -> dict:
+    lookups = _stats["hits"] + _stats["misses"]
+    return {
+        **_stats,
+        "hit_rate": _stats["hits"] / lookups if lookups else 0.0,
+        "users": len(_working_sets),
+        "bytes": _working_sets.weight,
+    }
+
+
+def _collect_metrics() -> metrics.Collected:
+    return [
+        ("finchat_working_set_hits_total", "counter", "Working set lookups served from memory.", _stats["hits"]),
+        ("finchat_working_set_misses_total", "counter", "Working set lookups that loaded from Mongo.", _stats["misses"]),
+        ("finchat_working_set_users", "gauge", "Users with a cached working set.", len(_working_sets)),
+        ("finchat_working_set_bytes", "gauge", "Bytes held by cached working sets.", _working_sets.weight),
+    ]
+
+
+metrics.register_collector(_collect_metrics)
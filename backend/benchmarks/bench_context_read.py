@@ -0,0 +1,106 @@
+"""
+Micro-benchmark: per-row cost of building the /user/context response.
+
+  before  - the old path: UserDocumentDB -> model_dump -> FinancialContext, then
+            FastAPI's response_model re-validation, jsonable_encoder and json.dumps.
+  single  - FinancialContext validated once from the raw documents (chat path).
+  after   - raw projected documents serialized straight to bytes with orjson
+            (user_service.get_user_financial_context_json).
+
+No database is needed; rows are shaped like the documents Motor returns.
+
+    cd backend && python -m benchmarks.bench_context_read --rows 1000 10000
+"""
+import argparse
+import json
+import random
+import time
+import uuid
+from datetime import datetime, timedelta
+
+import orjson
+from fastapi.encoders import jsonable_encoder
+
+from app.core.models import FinancialContext, TransactionCategory, UserDocumentDB
+
+CATEGORIES = [c.value for c in TransactionCategory]
+
+
+def make_documents(rows: int):
+    random.seed(rows)
+    start = datetime(2023, 1, 1)
+    transactions = [
+        {
+            "transaction_id": str(uuid.uuid4()),
+            "date": start + timedelta(minutes=37 * i),
+            "description": f"MERCHANT {random.randint(1, 500)} #{random.randint(1000, 9999)}",
+            "amount": round(random.uniform(-250, 250), 2),
+            "category": random.choice(CATEGORIES),
+            "merchant": None,
+            "account": "checking",
+        }
+        for i in range(rows)
+    ]
+    user = {
+        "email": "bench@example.com",
+        "clerk_id": "bench",
+        "goals": [{"name": "Emergency fund", "target_amount": 5000.0, "current_amount": 1200.0}],
+        "policies": [{
+            "policy_id": str(uuid.uuid4()), "description": "Food budget", "limit_amount": 400.0,
+            "target_category": "Food & Drink", "timeframe": "monthly", "current_spending": 120.0,
+            "window_start": datetime(2025, 1, 1),
+        }],
+        "accounts": [{"account_name": "checking"}],
+    }
+    return user, transactions
+
+
+def before(user, transactions) -> bytes:
+    user_db_model = UserDocumentDB(**user)
+    context = FinancialContext.model_validate({**user_db_model.model_dump(), "transactions": transactions})
+    # What FastAPI does with response_model=FinancialContext and the default JSONResponse.
+    validated = FinancialContext.model_validate(context.model_dump())
+    return json.dumps(jsonable_encoder(validated), ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+
+def single(user, transactions) -> FinancialContext:
+    return FinancialContext.model_validate(
+        {"goals": user["goals"], "policies": user["policies"], "transactions": transactions}
+    )
+
+
+def after(user, transactions) -> bytes:
+    return orjson.dumps({"goals": user["goals"], "policies": user["policies"], "transactions": transactions})
+
+
+def measure(fn, user, transactions, repeat: int) -> float:
+    """ Best-of-`repeat` wall time in seconds. """
+    best = float("inf")
+    for _ in range(repeat):
+        started = time.perf_counter()
+        fn(user, transactions)
+        best = min(best, time.perf_counter() - started)
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, nargs="+", default=[1000, 10000])
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    results = []
+    for rows in args.rows:
+        user, transactions = make_documents(rows)
+        timings = {name: measure(fn, user, transactions, args.repeat)
+                   for name, fn in (("before", before), ("single", single), ("after", after))}
+        results.append({
+            "rows": rows,
+            **{f"{name}_us_per_row": round(seconds / rows * 1e6, 3) for name, seconds in timings.items()},
+            "speedup": round(timings["before"] / timings["after"], 1),
+        })
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
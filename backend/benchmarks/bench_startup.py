@@ -0,0 +1,177 @@
+"""
+Cold-start benchmark: how fast a fresh API process becomes useful.
+
+Every measurement runs in a new Python process, so nothing is cached in memory:
+
+  import  - wall time of `import app.main`, and which heavy libraries it pulled in.
+  ready   - process spawn until the served app answers GET /health with 200.
+  warm    - process spawn until /health reports the background warmup as done
+            (heavy libraries imported, OpenAI client, CSV parse pool, categorizer).
+
+Mongo is the in-memory fake by default (or a local mongod, see bench_suite), so
+the numbers are about our own startup path, not the network. Heavy libraries
+must not be imported by `import app.main`; the run exits with status 1 if one is,
+or if the median import time exceeds --max-import-seconds.
+
+    cd backend && python -m benchmarks.bench_startup --repeat 5 --output startup.json
+    python -m benchmarks.bench_startup --baseline startup.json --max-import-seconds 1.5
+"""
+import argparse
+import asyncio
+import json
+import os
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.request
+from typing import Dict, List, Optional
+
+from benchmarks.bench_suite import _free_port, _git_commit
+
+# Loaded lazily by the app; finding one of these after `import app.main` is a regression.
+HEAVY_MODULES = ("pandas", "faiss", "openai", "httpx", "langchain_openai", "langchain_core", "sklearn", "scipy", "tiktoken")
+
+_IMPORT_PROBE = f"""
+import json, sys, time
+started = time.perf_counter()
+import app.main
+seconds = time.perf_counter() - started
+print(json.dumps({{"seconds": seconds, "heavy": [m for m in {HEAVY_MODULES!r} if m in sys.modules]}}))
+"""
+
+
+def _measure_import(env: Dict[str, str]) -> dict:
+    completed = subprocess.run([sys.executable, "-c", _IMPORT_PROBE], env=env, stdout=subprocess.PIPE, text=True, check=True)
+    return json.loads(completed.stdout.strip().splitlines()[-1])
+
+
+def _get_json(url: str) -> Optional[dict]:
+    try:
+        with urllib.request.urlopen(url, timeout=1) as response:
+            return json.loads(response.read())
+    except Exception:
+        return None
+
+
+def _measure_serve(env: Dict[str, str], mongo: str, database: str, timeout: float) -> dict:
+    """ Spawns a serving process and polls /health until it is ready and then warmed up. """
+    port = _free_port()
+    started = time.perf_counter()
+    process = subprocess.Popen(
+        [sys.executable, "-m", "benchmarks.bench_startup", "--serve", str(port), "--mongo", mongo, "--database", database],
+        env=env,
+    )
+    ready = warm = None
+    try:
+        while time.perf_counter() - started < timeout and process.poll() is None:
+            health = _get_json(f"http://127.0.0.1:{port}/health")
+            if health is not None:
+                now = time.perf_counter() - started
+                ready = ready if ready is not None else now
+                if health.get("warmup", {}).get("state") in ("done", "disabled"):
+                    warm = now
+                    break
+            time.sleep(0.01)
+    finally:
+        process.terminate()
+        process.wait()
+    return {"ready_seconds": ready, "warm_seconds": warm}
+
+
+def serve(port: int, mongo: str, database: str) -> None:
+    """ Child process: the app behind uvicorn, as in production but with the benchmark database. """
+    import uvicorn
+
+    from benchmarks.bench_suite import _connect_database
+
+    async def run():
+        await _connect_database(mongo, database)
+        from app.main import app
+
+        await uvicorn.Server(uvicorn.Config(app, host="127.0.0.1", port=port, log_level="warning")).serve()
+
+    asyncio.run(run())
+
+
+def _summary(values: List[float]) -> dict:
+    values = sorted(v for v in values if v is not None)
+    if not values:
+        return {"median": None, "max": None}
+    return {"median": round(statistics.median(values), 3), "max": round(values[-1], 3)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--serve", type=int, help=argparse.SUPPRESS)
+    parser.add_argument("--mongo", default="memory", help='"memory" or a mongodb:// URI of a local mongod')
+    parser.add_argument("--database", default="finchat_bench", help="Database used (and dropped) on a real mongod")
+    parser.add_argument("--repeat", type=int, default=5, help="Fresh processes per measurement")
+    parser.add_argument("--timeout", type=float, default=120.0, help="Seconds to wait for a server to become warm")
+    parser.add_argument("--max-import-seconds", type=float, help="Fail if the median `import app.main` is slower")
+    parser.add_argument("--output", help="Write the JSON results here instead of stdout")
+    parser.add_argument("--baseline", help="Earlier result file to compare against")
+    args = parser.parse_args()
+
+    if args.serve:
+        serve(args.serve, args.mongo, args.database)
+        return
+    if args.mongo != "memory" and args.database == "finchat":
+        raise SystemExit("Refusing to benchmark against (and drop) the application database 'finchat'")
+
+    workdir = tempfile.mkdtemp(prefix="finchat-startup-")
+    env = {
+        **os.environ,
+        "MONGO": args.mongo if args.mongo != "memory" else "mongodb://in-memory",
+        # Nothing is sent to OpenAI during startup; the client only needs to be constructible.
+        "OPENAI_BASE_URL": "http://127.0.0.1:9/v1",
+        "OPENAI_API_KEY": "bench",
+        "LLM": "bench",
+        "VECTOR_INDEX_DIR": os.path.join(workdir, "vector_indexes"),
+        "EMBEDDING_CACHE_DIR": os.path.join(workdir, "embedding_cache"),
+        "IMPORT_JOB_DIR": os.path.join(workdir, "import_jobs"),
+    }
+    try:
+        imports = [_measure_import(env) for _ in range(args.repeat)]
+        serves = [_measure_serve(env, args.mongo, args.database, args.timeout) for _ in range(args.repeat)]
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    results = {
+        "import_seconds": _summary([r["seconds"] for r in imports]),
+        "heavy_modules_at_import": sorted({m for r in imports for m in r["heavy"]}),
+        "ready_seconds": _summary([r["ready_seconds"] for r in serves]),
+        "warm_seconds": _summary([r["warm_seconds"] for r in serves]),
+    }
+    if args.baseline:
+        with open(args.baseline) as f:
+            before = json.load(f)["results"]
+        results["vs_baseline"] = {
+            key: round(results[key]["median"] / before[key]["median"], 3)
+            for key in ("import_seconds", "ready_seconds", "warm_seconds")
+            if results[key]["median"] and before.get(key, {}).get("median")
+        }
+    report = {"meta": {"commit": _git_commit(), "repeat": args.repeat, "cpus": os.cpu_count(),
+                       "mongo": "memory" if args.mongo == "memory" else "mongod"},
+              "results": results}
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output + "\n")
+    else:
+        print(output)
+
+    failures = []
+    if results["heavy_modules_at_import"]:
+        failures.append(f"heavy modules imported by app.main: {', '.join(results['heavy_modules_at_import'])}")
+    if args.max_import_seconds and results["import_seconds"]["median"] > args.max_import_seconds:
+        failures.append(f"median import {results['import_seconds']['median']}s > {args.max_import_seconds}s")
+    if failures:
+        print("startup regression: " + "; ".join(failures), file=sys.stderr)
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,557 @@
+"""
+End-to-end performance benchmark suite.
+
+Serves the real FastAPI app with uvicorn on a local port and drives it over HTTP
+against local stand-ins, so it runs without network access or credentials:
+
+  Mongo   - "memory" (default): an in-memory Motor-compatible fake (mongomock-motor),
+            or a mongodb:// URI of a local mongod. The suite only ever touches
+            the --database it is given and drops it before and after each workload.
+  OpenAI  - benchmarks.fake_openai, started as a subprocess, with configurable
+            latency and deterministic embeddings/completions. With
+            --embedding-backend local, embeddings never reach it.
+
+Workloads (each runs in its own subprocess, so peak RSS is per workload):
+
+  upload   - POST /user/upload of a generated bank CSV, one fresh user per repeat,
+             timed until the background import job finishes.
+  context  - GET /user/context for a user with a large seeded history, concurrently.
+  chat     - concurrent chat sessions (POST /chat/message or /chat/stream), each a
+             sequence of turns over a seeded history.
+
+Results are JSON: per workload the request count, errors, throughput,
+p50/p95/p99/mean/max latency in ms and peak RSS in MiB. Pass --baseline with an
+earlier result file to add before/after ratios.
+
+    cd backend && pip install mongomock-motor
+    python -m benchmarks.bench_suite --output bench.json
+    python -m benchmarks.bench_suite --upload-rows 1000 10000 100000 --context-rows 100000 \\
+        --mongo mongodb://localhost:27017 --baseline bench.json
+
+The in-memory fake has no query planner and no indexes, so absolute Mongo
+costs differ from a real server; compare runs against the same backend.
+"""
+import argparse
+import asyncio
+import io
+import json
+import os
+import platform
+import random
+import resource
+import shutil
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional
+
+from benchmarks import fake_openai
+
+# (description template, category, typical amount). "{n}" becomes a store/reference number.
+MERCHANTS = [
+    ("STARBUCKS STORE #{n}", "Food & Drink", -6.5),
+    ("UBER TRIP {n} HELP.UBER.COM", "Transport", -18.0),
+    ("WHOLE FOODS MKT {n}", "Groceries", -64.0),
+    ("TRADER JOE S #{n}", "Groceries", -48.0),
+    ("AMAZON MKTPLACE PMTS {n}", "Shopping", -35.0),
+    ("NETFLIX.COM {n}", "Entertainment", -15.49),
+    ("SHELL OIL {n}", "Gas", -42.0),
+    ("CHIPOTLE {n}", "Food & Drink", -12.75),
+    ("CVS PHARMACY {n}", "Health", -22.0),
+    ("COMCAST CABLE {n}", "Utilities", -89.99),
+    ("RENT PAYMENT {n}", "Housing", -1850.0),
+    ("DELTA AIR {n}", "Other", -320.0),
+    ("PAYROLL DEPOSIT ACME CORP {n}", "Income", 2450.0),
+    ("VENMO CASHOUT {n}", "Transfers", 60.0),
+    ("LOCAL CAFE {n}", None, -9.0),
+    ("CORNER HARDWARE {n}", None, -27.0),
+]
+CHAT_QUERIES = [
+    "How much did I spend on groceries last month?",
+    "What were my biggest expenses this year?",
+    "Show my coffee spending in the last 30 days",
+    "How much went to transportation in March?",
+    "Did I spend more than $100 on any restaurant?",
+    "What subscriptions am I paying for?",
+    "How much income did I receive last quarter?",
+    "Summarize my spending on shopping since January",
+]
+
+
+# =============================================================================
+# DATA GENERATION (deterministic)
+# =============================================================================
+
+def _rows(rows: int, seed: int):
+    rng = random.Random(seed)
+    start = datetime(2024, 1, 1)
+    for i in range(rows):
+        template, category, amount = MERCHANTS[rng.randrange(len(MERCHANTS))]
+        yield (
+            start + timedelta(minutes=rng.randrange(0, 60 * 24 * 540)),
+            template.format(n=rng.randrange(100, 400)),
+            round(amount * rng.uniform(0.6, 1.4), 2),
+            category,
+        )
+
+
+def make_csv(rows: int, seed: int, categorized_share: float = 0.7) -> bytes:
+    """ A bank export; roughly `categorized_share` of rows already carry a category. """
+    rng = random.Random(seed + 1)
+    out = io.StringIO()
+    out.write("Date,Description,Amount,Category\n")
+    for when, description, amount, category in _rows(rows, seed):
+        keep = category is not None and rng.random() < categorized_share
+        out.write(f"{when:%Y-%m-%d},{description},{amount:.2f},{category if keep else ''}\n")
+    return out.getvalue().encode("utf-8")
+
+
+def make_transaction_documents(clerk_id: str, rows: int, seed: int) -> List[dict]:
+    """ Transaction documents shaped like the ones user_service writes. """
+    from app.core.models import TransactionDB
+
+    return [
+        {"clerk_id": clerk_id, **TransactionDB(date=when, description=description, amount=amount,
+                                                category=category, account="checking").model_dump()}
+        for when, description, amount, category in _rows(rows, seed)
+    ]
+
+
+# =============================================================================
+# MEASUREMENT
+# =============================================================================
+
+def _percentile(sorted_values: List[float], q: float) -> float:
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, max(0, round(q / 100 * len(sorted_values) + 0.5) - 1))
+    return sorted_values[index]
+
+
+def summarize(latencies: List[float], duration: float, errors: int, **extra) -> dict:
+    values = sorted(latency * 1000 for latency in latencies)
+    return {
+        "requests": len(latencies) + errors,
+        "errors": errors,
+        "duration_s": round(duration, 3),
+        "throughput_rps": round(len(latencies) / duration, 2) if duration else 0.0,
+        "latency_ms": {
+            "p50": round(_percentile(values, 50), 2),
+            "p95": round(_percentile(values, 95), 2),
+            "p99": round(_percentile(values, 99), 2),
+            "mean": round(statistics.fmean(values), 2) if values else 0.0,
+            "max": round(values[-1], 2) if values else 0.0,
+        },
+        **extra,
+    }
+
+
+def peak_rss_mib() -> float:
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is KiB on Linux, bytes on macOS.
+    return round(peak / (1024 * 1024 if sys.platform == "darwin" else 1024), 1)
+
+
+# =============================================================================
+# WORKLOADS (run inside the child process)
+# =============================================================================
+
+async def _login(client, clerk_id: str) -> None:
+    response = await client.post("/api/v1/login/login", json={"email": f"{clerk_id}@bench.local", "clerk_id": clerk_id})
+    response.raise_for_status()
+
+
+async def _seed_user(clerk_id: str, rows: int, seed: int) -> None:
+    from app.core.database import get_db
+
+    db = await get_db()
+    await db.get_collection("users").insert_one({
+        "clerk_id": clerk_id, "email": f"{clerk_id}@bench.local", "accounts": [{"account_name": "checking"}],
+        "goals": [{"name": "Emergency fund", "target_amount": 5000.0, "current_amount": 1200.0}],
+        "policies": [], "data_version": 1,
+    })
+    documents = make_transaction_documents(clerk_id, rows, seed)
+    for start in range(0, len(documents), 10000):
+        await db.get_collection("transactions").insert_many(documents[start:start + 10000])
+
+
+async def _wait_for_job(client, job_id: str, poll_seconds: float = 0.05) -> dict:
+    while True:
+        response = await client.get(f"/api/v1/jobs/{job_id}")
+        response.raise_for_status()
+        job = response.json()
+        if job["status"] in ("succeeded", "failed"):
+            return job
+        await asyncio.sleep(poll_seconds)
+
+
+async def workload_upload(client, spec: dict) -> dict:
+    rows, repeat = spec["rows"], spec["repeat"]
+    # Warm-up upload (not measured): first-use costs such as the category index warm-up.
+    await _login(client, "bench-warmup")
+    response = await client.post("/api/v1/user/upload", data={"clerk_id": "bench-warmup"},
+                                 files={"file": ("warmup.csv", make_csv(100, seed=999), "text/csv")})
+    if response.status_code == 202:
+        await _wait_for_job(client, response.json()["job_id"])
+
+    latencies, accept_latencies, errors, imported = [], [], 0, 0
+    started = time.perf_counter()
+    for i in range(repeat):
+        clerk_id = f"bench-upload-{i}"
+        await _login(client, clerk_id)
+        content = make_csv(rows, seed=i)
+        t0 = time.perf_counter()
+        response = await client.post("/api/v1/user/upload", data={"clerk_id": clerk_id},
+                                     files={"file": (f"{clerk_id}.csv", content, "text/csv")})
+        if response.status_code != 202:
+            errors += 1
+            continue
+        accept_latencies.append(time.perf_counter() - t0)
+        job = await _wait_for_job(client, response.json()["job_id"])
+        if job["status"] != "succeeded":
+            errors += 1
+            continue
+        latencies.append(time.perf_counter() - t0)
+        imported += job["progress"]["rows_imported"]
+    duration = time.perf_counter() - started
+    upload_seconds = sum(latencies)
+    accept_ms = sorted(value * 1000 for value in accept_latencies)
+    return summarize(latencies, duration, errors, rows_imported=imported,
+                     rows_per_second=round(imported / upload_seconds, 1) if upload_seconds else 0.0,
+                     accept_ms_p50=round(_percentile(accept_ms, 50), 2))
+
+
+async def workload_context(client, spec: dict) -> dict:
+    rows, requests, concurrency = spec["rows"], spec["requests"], spec["concurrency"]
+    clerk_id = "bench-context"
+    await _seed_user(clerk_id, rows, seed=1)
+    await client.get("/api/v1/user/context", params={"clerk_id": clerk_id})  # warm-up
+
+    latencies, errors, response_bytes = [], 0, 0
+    queue = iter(range(requests))
+
+    async def reader():
+        nonlocal errors, response_bytes
+        for _ in queue:
+            t0 = time.perf_counter()
+            response = await client.get("/api/v1/user/context", params={"clerk_id": clerk_id})
+            if response.status_code != 200:
+                errors += 1
+                continue
+            latencies.append(time.perf_counter() - t0)
+            response_bytes = len(response.content)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(reader() for _ in range(concurrency)))
+    return summarize(latencies, time.perf_counter() - started, errors, response_bytes=response_bytes)
+
+
+async def workload_chat(client, spec: dict) -> dict:
+    sessions, turns, rows, endpoint = spec["sessions"], spec["turns"], spec["rows"], spec["endpoint"]
+    clerk_ids = [f"bench-chat-{i}" for i in range(sessions)]
+    for i, clerk_id in enumerate(clerk_ids):
+        await _seed_user(clerk_id, rows, seed=100 + i)
+
+    async def send(clerk_id: str, message: str) -> Optional[float]:
+        """ Returns time to first token for streams, else None. Raises on failure. """
+        payload = {"clerk_id": clerk_id, "message": message}
+        if endpoint == "message":
+            response = await client.post("/api/v1/chat/message", json=payload)
+            response.raise_for_status()
+            return None
+        t0, first_token = time.perf_counter(), None
+        async with client.stream("POST", "/api/v1/chat/stream", json=payload) as response:
+            response.raise_for_status()
+            async for line in response.aiter_lines():
+                if first_token is None and line == "event: token":
+                    first_token = time.perf_counter() - t0
+                elif line == "event: error":
+                    raise RuntimeError("chat stream reported an error")
+        return first_token
+
+    # Warm-up turn per session (not measured): builds the working set and backfills the vector index.
+    await asyncio.gather(*(send(clerk_id, "hello") for clerk_id in clerk_ids))
+
+    latencies, first_tokens, errors = [], [], 0
+
+    async def session(index: int, clerk_id: str):
+        nonlocal errors
+        for turn in range(turns):
+            t0 = time.perf_counter()
+            try:
+                first_token = await send(clerk_id, CHAT_QUERIES[(index + turn) % len(CHAT_QUERIES)])
+            except Exception:
+                errors += 1
+                continue
+            latencies.append(time.perf_counter() - t0)
+            if first_token is not None:
+                first_tokens.append(first_token)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(session(i, clerk_id) for i, clerk_id in enumerate(clerk_ids)))
+    duration = time.perf_counter() - started
+    extra = {"answer_cache": (await client.get("/api/v1/chat/cache/stats")).json()}
+    if first_tokens:
+        extra["time_to_first_token_ms"] = summarize(first_tokens, duration, 0)["latency_ms"]
+    return summarize(latencies, duration, errors, **extra)
+
+
+WORKLOADS = {"upload": workload_upload, "context": workload_context, "chat": workload_chat}
+
+
+def _patch_mongomock_bulk_sort() -> None:
+    """
+    pymongo >= 4.9 passes `sort=` to bulk update and replace operations, which
+    mongomock's bulk builder does not accept yet. Without this, rollup writes fail
+    in-memory and the upload workload would silently skip that work.
+    """
+    from mongomock.collection import BulkOperationBuilder
+
+    for name in ("add_update", "add_replace"):
+        method = getattr(BulkOperationBuilder, name)
+        if "sort" in method.__code__.co_varnames:
+            continue
+
+        def ignoring_sort(self, *args, sort=None, _method=method, **kwargs):
+            return _method(self, *args, **kwargs)
+
+        setattr(BulkOperationBuilder, name, ignoring_sort)
+
+
+async def _connect_database(mongo: str, database_name: str):
+    """ Points the app's shared Database at the benchmark backend, before the app starts. """
+    from app.core.database import client_options, db
+
+    if mongo == "memory":
+        try:
+            from mongomock_motor import AsyncMongoMockClient
+        except ImportError:
+            raise SystemExit("--mongo memory needs mongomock-motor: pip install mongomock-motor")
+        _patch_mongomock_bulk_sort()
+        db.client = AsyncMongoMockClient()
+        db.db = db.client[database_name]
+    else:
+        import motor.motor_asyncio
+
+        db.client = motor.motor_asyncio.AsyncIOMotorClient(mongo, event_listeners=[db.pool_stats], **client_options())
+        await db.client.drop_database(database_name)
+        db.db = db.client[database_name]
+        await db.ensure_indexes()
+    db.connected = True
+    return db
+
+
+async def run_child(spec: dict) -> dict:
+    """
+    Serves the app with uvicorn on a local port and drives it over real HTTP
+    (the ASGI in-process transport buffers streamed responses).
+    """
+    import httpx
+    import uvicorn
+
+    database = await _connect_database(spec["mongo"], spec["database"])
+    mongo_client = database.client
+    from app.main import app
+
+    port = _free_port()
+    server = uvicorn.Server(uvicorn.Config(app, host="127.0.0.1", port=port, log_level="warning", lifespan="on"))
+    serving = asyncio.create_task(server.serve())
+    try:
+        while not server.started:
+            if serving.done():
+                serving.result()
+            await asyncio.sleep(0.05)
+        limits = httpx.Limits(max_connections=None, max_keepalive_connections=None)
+        async with httpx.AsyncClient(base_url=f"http://127.0.0.1:{port}", timeout=None, limits=limits) as client:
+            result = await WORKLOADS[spec["workload"]](client, spec)
+    finally:
+        server.should_exit = True
+        await serving
+        if spec["mongo"] != "memory":
+            await mongo_client.drop_database(spec["database"])
+    return {**result, "peak_rss_mib": peak_rss_mib()}
+
+
+# =============================================================================
+# ORCHESTRATION (parent process)
+# =============================================================================
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def _start_fake_openai(args, port: int) -> subprocess.Popen:
+    command = [
+        sys.executable, "-m", "benchmarks.fake_openai", "--port", str(port),
+        "--dimensions", str(args.dimensions),
+        "--embedding-latency-ms", str(args.embedding_latency_ms),
+        "--chat-latency-ms", str(args.chat_latency_ms),
+        "--token-latency-ms", str(args.token_latency_ms),
+        "--jitter", str(args.jitter),
+        "--answer-tokens", str(args.answer_tokens),
+    ]
+    process = subprocess.Popen(command)
+    deadline = time.monotonic() + 20
+    while time.monotonic() < deadline:
+        try:
+            with socket.create_connection(("127.0.0.1", port), timeout=0.2):
+                return process
+        except OSError:
+            if process.poll() is not None:
+                break
+            time.sleep(0.1)
+    process.kill()
+    raise SystemExit("Fake OpenAI server failed to start")
+
+
+def _specs(args) -> List[dict]:
+    common = {"mongo": args.mongo, "database": args.database}
+    specs = []
+    if "upload" in args.workloads:
+        specs += [{**common, "workload": "upload", "rows": rows, "repeat": args.upload_repeat} for rows in args.upload_rows]
+    if "context" in args.workloads:
+        specs += [{**common, "workload": "context", "rows": rows, "requests": args.context_requests,
+                   "concurrency": args.context_concurrency} for rows in args.context_rows]
+    if "chat" in args.workloads:
+        specs += [{**common, "workload": "chat", "rows": args.chat_rows, "sessions": sessions, "turns": args.chat_turns,
+                   "endpoint": args.chat_endpoint} for sessions in args.chat_sessions]
+    return specs
+
+
+# Fields that identify a workload run, for matching results against a baseline.
+_PARAM_KEYS = ("workload", "rows", "repeat", "requests", "concurrency", "sessions", "turns", "endpoint")
+
+
+def _spec_key(spec: dict) -> str:
+    return json.dumps({k: spec[k] for k in _PARAM_KEYS if k in spec}, sort_keys=True)
+
+
+def _run_spec(spec: dict, env: Dict[str, str]) -> dict:
+    label = ", ".join(f"{k}={v}" for k, v in spec.items() if k not in ("mongo", "database"))
+    print(f"running {label}", file=sys.stderr)
+    completed = subprocess.run(
+        [sys.executable, "-m", "benchmarks.bench_suite", "--child", json.dumps(spec)],
+        env=env, stdout=subprocess.PIPE, text=True,
+    )
+    params = {k: v for k, v in spec.items() if k not in ("mongo", "database")}
+    if completed.returncode != 0 or not completed.stdout.strip():
+        return {**params, "failed": True, "returncode": completed.returncode}
+    return {**params, **json.loads(completed.stdout.strip().splitlines()[-1])}
+
+
+def _compare(results: List[dict], baseline_path: str) -> None:
+    """ Adds `vs_baseline` ratios (current / baseline) for matching workloads. """
+    with open(baseline_path) as f:
+        baseline = {_spec_key(r): r for r in json.load(f)["results"] if not r.get("failed")}
+    for result in results:
+        before = baseline.get(_spec_key(result))
+        if before is None or result.get("failed"):
+            continue
+        ratios = {f"latency_{q}": result["latency_ms"][q] / before["latency_ms"][q]
+                  for q in ("p50", "p95", "p99") if before["latency_ms"][q]}
+        if before["throughput_rps"]:
+            ratios["throughput"] = result["throughput_rps"] / before["throughput_rps"]
+        if before["peak_rss_mib"]:
+            ratios["peak_rss"] = result["peak_rss_mib"] / before["peak_rss_mib"]
+        result["vs_baseline"] = {k: round(v, 3) for k, v in ratios.items()}
+
+
+def _git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except Exception:
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--child", help=argparse.SUPPRESS)
+    parser.add_argument("--workloads", nargs="+", choices=list(WORKLOADS), default=list(WORKLOADS))
+    parser.add_argument("--mongo", default="memory", help='"memory" or a mongodb:// URI of a local mongod')
+    parser.add_argument("--database", default="finchat_bench", help="Database used (and dropped) on a real mongod")
+    parser.add_argument("--upload-rows", type=int, nargs="+", default=[1000, 10000])
+    parser.add_argument("--upload-repeat", type=int, default=3)
+    parser.add_argument("--context-rows", type=int, nargs="+", default=[10000])
+    parser.add_argument("--context-requests", type=int, default=50)
+    parser.add_argument("--context-concurrency", type=int, default=4)
+    parser.add_argument("--chat-rows", type=int, default=5000, help="History size of each chat user")
+    parser.add_argument("--chat-sessions", type=int, nargs="+", default=[1, 8])
+    parser.add_argument("--chat-turns", type=int, default=5)
+    parser.add_argument("--chat-endpoint", choices=["message", "stream"], default="stream")
+    parser.add_argument("--embedding-backend", choices=["openai", "local"], default="openai",
+                        help="The app's EMBEDDING_BACKEND")
+    fake_openai.add_arguments(parser)
+    parser.add_argument("--output", help="Write the JSON results here instead of stdout")
+    parser.add_argument("--baseline", help="Earlier result file to compare against")
+    args = parser.parse_args()
+
+    if args.child:
+        print(json.dumps(asyncio.run(run_child(json.loads(args.child)))))
+        return
+
+    if args.mongo != "memory" and args.database == "finchat":
+        raise SystemExit("Refusing to benchmark against (and drop) the application database 'finchat'")
+
+    port = _free_port()
+    fake_server = _start_fake_openai(args, port)
+    workdir = tempfile.mkdtemp(prefix="finchat-bench-")
+    try:
+        results = []
+        for spec in _specs(args):
+            # Fresh on-disk caches per workload, so no run benefits from an earlier one.
+            run_dir = tempfile.mkdtemp(dir=workdir)
+            env = {
+                **os.environ,
+                "MONGO": args.mongo if args.mongo != "memory" else "mongodb://in-memory",
+                "OPENAI_BASE_URL": f"http://127.0.0.1:{port}/v1",
+                "OPENAI_API_KEY": "bench",
+                "LLM": "bench",
+                "EMBEDDING_BACKEND": args.embedding_backend,
+                "VECTOR_INDEX_DIR": os.path.join(run_dir, "vector_indexes"),
+                "EMBEDDING_CACHE_DIR": os.path.join(run_dir, "embedding_cache"),
+                "IMPORT_JOB_DIR": os.path.join(run_dir, "import_jobs"),
+            }
+            results.append(_run_spec(spec, env))
+    finally:
+        fake_server.terminate()
+        fake_server.wait()
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    if args.baseline:
+        _compare(results, args.baseline)
+    report = {
+        "meta": {
+            "commit": _git_commit(),
+            "timestamp": datetime.now().isoformat(timespec="seconds"),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpus": os.cpu_count(),
+            "mongo": "memory" if args.mongo == "memory" else "mongod",
+            "embedding_backend": args.embedding_backend,
+            "fake_openai": {
+                "dimensions": args.dimensions,
+                "embedding_latency_ms": args.embedding_latency_ms,
+                "chat_latency_ms": args.chat_latency_ms,
+                "token_latency_ms": args.token_latency_ms,
+                "jitter": args.jitter,
+            },
+        },
+        "results": results,
+    }
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output + "\n")
+    else:
+        print(output)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,179 @@
+"""
+Recall-vs-latency benchmark of the vector index types against exact search.
+
+For each corpus size, every index type (app.services.ann_index) is built and
+tuned as the app would, then measured on held-out queries:
+
+  build     - build + tuning seconds, and the setting tuning picked;
+  memory    - the app's estimate next to the serialized FAISS index size;
+  curve     - recall@k and median single-query latency for every candidate
+              setting (efSearch, or nprobe x k_factor), flat being the baseline;
+  filtered  - recall and latency through UserVectorIndex.search with a random
+              transaction subset (a structured pre-filter) of --filter-fraction.
+
+Vectors are fake_openai's hashed bag-of-words embeddings of generated bank
+descriptions (texts sharing words are close, as with the real model), or real
+embeddings from --vectors (a float32 .npy of shape rows x dim, queries taken
+from its tail). Recall counts a result as a hit when its exact score reaches
+the exact k-th best score, so repeated descriptions do not read as misses.
+
+    cd backend && python -m benchmarks.bench_vector_index --rows 20000 100000 --output ann.json
+    python -m benchmarks.bench_vector_index --rows 200000 --kinds flat ivfpq --target-recall 0.9
+"""
+import argparse
+import json
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+from typing import Dict, List
+
+import numpy as np
+
+from benchmarks import fake_openai
+from benchmarks.bench_suite import _git_commit
+
+_PREFIXES = ["POS", "DEBIT", "CHECKCARD", "ACH", "PURCHASE", "RECURRING", "ONLINE", ""]
+_SYLLABLES = ["ka", "lo", "mi", "ra", "ton", "ber", "sun", "vel", "co", "mar", "den", "fi", "gro", "star", "qua", "nex"]
+_SUFFIXES = ["MARKET", "CAFE", "STORE", "INC", "LLC", "PHARMACY", "GRILL", "FUEL", "SHOP", "ONLINE", "CO", ""]
+
+
+def make_descriptions(rows: int, seed: int) -> List[str]:
+    """ Bank-statement-like descriptions: Zipf-popular merchants with store numbers and places. """
+    rng = random.Random(seed)
+    names = random.Random(0)
+    merchants = [
+        " ".join("".join(names.choice(_SYLLABLES) for _ in range(names.randint(2, 3))).upper()
+                 for _ in range(names.randint(1, 2))) + " " + names.choice(_SUFFIXES)
+        for _ in range(3000)
+    ]
+    cities = ["".join(names.choice(_SYLLABLES) for _ in range(3)).upper() for _ in range(300)]
+    weights = [1 / (i + 1) for i in range(len(merchants))]
+    picked = rng.choices(merchants, weights=weights, k=rows)
+    return [
+        f"{rng.choice(_PREFIXES)} {merchant} #{rng.randrange(1, 2000)} {rng.choice(cities)} {rng.randrange(10, 60)}"
+        for merchant in picked
+    ]
+
+
+def make_vectors(rows: int, dim: int, seed: int) -> np.ndarray:
+    fake = fake_openai.FakeOpenAI(dimensions=dim, embedding_latency=0, chat_latency=0, token_latency=0,
+                                  jitter=0, answer_tokens=0)
+    return np.stack([fake.embed(text, dim) for text in make_descriptions(rows, seed)]).astype(np.float32)
+
+
+def _flat_curve(vectors: np.ndarray, queries: np.ndarray, k: int) -> dict:
+    import faiss
+
+    index = faiss.IndexFlatIP(vectors.shape[1])
+    index.add(vectors)
+    latencies = []
+    for query in queries:
+        started = time.perf_counter()
+        index.search(query.reshape(1, -1), k)
+        latencies.append(time.perf_counter() - started)
+    return {"recall": 1.0, "latency_ms": round(float(np.median(latencies)) * 1000, 3)}
+
+
+def _filtered(user_index, vectors: np.ndarray, queries: np.ndarray, k: int, fraction: float, seed: int) -> dict:
+    rng = np.random.default_rng(seed)
+    subset = np.sort(rng.choice(len(vectors), size=max(int(len(vectors) * fraction), k), replace=False))
+    ids = [str(i) for i in subset]
+    hits, latencies = 0, []
+    for query in queries:
+        exact = np.sort(vectors[subset] @ query)[::-1][k - 1]
+        started = time.perf_counter()
+        results = user_index.search(query.reshape(1, -1), k, ids)
+        latencies.append(time.perf_counter() - started)
+        positions = np.array([int(tid) for tid, _, _ in results], dtype=np.int64)
+        hits += int(np.count_nonzero(vectors[positions] @ query >= exact - 1e-3))
+    return {"fraction": fraction, "rows": int(subset.size), "recall": round(hits / (len(queries) * k), 4),
+            "latency_ms": round(float(np.median(latencies)) * 1000, 3)}
+
+
+def run(rows: int, vectors: np.ndarray, queries: np.ndarray, args) -> Dict[str, dict]:
+    import faiss
+
+    from app.services import ann_index, vector_store
+
+    k = args.k
+    exact_scores, _ = faiss.knn(queries, vectors, k, metric=faiss.METRIC_INNER_PRODUCT)
+    results = {}
+    for kind in args.kinds:
+        if kind == ann_index.FLAT:
+            results[kind] = {"memory_bytes": ann_index.estimate_bytes(kind, rows, vectors.shape[1]),
+                             "curve": [_flat_curve(vectors, queries, k)]}
+            continue
+        index, params = ann_index.build(kind, vectors)
+        user_index = vector_store.UserVectorIndex(f"bench-{kind}-{rows}", index, [str(i) for i in range(rows)],
+                                                  [""] * rows, params)
+        if kind == ann_index.IVFPQ:
+            user_index._store_vectors(0, vectors)
+        search_vectors = user_index._full_vectors() if kind == ann_index.IVFPQ else vectors
+        curve = []
+        for setting in ann_index.candidate_settings(params):
+            recall, latency_ms = ann_index.measure(index, {**params, **setting}, search_vectors, queries, k,
+                                                   exact_scores[:, -1])
+            curve.append({**setting, "recall": round(recall, 4), "latency_ms": round(latency_ms, 3)})
+        results[kind] = {
+            "build_seconds": params["build_seconds"],
+            "tuned": {key: value for key, value in params.items() if key not in ("kind", "built_rows", "build_seconds")},
+            "memory_bytes": user_index.memory_bytes,
+            "serialized_bytes": len(faiss.serialize_index(index)),
+            "disk_vector_bytes": os.path.getsize(user_index.vectors_path) if kind == ann_index.IVFPQ else 0,
+            "curve": curve,
+            "filtered": _filtered(user_index, vectors, queries, k, args.filter_fraction, rows),
+        }
+        print(f"{rows} {kind}: {results[kind]['tuned']}", file=sys.stderr)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, nargs="+", default=[20000, 100000])
+    parser.add_argument("--dim", type=int, default=1536)
+    parser.add_argument("--vectors", help="Real embeddings (.npy, rows x dim) instead of generated ones")
+    parser.add_argument("--queries", type=int, default=200, help="Held-out queries per corpus")
+    parser.add_argument("--k", type=int, default=20, help="Neighbours per query (the app's RETRIEVAL_MAX_K)")
+    parser.add_argument("--kinds", nargs="+", choices=["flat", "hnsw", "ivfpq"], default=["flat", "hnsw", "ivfpq"])
+    parser.add_argument("--target-recall", type=float, help="Overrides VECTOR_TARGET_RECALL for tuning")
+    parser.add_argument("--filter-fraction", type=float, default=0.2)
+    parser.add_argument("--output", help="Write the JSON results here instead of stdout")
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="finchat-ann-")
+    # Read by app.core.config, so set before the app modules are imported.
+    os.environ["VECTOR_INDEX_DIR"] = workdir
+    os.environ["RETRIEVAL_MAX_K"] = str(args.k)
+    if args.target_recall is not None:
+        os.environ["VECTOR_TARGET_RECALL"] = str(args.target_recall)
+
+    loaded = np.load(args.vectors).astype(np.float32) if args.vectors else None
+    report = {"meta": {"commit": _git_commit(), "dim": args.dim if loaded is None else loaded.shape[1],
+                       "vectors": args.vectors or "fake_openai", "k": args.k, "queries": args.queries,
+                       "cpus": os.cpu_count()},
+              "results": []}
+    try:
+        for rows in args.rows:
+            if loaded is not None:
+                rows = min(rows, len(loaded) - args.queries)
+                vectors, queries = loaded[:rows], loaded[-args.queries:]
+            else:
+                vectors = make_vectors(rows, args.dim, seed=rows)
+                queries = make_vectors(args.queries, args.dim, seed=rows + 1)
+            report["results"].append({"rows": rows, **run(rows, np.ascontiguousarray(vectors), queries, args)})
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output + "\n")
+    else:
+        print(output)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,216 @@
+"""
+Fake OpenAI-compatible HTTP server for benchmarks.
+
+Serves the two endpoints the app uses, with configurable latency and fully
+deterministic output, so runs are comparable across commits:
+
+  POST /v1/embeddings        - hashed bag-of-words vectors (texts sharing words
+                               are close), float lists or base64 float32.
+  POST /v1/chat/completions  - a fixed answer, streamed token by token when
+                               stream=true. Structured-output requests (LangChain
+                               categorization) get a category picked from the
+                               request's JSON schema enum by hashing the prompt.
+
+    cd backend && python -m benchmarks.fake_openai --port 8765 --chat-latency-ms 300
+
+Point the app at it with OPENAI_BASE_URL=http://127.0.0.1:8765/v1.
+"""
+import argparse
+import asyncio
+import base64
+import hashlib
+import json
+import random
+import re
+import time
+from typing import Dict, List, Optional
+
+import numpy as np
+import uvicorn
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+
+_TOKEN_RE = re.compile(r"[a-z0-9]+")
+_ANSWER = (
+    "Based on your recent transactions, most of your spending went to dining and groceries. "
+    "Your largest single expense was rent, and subscriptions add up to a steady monthly amount. "
+    "Consider setting a monthly limit on dining out and reviewing recurring charges you no longer use. "
+    "You are on track with your savings goal if you keep this month's pace."
+)
+
+
+def _stable_hash(text: str) -> int:
+    return int.from_bytes(hashlib.blake2b(text.encode("utf-8"), digest_size=8).digest(), "little")
+
+
+class FakeOpenAI:
+    def __init__(self, dimensions: int, embedding_latency: float, chat_latency: float, token_latency: float,
+                 jitter: float, answer_tokens: int):
+        self.dimensions = dimensions
+        self.embedding_latency = embedding_latency
+        self.chat_latency = chat_latency
+        self.token_latency = token_latency
+        self.jitter = jitter
+        self.answer_tokens = _ANSWER.split(" ")[:answer_tokens]
+        self._token_vectors: Dict[str, np.ndarray] = {}
+        self._random = random.Random(0)
+        self.requests = {"embeddings": 0, "embedded_texts": 0, "chat": 0, "structured": 0, "stream": 0}
+
+    async def _sleep(self, seconds: float) -> None:
+        if seconds > 0:
+            await asyncio.sleep(seconds * (1 + self._random.uniform(-self.jitter, self.jitter)))
+
+    def _token_vector(self, token: str) -> np.ndarray:
+        vector = self._token_vectors.get(token)
+        if vector is None:
+            vector = np.random.default_rng(_stable_hash(token)).standard_normal(self.dimensions).astype(np.float32)
+            self._token_vectors[token] = vector
+        return vector
+
+    def embed(self, text: str, dimensions: int) -> np.ndarray:
+        tokens = _TOKEN_RE.findall(text.lower()) or [text]
+        vector = np.sum([self._token_vector(t) for t in tokens], axis=0)[:dimensions]
+        return vector / (np.linalg.norm(vector) or 1.0)
+
+    @staticmethod
+    def _find_enum(schema) -> Optional[List[str]]:
+        if isinstance(schema, dict):
+            if isinstance(schema.get("enum"), list):
+                return schema["enum"]
+            children = schema.values()
+        elif isinstance(schema, list):
+            children = schema
+        else:
+            return None
+        for child in children:
+            found = FakeOpenAI._find_enum(child)
+            if found:
+                return found
+        return None
+
+    def structured_content(self, body: dict) -> Optional[str]:
+        """ JSON arguments for structured-output / tool-call requests, else None. """
+        schema = None
+        if body.get("response_format", {}).get("type") == "json_schema":
+            schema = body["response_format"]["json_schema"].get("schema")
+        elif body.get("tools"):
+            schema = body["tools"][0]["function"].get("parameters")
+        if schema is None:
+            return None
+        prompt = " ".join(str(m.get("content", "")) for m in body.get("messages", []))
+        choices = self._find_enum(schema) or ["Other"]
+        properties = schema.get("properties", {})
+        field = next(iter(properties), "category")
+        return json.dumps({field: choices[_stable_hash(prompt) % len(choices)]})
+
+
+def build_app(fake: FakeOpenAI) -> FastAPI:
+    app = FastAPI()
+
+    @app.get("/health")
+    async def health():
+        return fake.requests
+
+    @app.post("/v1/embeddings")
+    async def embeddings(request: Request):
+        body = await request.json()
+        texts = body["input"] if isinstance(body["input"], list) else [body["input"]]
+        dimensions = body.get("dimensions") or fake.dimensions
+        fake.requests["embeddings"] += 1
+        fake.requests["embedded_texts"] += len(texts)
+        await fake._sleep(fake.embedding_latency)
+        as_base64 = body.get("encoding_format") == "base64"
+        data = []
+        for i, text in enumerate(texts):
+            vector = fake.embed(str(text), dimensions)
+            embedding = base64.b64encode(vector.astype("<f4").tobytes()).decode("ascii") if as_base64 else vector.tolist()
+            data.append({"object": "embedding", "index": i, "embedding": embedding})
+        tokens = sum(len(str(t).split()) for t in texts)
+        return JSONResponse({
+            "object": "list", "data": data, "model": body.get("model", "fake"),
+            "usage": {"prompt_tokens": tokens, "total_tokens": tokens},
+        })
+
+    @app.post("/v1/chat/completions")
+    async def chat_completions(request: Request):
+        body = await request.json()
+        model = body.get("model", "fake")
+        created = int(time.time())
+        fake.requests["chat"] += 1
+        await fake._sleep(fake.chat_latency)
+
+        structured = fake.structured_content(body)
+        if structured is not None:
+            fake.requests["structured"] += 1
+            message = {"role": "assistant", "content": structured}
+            if body.get("tools"):
+                message = {"role": "assistant", "content": None, "tool_calls": [{
+                    "id": "call_0", "type": "function",
+                    "function": {"name": body["tools"][0]["function"]["name"], "arguments": structured},
+                }]}
+            return JSONResponse(_completion(model, created, message, "tool_calls" if body.get("tools") else "stop"))
+
+        if not body.get("stream"):
+            message = {"role": "assistant", "content": " ".join(fake.answer_tokens)}
+            return JSONResponse(_completion(model, created, message, "stop"))
+
+        fake.requests["stream"] += 1
+
+        async def events():
+            yield _chunk(model, created, {"role": "assistant", "content": ""})
+            for i, token in enumerate(fake.answer_tokens):
+                await fake._sleep(fake.token_latency)
+                yield _chunk(model, created, {"content": token if i == 0 else " " + token})
+            yield _chunk(model, created, {}, "stop")
+            yield "data: [DONE]\n\n"
+
+        return StreamingResponse(events(), media_type="text/event-stream")
+
+    return app
+
+
+def _completion(model: str, created: int, message: dict, finish_reason: str) -> dict:
+    return {
+        "id": "chatcmpl-bench", "object": "chat.completion", "created": created, "model": model,
+        "choices": [{"index": 0, "message": message, "finish_reason": finish_reason}],
+        "usage": {"prompt_tokens": 0, "completion_tokens": 0, "total_tokens": 0},
+    }
+
+
+def _chunk(model: str, created: int, delta: dict, finish_reason: Optional[str] = None) -> str:
+    payload = {
+        "id": "chatcmpl-bench", "object": "chat.completion.chunk", "created": created, "model": model,
+        "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}],
+    }
+    return f"data: {json.dumps(payload)}\n\n"
+
+
+def add_arguments(parser: argparse.ArgumentParser) -> None:
+    parser.add_argument("--dimensions", type=int, default=1536)
+    parser.add_argument("--embedding-latency-ms", type=float, default=50.0)
+    parser.add_argument("--chat-latency-ms", type=float, default=300.0, help="Latency before the first token / full reply")
+    parser.add_argument("--token-latency-ms", type=float, default=10.0, help="Delay between streamed tokens")
+    parser.add_argument("--jitter", type=float, default=0.0, help="Uniform +/- fraction applied to every delay")
+    parser.add_argument("--answer-tokens", type=int, default=60)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    add_arguments(parser)
+    args = parser.parse_args()
+
+    fake = FakeOpenAI(
+        dimensions=args.dimensions,
+        embedding_latency=args.embedding_latency_ms / 1000,
+        chat_latency=args.chat_latency_ms / 1000,
+        token_latency=args.token_latency_ms / 1000,
+        jitter=args.jitter,
+        answer_tokens=args.answer_tokens,
+    )
+    uvicorn.run(build_app(fake), host=args.host, port=args.port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
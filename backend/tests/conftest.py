@@ -0,0 +1,106 @@
+"""
+Behavior tests for the backend services.
+
+They run against an in-memory Mongo (mongomock-motor) with the local embedding
+backend, so they need no database, network or API key:
+
+    cd backend && pip install pytest mongomock-motor && python -m pytest tests
+
+Settings are read once, when app.core.config is imported, so the environment
+below is set before any app module is imported.
+"""
+import io
+import os
+import tempfile
+from datetime import date, timedelta
+from typing import List, Optional, Tuple
+
+import pytest
+
+pytest.importorskip("mongomock_motor")
+
+_SCRATCH = tempfile.mkdtemp(prefix="finchat-tests-")
+os.environ.update({
+    "MONGO": "mongodb://in-memory",
+    "OPENAI_API_KEY": "test",
+    "LLM": "test",
+    "EMBEDDING_BACKEND": "local",
+    "PROMPT_TOKENIZER": "estimate",
+    # Small chunks and batches, so a few hundred rows cover several of each.
+    "CSV_PARSE_MODE": "inline",
+    "CSV_CHUNK_SIZE": "200",
+    "IMPORT_BATCH_SIZE": "50",
+    "VECTOR_INDEX_DIR": os.path.join(_SCRATCH, "vector_indexes"),
+    "EMBEDDING_CACHE_DIR": os.path.join(_SCRATCH, "embedding_cache"),
+    "IMPORT_JOB_DIR": os.path.join(_SCRATCH, "import_jobs"),
+})
+
+from mongomock_motor import AsyncMongoMockClient  # noqa: E402
+
+from app.core.database import db  # noqa: E402
+from app.core.models import UserLoginRequest  # noqa: E402
+from app.services import ingestion, jobs, user_service, vector_store  # noqa: E402
+from benchmarks.bench_suite import _patch_mongomock_bulk_sort  # noqa: E402
+
+# Merchants with the category the CSV states for them, so imports never call the LLM.
+MERCHANTS = [
+    ("STARBUCKS #{n}", "Food & Drink"),
+    ("WHOLE FOODS MARKET {n}", "Groceries"),
+    ("SHELL OIL {n}", "Gas"),
+    ("AMAZON MKTPLACE {n}", "Shopping"),
+    ("NETFLIX.COM {n}", "Entertainment"),
+]
+
+
+@pytest.fixture
+def anyio_backend():
+    return "asyncio"
+
+
+@pytest.fixture
+async def database():
+    """ A fresh in-memory database behind the app's shared Database for each test. """
+    _patch_mongomock_bulk_sort()
+    db.client = AsyncMongoMockClient()
+    db.db = db.client["finchat_test"]
+    db.connected = True
+    yield db.db
+    await vector_store.drain_background(timeout=10.0)
+    db.client = db.db = None
+    db.connected = False
+
+
+async def create_user(clerk_id: str) -> None:
+    await user_service.get_or_create_user(UserLoginRequest(email=f"{clerk_id}@example.com", clerk_id=clerk_id))
+
+
+def csv_rows(start: int, stop: int) -> List[Tuple[date, str, float, str]]:
+    """ Rows start..stop-1 of one deterministic bank export: (date, description, amount, category). """
+    rows = []
+    for n in range(start, stop):
+        template, category = MERCHANTS[n % len(MERCHANTS)]
+        rows.append((date(2024, 1, 1) + timedelta(days=n // 3), template.format(n=n), -round(5 + n % 97 * 1.25, 2),
+                     category))
+    return rows
+
+
+def csv_file(rows: List[Tuple[date, str, float, str]]) -> io.BytesIO:
+    lines = ["Date,Description,Amount,Category"]
+    lines += [f"{when:%Y-%m-%d},{description},{amount:.2f},{category}" for when, description, amount, category in rows]
+    return io.BytesIO(("\n".join(lines) + "\n").encode("utf-8"))
+
+
+async def run_jobs(owner: str = "test-worker") -> None:
+    """ Runs queued jobs (retries included) on this task until the queue is empty. """
+    while True:
+        job = await jobs._claim(owner)
+        if job is None:
+            return
+        await jobs._run(job, owner)
+
+
+async def import_csv(clerk_id: str, rows: List[Tuple[date, str, float, str]]) -> Optional[dict]:
+    """ Uploads rows as a CSV import job, runs it and returns the finished job document. """
+    job = await ingestion.submit_csv_import(clerk_id, csv_file(rows))
+    await run_jobs()
+    return await jobs.get_job(job["job_id"])
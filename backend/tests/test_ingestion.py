@@ -0,0 +1,86 @@
+import pytest
+
+from app.services import jobs, user_service
+from tests.conftest import create_user, csv_rows, import_csv
+
+pytestmark = pytest.mark.anyio
+
+
+async def _stored(database, clerk_id: str) -> list:
+    return await database.transactions.find({"clerk_id": clerk_id}, {"_id": 0}).to_list(length=None)
+
+
+async def _rolled_up_count(database, clerk_id: str) -> int:
+    return sum([cell["count"] async for cell in database.spending_rollups.find({"clerk_id": clerk_id})])
+
+
+async def test_import_stores_every_row_once(database):
+    await create_user("alice")
+    rows = csv_rows(0, 450)
+
+    job = await import_csv("alice", rows)
+
+    assert job["status"] == jobs.SUCCEEDED
+    assert job["progress"]["rows_imported"] == 450
+    assert job["progress"]["rows_skipped"] == 0
+    stored = await _stored(database, "alice")
+    assert len(stored) == 450
+    assert len({t["fingerprint"] for t in stored}) == 450
+    assert await _rolled_up_count(database, "alice") == 450
+
+
+async def test_resume_after_a_mid_chunk_crash_imports_each_row_once(database, monkeypatch):
+    await create_user("bob")
+    rows = csv_rows(0, 450)
+    insert_unique = user_service._insert_unique
+    calls = {"n": 0}
+
+    async def dies_after_second_batch(clerk_id, batch):
+        # The second batch of the first chunk reaches Mongo, then the worker dies before
+        # the chunk's checkpoint and before the post-write hooks see that batch.
+        calls["n"] += 1
+        written = await insert_unique(clerk_id, batch)
+        if calls["n"] == 2:
+            raise RuntimeError("worker died")
+        return written
+
+    monkeypatch.setattr(user_service, "_insert_unique", dies_after_second_batch)
+
+    job = await import_csv("bob", rows)
+
+    assert job["status"] == jobs.SUCCEEDED
+    assert job["attempts"] == 2
+    stored = await _stored(database, "bob")
+    assert len(stored) == 450
+    assert len({t["fingerprint"] for t in stored}) == 450
+    assert job["progress"]["rows_imported"] + job["progress"]["rows_skipped"] == 450
+    # The batch whose hooks never ran is repaired when the job resumes over it.
+    assert await _rolled_up_count(database, "bob") == 450
+
+
+async def test_overlapping_upload_reports_skipped_rows(database):
+    await create_user("carol")
+    first = await import_csv("carol", csv_rows(0, 300))
+    second = await import_csv("carol", csv_rows(200, 500))
+
+    assert first["progress"]["rows_imported"] == 300
+    assert second["status"] == jobs.SUCCEEDED
+    assert second["progress"]["rows_imported"] == 200
+    assert second["progress"]["rows_skipped"] == 100
+    assert len(await _stored(database, "carol")) == 500
+    assert await _rolled_up_count(database, "carol") == 500
+
+
+async def test_identical_rows_in_one_file_stay_distinct_and_reupload_skips_them(database):
+    await create_user("dave")
+    rows = csv_rows(0, 10)
+    rows = rows + [rows[3], rows[3]]
+
+    first = await import_csv("dave", rows)
+    again = await import_csv("dave", rows)
+
+    assert first["progress"]["rows_imported"] == 12
+    assert again["status"] == jobs.SUCCEEDED
+    assert again["progress"]["rows_imported"] == 0
+    assert again["progress"]["rows_skipped"] == 12
+    assert len(await _stored(database, "dave")) == 12
@@ -0,0 +1,75 @@
+from datetime import datetime
+
+import pytest
+
+from app.api.v1.endpoints import chats
+from app.core.models import TransactionCreate
+from app.services import user_service, working_set
+from app.services.answer_cache import answer_cache
+from tests.conftest import create_user, csv_rows
+
+pytestmark = pytest.mark.anyio
+
+QUESTION = "how much did I spend on groceries"
+
+
+def _transactions(start: int, stop: int):
+    return [TransactionCreate(date=datetime.combine(when, datetime.min.time()), description=description,
+                              amount=amount, category=category)
+            for when, description, amount, category in csv_rows(start, stop)]
+
+
+async def _cache_an_answer(clerk_id: str) -> None:
+    cached, cache_key = await chats._lookup_cached_answer(clerk_id, QUESTION)
+    assert cached is None
+    answer_cache.store(clerk_id, *cache_key, "You spent 42.00 on groceries.", [], 1.0)
+    cached, _ = await chats._lookup_cached_answer(clerk_id, QUESTION)
+    assert cached is not None
+
+
+async def test_adding_transactions_invalidates_working_set_and_answers(database):
+    await create_user("erin")
+    await user_service.add_transactions_to_user("erin", _transactions(0, 20))
+    ws = await working_set.get_working_set("erin")
+    assert ws.columns.size == 20
+    assert await working_set.get_working_set("erin", load=False) is ws
+    await _cache_an_answer("erin")
+
+    await user_service.add_transactions_to_user("erin", _transactions(20, 25))
+
+    assert await working_set.get_working_set("erin", load=False) is None
+    assert (await working_set.get_working_set("erin")).columns.size == 25
+    cached, _ = await chats._lookup_cached_answer("erin", QUESTION)
+    assert cached is None
+
+
+async def test_recategorizing_invalidates_working_set_and_answers(database):
+    await create_user("frank")
+    await user_service.add_transactions_to_user("frank", _transactions(0, 10))
+    ws = await working_set.get_working_set("frank")
+    await _cache_an_answer("frank")
+    transaction_id = ws.columns.transaction_id(0)
+
+    await user_service.update_transaction_categories("frank", {transaction_id: "Bills"})
+    await user_service.on_transactions_recategorized("frank")
+
+    reloaded = await working_set.get_working_set("frank")
+    assert reloaded is not ws
+    assert reloaded.columns.category(reloaded.columns.transaction_id_list().index(transaction_id)) == "Bills"
+    cached, _ = await chats._lookup_cached_answer("frank", QUESTION)
+    assert cached is None
+
+
+async def test_a_write_for_one_user_keeps_other_users_cached(database):
+    await create_user("gina")
+    await create_user("hugo")
+    await user_service.add_transactions_to_user("gina", _transactions(0, 10))
+    await user_service.add_transactions_to_user("hugo", _transactions(0, 10))
+    hugo = await working_set.get_working_set("hugo")
+    await _cache_an_answer("hugo")
+
+    await user_service.add_transactions_to_user("gina", _transactions(10, 15))
+
+    assert await working_set.get_working_set("hugo", load=False) is hugo
+    cached, _ = await chats._lookup_cached_answer("hugo", QUESTION)
+    assert cached is not None
@@ -9,6 +9,47 @@ interface UploadResponse {
   imported_count: number;
 }
 
+// The upload endpoint queues a background import job (202) and returns its id.
+interface JobAccepted {
+  job_id: string;
+  status: string;
+}
+
+interface JobStatus {
+  status: 'queued' | 'running' | 'succeeded' | 'failed';
+  progress: {
+    rows_total: number | null;
+    rows_processed: number;
+    rows_imported: number;
+    rows_skipped: number;
+  };
+  eta_seconds: number | null;
+  error: string | null;
+}
+
+const JOB_POLL_INTERVAL_MS = 1000;
+// Stop waiting after this long; the import itself keeps running on the server.
+const JOB_TIMEOUT_MS = 15 * 60 * 1000;
+
+// Polls a background job until it succeeds or fails, or the timeout passes.
+const waitForJob = async (jobId: string): Promise<JobStatus> => {
+  const deadline = Date.now() + JOB_TIMEOUT_MS;
+  while (true) {
+    if (Date.now() > deadline) {
+      throw new Error("The import is taking longer than expected. It is still running; refresh in a few minutes to see your transactions.");
+    }
+    const response = await fetch(`${API_BASE_URL}/jobs/${jobId}`);
+    if (!response.ok) {
+      throw new Error(`Checking the import failed with status: ${response.status}`);
+    }
+    const job: JobStatus = await response.json();
+    if (job.status === 'succeeded' || job.status === 'failed') {
+      return job;
+    }
+    await new Promise((resolve) => setTimeout(resolve, JOB_POLL_INTERVAL_MS));
+  }
+};
+
 export const uploadTransactions = async (file: File, clerkId: string): Promise<UploadResponse> => {
   if (!file || !clerkId) {
     throw new Error("File and User ID are required.");
@@ -31,7 +72,11 @@ export const uploadTransactions = async (file: File, clerkId: string): Promise<U
     throw new Error(errorData.detail || `Upload failed with status: ${response.status}`);
   }
 
-  const data: UploadResponse = await response.json();
-  return data;
+  const accepted: JobAccepted = await response.json();
+  const job = await waitForJob(accepted.job_id);
+  if (job.status === 'failed') {
+    throw new Error(job.error || "Import failed.");
+  }
+  return { status: 'success', imported_count: job.progress.rows_imported };
 };
 
@@ -169,7 +169,7 @@ export const ChatPage: React.FC = () => {
           setContext(updatedContext);
       } catch (error) {
           console.error("Failed to upload file:", error);
-          setError("Failed to process the uploaded file. Please check the format.");
+          setError(error instanceof Error ? error.message : "Failed to process the uploaded file. Please check the format.");
       } finally {
           setIsSubmitting(false);
       }